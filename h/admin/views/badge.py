@@ -5,6 +5,7 @@ from pyramid.view import view_config
 from sqlalchemy.exc import IntegrityError
 
 from h import models
+from h.badge import blocklist
 from h.i18n import TranslationString as _
 
 
@@ -33,6 +34,8 @@ def badge_add(request):
         request.db.rollback()
         msg = _("{uri} is already blocked.").format(uri=uri)
         request.session.flash(msg, 'error')
+    else:
+        _invalidate_blocklist_after_commit(request)
 
     index = request.route_path('admin_badge')
     return httpexceptions.HTTPSeeOther(location=index)
@@ -45,10 +48,25 @@ def badge_add(request):
 def badge_remove(request):
     uri = request.params['remove']
     request.db.query(models.Blocklist).filter_by(uri=uri).delete()
+    _invalidate_blocklist_after_commit(request)
 
     index = request.route_path('admin_badge')
     return httpexceptions.HTTPSeeOther(location=index)
 
 
+def _invalidate_blocklist_after_commit(request):
+    """
+    Recompile the blocklist once the request's transaction has committed.
+
+    If it were recompiled straight away, it would be recompiled from the
+    blocklist as it was before the change.
+    """
+    def invalidate(success):
+        if success:
+            blocklist.BLOCKLIST.invalidate()
+
+    request.tm.get().addAfterCommitHook(invalidate)
+
+
 def includeme(config):
     config.scan(__name__)
@@ -105,7 +105,8 @@ def delete_user(request, user):
     user.groups = []
 
     query = _all_user_annotations_query(request, user)
-    annotations = es_helpers.scan(client=request.es.conn, query={'query': query})
+    annotations = es_helpers.scan(client=request.es.conn,
+                                  query={'query': query, '_source': False})
     for annotation in annotations:
         storage.delete_annotation(request.db, annotation['_id'])
 
@@ -19,3 +19,4 @@ def includeme(config):
                      factory='h.api.resources:AnnotationFactory',
                      traverse='/{id}')
     config.add_route('api.search', '/search')
+    config.add_route('api.export', '/export')
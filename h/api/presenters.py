@@ -6,6 +6,8 @@ Presenters for API data.
 import collections
 import copy
 
+from h.api.models.elastic import Annotation as ElasticAnnotation
+
 LINK_GENERATORS_KEY = 'h.api.presenters.link_generators'
 
 
@@ -27,16 +29,7 @@ class AnnotationBasePresenter(object):
     @property
     def links(self):
         """A dictionary of named hypermedia links for this annotation."""
-        # Named link generators are registered elsewhere in the code. See
-        # :py:func:`h.api.presenters.add_annotation_link_generator` for
-        # details.
-        link_generators = self.request.registry.get(LINK_GENERATORS_KEY, {})
-        out = {}
-        for name, generator in link_generators.items():
-            link = generator(self.request, self.annotation)
-            if link is not None:
-                out[name] = link
-        return out
+        return _links(self.request, self.annotation)
 
     @property
     def text(self):
@@ -132,6 +125,39 @@ class AnnotationSearchIndexPresenter(AnnotationBasePresenter):
         return _permissions(self.annotation)
 
 
+class AnnotationSearchHitJSONPresenter(object):
+
+    """
+    Present an annotation from the search index in the API's JSON format.
+
+    Annotations are stored in the search index as presented by
+    :py:class:`AnnotationSearchIndexPresenter`, which is the same as the JSON
+    format apart from the links and the index-only fields. So rather than
+    loading the stored annotation into a model object and presenting it again,
+    this reuses the stored fields and adds the links.
+    """
+
+    def __init__(self, request, source):
+        self.request = request
+        self.source = source
+
+    def asdict(self):
+        annotation = dict(self.source)
+
+        if not annotation.get('text'):
+            annotation['text'] = ''
+        if not annotation.get('tags'):
+            annotation['tags'] = []
+
+        annotation['target'] = [_without_scope(t)
+                                for t in annotation.get('target') or []]
+
+        # Link generators expect an annotation object.
+        annotation['links'] = _links(self.request, ElasticAnnotation(self.source))
+
+        return annotation
+
+
 class AnnotationJSONLDPresenter(AnnotationBasePresenter):
 
     """
@@ -268,6 +294,25 @@ def deep_merge_dict(a, b):
             a[k] = v
 
 
+def _links(request, annotation):
+    # Named link generators are registered elsewhere in the code. See
+    # :py:func:`h.api.presenters.add_annotation_link_generator` for details.
+    link_generators = request.registry.get(LINK_GENERATORS_KEY, {})
+    out = {}
+    for name, generator in link_generators.items():
+        link = generator(request, annotation)
+        if link is not None:
+            out[name] = link
+    return out
+
+
+def _without_scope(target):
+    if isinstance(target, dict) and 'scope' in target:
+        target = dict(target)
+        del target['scope']
+    return target
+
+
 def _json_link(request, annotation):
     return request.route_url('api.annotation', id=annotation.id)
 
@@ -1,40 +1,150 @@
 # -*- coding: utf-8 -*-
 
+import functools
+import logging
+import os
+import threading
+import time
+
 from pyramid.settings import asbool
 
+from h import realtime
+from h import stats
+from h.api import storage
+from h.api import uri
+from h.api.search.cache import SearchCache
 from h.api.search.client import Client
+from h.api.search.client import pool_stats
 from h.api.search.config import configure_index
+from h.api.search.core import count_by_uri
+from h.api.search.core import scan
 from h.api.search.core import search
+from h.api.search.core import CACHE_KEY
 from h.api.search.core import FILTERS_KEY
 from h.api.search.core import MATCHERS_KEY
 
-__all__ = ('search',)
+__all__ = ('count_by_uri', 'scan', 'search')
 
+log = logging.getLogger(__name__)
 
-def _get_client(settings):
-    """Return a client for the Elasticsearch index."""
-    host = settings['es.host']
-    index = settings['es.index']
-    kwargs = {}
-    kwargs['timeout'] = settings.get('es.client_timeout', 10)
+# The minimum number of seconds between reports of connection pool statistics
+POOL_STATS_INTERVAL = 10
 
-    if 'es.client_poolsize' in settings:
-        kwargs['maxsize'] = settings['es.client_poolsize']
+_pool_stats_reported = {'at': None}
 
-    return Client(host, index, **kwargs)
+# The process in which the search cache invalidator was last started
+_invalidator_started = {'pid': None}
+
+
+def _get_client(settings):
+    """Return a client for the Elasticsearch index."""
+    return Client(settings['es.host'],
+                  settings['es.index'],
+                  **_client_options(settings))
 
 
 def _legacy_get_client(settings):
     """Return a client for the legacy Elasticsearch index."""
-    host = settings['es.host']
-    index = settings['legacy.es.index']
+    return Client(settings['es.host'],
+                  settings['legacy.es.index'],
+                  **_client_options(settings))
+
+
+def _client_options(settings):
     kwargs = {}
     kwargs['timeout'] = settings.get('es.client_timeout', 10)
 
     if 'es.client_poolsize' in settings:
         kwargs['maxsize'] = settings['es.client_poolsize']
 
-    return Client(host, index, **kwargs)
+    if asbool(settings.get('es.client_sniff', False)):
+        kwargs['sniff_on_start'] = True
+        kwargs['sniff_on_connection_fail'] = True
+        kwargs['sniffer_timeout'] = settings.get('es.client_sniffer_timeout', 60)
+
+    return kwargs
+
+
+def report_pool_stats(settings):
+    """
+    Send statistics about the Elasticsearch connection pools to statsd.
+
+    Reports are sent at most once every `POOL_STATS_INTERVAL` seconds, so this
+    can be called as often as is convenient.
+    """
+    now = time.time()
+    last = _pool_stats_reported['at']
+    if last is not None and now - last < POOL_STATS_INTERVAL:
+        return
+    _pool_stats_reported['at'] = now
+
+    usage = pool_stats()
+    client = stats.get_client(settings).pipeline()
+    for name, value in usage.items():
+        client.gauge('es.pool.' + name, value)
+    if usage['requests']:
+        client.gauge('es.pool.reuse_ratio',
+                     1 - float(usage['connections_opened']) / usage['requests'])
+    client.send()
+
+
+def _report_pool_stats_after_request(event):
+    report_pool_stats(event.request.registry.settings)
+
+
+def _invalidate_search_cache(event):
+    """Invalidate cached search results which an annotation event affects."""
+    cache = event.request.registry.get(CACHE_KEY)
+    if cache is None:
+        return
+
+    if event.annotation_dict:
+        target_uri = event.annotation_dict.get('uri')
+    else:
+        annotation = storage.fetch_annotation(event.request.db,
+                                              event.annotation_id)
+        target_uri = annotation.target_uri if annotation is not None else None
+
+    _invalidate(cache, target_uri)
+
+
+def _invalidate_from_message(cache, message):
+    """Invalidate cached search results which an annotation message affects."""
+    _invalidate(cache, message.get('uri'))
+
+
+def _invalidate(cache, target_uri):
+    if target_uri is None:
+        # We don't know where the annotation is, so anything could be stale.
+        cache.clear()
+    else:
+        cache.invalidate(uri.normalize(target_uri))
+
+
+def _start_cache_invalidator(event):
+    """
+    Start invalidating the search cache on changes made by other processes.
+
+    Each process has its own cache, so each consumes the realtime annotation
+    messages in a thread of its own. The thread is started on the first
+    request in each process, as threads don't survive the forking of workers.
+    """
+    pid = os.getpid()
+    if _invalidator_started['pid'] == pid:
+        return
+    _invalidator_started['pid'] = pid
+
+    registry = event.request.registry
+    handler = functools.partial(_invalidate_from_message, registry[CACHE_KEY])
+    consumer = realtime.Consumer(
+        connection=realtime.get_connection(registry.settings),
+        routing_key='annotation',
+        handler=handler)
+    thread = threading.Thread(target=consumer.run,
+                              name='search-cache-invalidator')
+    thread.daemon = True
+    thread.start()
+    log.info('started search cache invalidator in process %d', pid)
 
 
 def includeme(config):
@@ -54,7 +164,7 @@ def includeme(config):
 
     # Add a property to all requests for easy access to the elasticsearch
     # client. This can be used for direct or bulk access without having to
-    # reread the settings.
+    # reread the settings. The clients share one connection pool per process.
     config.add_request_method(
         lambda r: _get_client(r.registry.settings),
         name='es',
@@ -69,6 +179,22 @@ def includeme(config):
         name='legacy_es',
         reify=True)
 
+    config.add_subscriber(_report_pool_stats_after_request,
+                          'pyramid.events.NewResponse')
+
+    # If configured, cache search results in memory for up to
+    # `h.search.cache_ttl` seconds. Changes made in this process invalidate
+    # the cache at once, and changes made in other processes as soon as their
+    # realtime messages arrive.
+    cache_size = int(settings.get('h.search.cache_size', 0))
+    if cache_size > 0:
+        ttl = float(settings.get('h.search.cache_ttl', 10))
+        config.registry[CACHE_KEY] = SearchCache(size=cache_size, ttl=ttl)
+        config.add_subscriber(_invalidate_search_cache,
+                              'h.api.events.AnnotationEvent')
+        config.add_subscriber(_start_cache_invalidator,
+                              'pyramid.events.NewRequest')
+
     # If requested, automatically configure the index
     if asbool(settings.get('h.search.autoconfig', False)):
         configure_index(_get_client(settings))
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""
+A cache of Elasticsearch search results.
+
+Every sidebar load of a popular page sends the same query to Elasticsearch.
+The :py:class:`SearchCache` keeps the results of recent queries in memory, so
+that repeated queries can be answered without a round trip.
+
+Results are cached under the full query body together with the requesting
+user's effective principals, so results are never shared between users with
+different permissions. Entries expire after a fixed time, and the least
+recently used entries are evicted when the cache is full.
+
+Entries are also invalidated when annotations change. Each entry is scoped by
+the normalized URIs its query is restricted to (if any), and a change to an
+annotation invalidates the entries scoped to the annotation's URI, as well as
+all entries for queries which aren't restricted to particular URIs.
+
+Annotation events are handled before Elasticsearch has indexed the change, so
+a search in between would cache stale results again. Results aren't cached in
+an invalidated scope until the entries' time to live has passed since the
+invalidation, by which time the change should have been indexed.
+
+The cache is per-process. Changes made through other processes are learned
+of from the realtime annotation messages (see
+:py:func:`h.api.search._start_cache_invalidator`), so entries are as stale as
+the message queue is slow. If the queue is unreachable, changes made through
+other processes are only reflected once the affected entries expire, after
+`h.search.cache_ttl` seconds at most. The cache is off unless
+`h.search.cache_size` is set.
+"""
+
+from collections import OrderedDict
+import json
+import threading
+import time
+
+# A sentinel scope for entries whose queries aren't restricted by URI
+UNSCOPED = object()
+
+# A sentinel scope for holding back entries of every scope
+_ALL = object()
+
+
+class SearchCache(object):
+
+    """
+    A size-bounded, time-limited cache of search results.
+
+    :param size: the maximum number of entries to hold
+    :param ttl: the number of seconds after which entries expire
+    """
+
+    def __init__(self, size, ttl, clock=time.time):
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+
+        # Map from key to `(expiry time, scopes, value)`, least recently used
+        # first
+        self._entries = OrderedDict()
+
+        # Map from scope to the set of keys of the entries with that scope
+        self._scopes = {}
+
+        # Map from scope to the time until which results in that scope aren't
+        # cached, earliest first
+        self._holds = OrderedDict()
+
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the value cached for `key`, or None."""
+        with self._lock:
+            try:
+                expires, scopes, value = self._entries.pop(key)
+            except KeyError:
+                return None
+            if expires <= self.clock():
+                self._unscope(key, scopes)
+                return None
+            self._entries[key] = (expires, scopes, value)
+            return value
+
+    def set(self, key, value, scopes=None):
+        """
+        Cache `value` under `key`.
+
+        :param scopes: the normalized URIs the query is restricted to, or None
+            if it isn't restricted by URI
+        """
+        scopes = frozenset(scopes) if scopes else frozenset([UNSCOPED])
+
+        with self._lock:
+            now = self.clock()
+            if self._held(scopes, now):
+                return
+
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._unscope(key, old[1])
+
+            while len(self._entries) >= self.size:
+                evicted, (_, evicted_scopes, _) = self._entries.popitem(last=False)
+                self._unscope(evicted, evicted_scopes)
+
+            self._entries[key] = (now + self.ttl, scopes, value)
+            for scope in scopes:
+                self._scopes.setdefault(scope, set()).add(key)
+
+    def invalidate(self, uri_normalized):
+        """
+        Invalidate entries which could include annotations on a URI.
+
+        This removes the entries scoped to `uri_normalized`, and all the
+        entries which aren't restricted by URI. Results in those scopes aren't
+        cached again until `ttl` seconds have passed.
+        """
+        with self._lock:
+            for scope in (uri_normalized, UNSCOPED):
+                for key in list(self._scopes.get(scope, ())):
+                    _, scopes, _ = self._entries.pop(key)
+                    self._unscope(key, scopes)
+                self._hold(scope)
+
+    def clear(self):
+        """Remove every entry, and don't cache anything for `ttl` seconds."""
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+            self._hold(_ALL)
+
+    def _hold(self, scope):
+        self._holds.pop(scope, None)
+        self._holds[scope] = self.clock() + self.ttl
+
+    def _held(self, scopes, now):
+        while self._holds:
+            scope = next(iter(self._holds))
+            if self._holds[scope] > now:
+                break
+            del self._holds[scope]
+        return _ALL in self._holds or any(s in self._holds for s in scopes)
+
+    def _unscope(self, key, scopes):
+        for scope in scopes:
+            keys = self._scopes.get(scope)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self._scopes[scope]
+
+
+def cache_key(index, body, principals):
+    """Return the cache key for a search with `body` by `principals`."""
+    return json.dumps([index, body, sorted(principals)], sort_keys=True)
+
+
+def query_scopes(body):
+    """
+    Return the normalized URIs a query built by `query.Builder` is limited to.
+
+    Returns None if the query isn't restricted to particular URIs.
+    """
+    filters = body.get('query', {}).get('filtered', {}).get('filter', {})
+    for f in filters.get('and', []):
+        terms = f.get('terms', {})
+        if 'target.scope' in terms:
+            return terms['target.scope']
+    return None
@@ -1,7 +1,17 @@
 # -*- coding: utf-8 -*-
 
+import os
+import threading
+
 import elasticsearch
 
+# The Elasticsearch connections shared by all the clients in this process,
+# keyed by process id and connection options. Connections must not be shared
+# with forked child processes (such as Celery workers), so each process
+# creates its own.
+_CONNECTIONS = {}
+_CONNECTIONS_LOCK = threading.Lock()
+
 
 class Client(object):
 
@@ -11,6 +21,10 @@ class Client(object):
     Holds a connection object, an index name, and an enumeration of document
     types stored in the index.
 
+    Clients created with the same host and options share a single
+    long-lived connection (and its pool of HTTP connections) for the life of
+    the process, so creating a client is cheap.
+
     :param host: Elasticsearch host URL
     :param index: index name
     """
@@ -22,6 +36,61 @@ class Client(object):
 
     def __init__(self, host, index, **kwargs):
         self.index = index
-        self.conn = elasticsearch.Elasticsearch([host],
-                                                verify_certs=True,
-                                                **kwargs)
+        self.conn = get_connection(host, **kwargs)
+
+
+def get_connection(host, **kwargs):
+    """
+    Return this process's `elasticsearch.Elasticsearch` for `host`.
+
+    The connection is created on first use and shared thereafter. Keyword
+    arguments are passed to `elasticsearch.Elasticsearch`, and a separate
+    connection is kept for each distinct set of arguments.
+    """
+    pid = os.getpid()
+    key = (pid, host, tuple(sorted(kwargs.items())))
+
+    with _CONNECTIONS_LOCK:
+        conn = _CONNECTIONS.get(key)
+        if conn is None:
+            # Forget any connections inherited from a parent process.
+            for k in [k for k in _CONNECTIONS if k[0] != pid]:
+                del _CONNECTIONS[k]
+            conn = _CONNECTIONS[key] = elasticsearch.Elasticsearch(
+                [host], verify_certs=True, **kwargs)
+        return conn
+
+
+def pool_stats():
+    """
+    Return usage statistics for this process's HTTP connection pools.
+
+    Returns a dict with the total number of pooled connections allowed
+    (`size`), the number currently checked out (`in_use`) and kept open
+    awaiting reuse (`idle`), and the number of connections opened and
+    requests made since the pools were created.
+    """
+    stats = {'size': 0,
+             'in_use': 0,
+             'idle': 0,
+             'connections_opened': 0,
+             'requests': 0}
+    pid = os.getpid()
+
+    with _CONNECTIONS_LOCK:
+        conns = [c for k, c in _CONNECTIONS.items() if k[0] == pid]
+
+    for conn in conns:
+        for connection in conn.transport.connection_pool.connections:
+            # Only urllib3-based connections are pooled.
+            pool = getattr(connection, 'pool', None)
+            if pool is None or pool.pool is None:
+                continue
+            slots = list(pool.pool.queue)
+            stats['size'] += pool.pool.maxsize
+            stats['in_use'] += pool.pool.maxsize - len(slots)
+            stats['idle'] += sum(1 for s in slots if s is not None)
+            stats['connections_opened'] += pool.num_connections
+            stats['requests'] += pool.num_requests
+
+    return stats
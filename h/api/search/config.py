@@ -236,6 +236,71 @@ def configure_index(client, index=None):
     _update_index_mappings(client.conn, index, mappings)
 
 
+def get_aliased_index(client):
+    """
+    Return the name of the index the client's index alias points to.
+
+    Returns None if the client's index name isn't an alias.
+    """
+    conn = client.conn
+    if not conn.indices.exists_alias(name=client.index):
+        return None
+
+    result = conn.indices.get_alias(name=client.index)
+    if len(result) > 1:
+        raise RuntimeError("We don't support aliases that point to multiple "
+                           "indices at the moment!")
+    return list(result.keys())[0]
+
+
+def update_aliased_index(client, new_target):
+    """
+    Point the client's index alias at the index named `new_target`.
+
+    The alias is moved from its previous index in a single atomic operation,
+    so searches never see a missing or partial index. If there is no index or
+    alias with the client's index name yet, the alias is created.
+
+    Raises RuntimeError if the client's index name is the name of a concrete
+    index rather than an alias: see :py:func:`check_aliasable`.
+
+    Returns the name of the index the alias previously pointed to, or None.
+    """
+    conn = client.conn
+    old_target = get_aliased_index(client)
+    if old_target is None:
+        check_aliasable(client)
+
+    actions = []
+    if old_target is not None:
+        actions.append({'remove': {'index': old_target, 'alias': client.index}})
+    actions.append({'add': {'index': new_target, 'alias': client.index}})
+    conn.indices.update_aliases(body={'actions': actions})
+
+    return old_target
+
+
+def check_aliasable(client):
+    """
+    Raise RuntimeError if the client's index name can't be made an alias.
+
+    An existing concrete index would have to be deleted before an alias with
+    the same name could be added. That can't be done atomically, and an
+    annotation indexed in between would create the index again, so this is
+    left to the operator.
+    """
+    if get_aliased_index(client) is not None:
+        return
+    if not client.conn.indices.exists(index=client.index):
+        return
+
+    message = ("{index} is an index, not an alias, so it can't be pointed at "
+               "a new index. To switch to an alias, reindex into a new index "
+               "with a different ELASTICSEARCH_INDEX alias name, point the "
+               "application at that alias, and then delete {index}.")
+    raise RuntimeError(message.format(index=client.index))
+
+
 def _ensure_icu_plugin(conn):
     """Ensure that the ICU analysis plugin is installed for ES."""
     # Pylint issue #258: https://bitbucket.org/logilab/pylint/issue/258
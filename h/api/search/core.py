@@ -1,15 +1,29 @@
 # -*- coding: utf-8 -*-
+import json
 import logging
 
+from elasticsearch import helpers
+
+from h.api import storage
 from h.api.search import query
+from h.api.search.cache import cache_key
+from h.api.search.cache import query_scopes
 
+CACHE_KEY = 'h.api.search.cache'
 FILTERS_KEY = 'h.api.search.filters'
 MATCHERS_KEY = 'h.api.search.matchers'
 
+# The number of replies returned per page by a search with separate replies
+REPLIES_LIMIT = 200
+
+# The number of annotations fetched from each shard per batch by `scan`
+SCAN_BATCH_SIZE = 100
+
 log = logging.getLogger(__name__)
 
 
-def search(request, params, private=True, separate_replies=False):
+def search(request, params, private=True, separate_replies=False,
+           use_cache=True, replies_cursor=None, source=None):
     """
     Search with the given params and return the matching annotations.
 
@@ -26,53 +40,296 @@ def search(request, params, private=True, separate_replies=False):
     :param separate_replies: Whether or not to include a "replies" key in the
         result containing a list of all replies to the annotations in the
         "rows" key. If this is True then the "rows" key will include only
-        top-level annotations, not replies.
+        top-level annotations, not replies. Searches by "uri" then fetch the
+        annotations and their replies in one round trip, unless there are
+        more than `REPLIES_LIMIT` replies on the URI, when the replies take a
+        second round trip (see :py:func:`_threaded_search`).
     :type private: bool
 
+    :param use_cache: whether results may be served from the search cache,
+        if it is enabled. Callers which must see the effects of changes made
+        through other processes immediately should pass False.
+    :type use_cache: bool
+
+    :param replies_cursor: the "replies_cursor" from a previous result, to
+        fetch the next page of replies
+    :type replies_cursor: str
+
+    :param source: the fields of the annotations in "rows" to return: None
+        for all of them, False for only their ids, or a list of field names
+    :type source: None, bool or list
+
     :returns: A dict with keys:
       "rows" (the list of matching annotations, as dicts)
       "total" (the number of matching annotations, an int)
-      "replies": (the list of all replies to the annotations in "rows", if
+      "replies": (the list of replies to the annotations in "rows", if
         separate_replies=True was passed)
+      "replies_cursor": (if there are more replies than were returned, a
+        cursor for fetching the next page of them)
+      "next_cursor": (if the "cursor" parameter was given and there may be
+        more results, the "cursor" parameter for the next page)
     :rtype: dict
     """
     builder = default_querybuilder(request, private=private)
+    builder.source = source
     if separate_replies:
         builder.append_filter(query.TopLevelAnnotationsFilter())
+    body = builder.build(params)
 
-    es = request.es
-    results = es.conn.search(index=es.index,
-                             doc_type=es.t.annotation,
-                             body=builder.build(params))
-    total = results['hits']['total']
-    docs = results['hits']['hits']
-    rows = [dict(d['_source'], id=d['_id']) for d in docs]
-    return_value = {"rows": rows, "total": total}
+    if separate_replies and 'uri' in params and replies_cursor is None:
+        return _threaded_search(request, params, body, private, use_cache)
+
+    results = _search(request, body, use_cache)
+    return_value = _rows(results)
+    _add_next_cursor(return_value, results, params, body)
 
     if separate_replies:
         # Do a second query for all replies to the annotations from the first
         # query.
-        builder = default_querybuilder(request, private=private)
-        builder.append_matcher(query.RepliesMatcher(
-            [h['_id'] for h in results['hits']['hits']]))
-        reply_results = es.conn.search(index=es.index,
-                                       doc_type=es.t.annotation,
-                                       body=builder.build({'limit': 200}))
+        _add_replies(request, return_value, private, use_cache,
+                     replies_cursor)
 
-        if len(reply_results['hits']['hits']) < reply_results['hits']['total']:
-            log.warn("The number of reply annotations exceeded the page size "
-                     "of the Elasticsearch query. We currently don't handle "
-                     "this, our search API doesn't support pagination of the "
-                     "reply set.")
+    return return_value
+
+
+def scan(request, params, private=True):
+    """
+    Return an iterator over all the annotations matching the given params.
 
-        reply_docs = reply_results['hits']['hits']
-        reply_rows = [dict(d['_source'], id=d['_id']) for d in reply_docs]
+    Unlike :py:func:`search`, this returns every matching annotation, rather
+    than one page of them, in no particular order. The annotations are fetched
+    from Elasticsearch in batches with a scrolled search as the iterator is
+    consumed.
 
-        return_value["replies"] = reply_rows
+    :param request: the request object
+    :type request: pyramid.request.Request
+
+    :param params: the search parameters
+    :type params: dict-like
+
+    :param private: whether or not to include private annotations
+    :type private: bool
+
+    :returns: an iterator of the matching annotations, as dicts
+    """
+    # The query is built now, rather than when iteration starts, as building
+    # it may use the database session, which may have been closed by the time
+    # a streamed response is iterated.
+    builder = default_querybuilder(request, private=private)
+    body = builder.build(params)
+
+    es = request.es
+    hits = helpers.scan(es.conn,
+                        query={'query': body['query']},
+                        index=es.index,
+                        doc_type=es.t.annotation,
+                        size=SCAN_BATCH_SIZE)
+    return (dict(hit['_source'], id=hit['_id']) for hit in hits)
+
+
+def _threaded_search(request, params, body, private, use_cache):
+    """
+    Search for top-level annotations and their replies in one request.
+
+    The replies query can't depend on the results of the top-level query if
+    both are to be sent at once. Instead it selects the replies on the same
+    URIs as the top-level query (replies are made on the same pages as their
+    parents), and the replies to annotations other than those in the results
+    are then discarded.
+
+    That is only exact if all the replies on the URIs fit in one page of
+    `REPLIES_LIMIT` replies. If there are more, the page is discarded and the
+    replies to the annotations in the results are searched for by their ids,
+    as for any other search, at the cost of a second round trip.
+
+    Replies whose URI isn't one of those searched for (which clients don't
+    create, as they reply on their parent's page) aren't found by the replies
+    query, and can't be told apart from there being no such replies, so they
+    are left out of the results rather than triggering the second round trip.
+    """
+    reply_params = params.copy()
+    for key in set(reply_params.keys()) - set(['uri']):
+        del reply_params[key]
+    reply_params.update({'limit': REPLIES_LIMIT,
+                         'sort': 'updated',
+                         'order': 'asc'})
+
+    builder = default_querybuilder(request, private=private)
+    builder.append_filter(query.RepliesFilter())
+    reply_body = builder.build(reply_params)
+
+    results, reply_results = _msearch(request, [body, reply_body], use_cache)
+    return_value = _rows(results)
+    _add_next_cursor(return_value, results, params, body)
+
+    if len(reply_results['hits']['hits']) < reply_results['hits']['total']:
+        _add_replies(request, return_value, private, use_cache, None)
+        return return_value
+
+    ids = set(row['id'] for row in return_value['rows'])
+    return_value['replies'] = [
+        row for row in _rows(reply_results)['rows']
+        if ids.intersection(row.get('references', []))]
 
     return return_value
 
 
+def _add_replies(request, return_value, private, use_cache, replies_cursor):
+    """Add a page of the replies to the annotations in the results."""
+    offset = _replies_offset(replies_cursor)
+    builder = default_querybuilder(request, private=private)
+    builder.append_matcher(query.RepliesMatcher(
+        [row['id'] for row in return_value['rows']]))
+    reply_results = _search(request,
+                            builder.build({'limit': REPLIES_LIMIT,
+                                           'offset': offset}),
+                            use_cache)
+
+    return_value['replies'] = _rows(reply_results)['rows']
+    _add_replies_cursor(return_value, reply_results, offset)
+
+
+def _rows(results):
+    docs = results['hits']['hits']
+    # Hits have no `_source` if the query didn't select any fields.
+    rows = [dict(d.get('_source', {}), id=d['_id']) for d in docs]
+    return {"rows": rows, "total": results['hits']['total']}
+
+
+def _add_next_cursor(return_value, results, params, body):
+    """Add a cursor for the next page of results, for a cursor search."""
+    if 'cursor' not in params:
+        return
+    docs = results['hits']['hits']
+    if not docs or len(docs) < body['size']:
+        return
+    sort_values = docs[-1].get('sort')
+    if not sort_values or None in sort_values:
+        return
+    return_value['next_cursor'] = query.encode_cursor(sort_values)
+
+
+def _replies_offset(cursor):
+    try:
+        offset = int(cursor)
+    except (TypeError, ValueError):
+        return 0
+    return max(offset, 0)
+
+
+def _add_replies_cursor(return_value, reply_results, offset):
+    """Add a cursor for the next page of replies, if there are more."""
+    end = offset + len(reply_results['hits']['hits'])
+    if end < reply_results['hits']['total']:
+        return_value['replies_cursor'] = str(end)
+
+
+def count_by_uri(request, uris, private=True):
+    """
+    Return the number of annotations on each of the given URIs.
+
+    This gives the same numbers as searching with each URI in turn, but
+    expands all of the URIs with one database query, and counts the
+    annotations with one Elasticsearch multi-search request.
+
+    :param request: the request object
+    :type request: pyramid.request.Request
+
+    :param uris: the URIs to count annotations on
+    :type uris: list of str
+
+    :param private: whether or not to count private annotations
+    :type private: bool
+
+    :returns: a dict mapping each of `uris` to the number of annotations
+    :rtype: dict
+    """
+    uris = list(uris)
+    if not uris:
+        return {}
+
+    expanded = storage.expand_uris(request.db, uris)
+
+    bodies = []
+    for uri in uris:
+        builder = default_querybuilder(request, private=private)
+        builder.append_filter(query.ScopeFilter(expanded[uri]))
+        bodies.append(builder.build({'limit': 0}))
+
+    results = _msearch(request, bodies, use_cache=False)
+    return {uri: result['hits']['total'] for uri, result in zip(uris, results)}
+
+
+def _search(request, body, use_cache):
+    """Run the search query `body`, using the search cache if possible."""
+    es = request.es
+    cache = request.registry.get(CACHE_KEY) if use_cache else None
+    if cache is None:
+        return es.conn.search(index=es.index,
+                              doc_type=es.t.annotation,
+                              body=body)
+
+    key = cache_key(es.index, body, request.effective_principals)
+    cached = cache.get(key)
+    if cached is not None:
+        request.stats.incr('search.cache.hit')
+        return json.loads(cached)
+
+    request.stats.incr('search.cache.miss')
+    results = es.conn.search(index=es.index,
+                             doc_type=es.t.annotation,
+                             body=body)
+    # The results are stored serialized, so that callers can't modify the
+    # cached copy.
+    cache.set(key, json.dumps(results), scopes=query_scopes(body))
+    return results
+
+
+def _msearch(request, bodies, use_cache):
+    """
+    Run the search queries `bodies` in one multi-search request.
+
+    Queries whose results are in the search cache are answered from the
+    cache, and the others are sent to Elasticsearch together.
+    """
+    es = request.es
+    cache = request.registry.get(CACHE_KEY) if use_cache else None
+    results = [None] * len(bodies)
+    keys = [None] * len(bodies)
+
+    if cache is not None:
+        for i, body in enumerate(bodies):
+            keys[i] = cache_key(es.index, body, request.effective_principals)
+            cached = cache.get(keys[i])
+            if cached is None:
+                request.stats.incr('search.cache.miss')
+            else:
+                request.stats.incr('search.cache.hit')
+                results[i] = json.loads(cached)
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    if not missing:
+        return results
+
+    msearch_body = []
+    for i in missing:
+        msearch_body.extend([{}, bodies[i]])
+    responses = es.conn.msearch(index=es.index,
+                                doc_type=es.t.annotation,
+                                body=msearch_body)['responses']
+
+    for i, response in zip(missing, responses):
+        if 'error' in response:
+            raise RuntimeError('Elasticsearch search failed: '
+                               '{}'.format(response['error']))
+        results[i] = response
+        if cache is not None:
+            cache.set(keys[i], json.dumps(response),
+                      scopes=query_scopes(bodies[i]))
+
+    return results
+
+
 def default_querybuilder(request, private=True):
     builder = query.Builder()
     builder.append_filter(query.AuthFilter(request, private=private))
@@ -3,24 +3,53 @@
 
 from __future__ import unicode_literals
 from collections import namedtuple
+import contextlib
+import copy
+import datetime
 import itertools
+import json
 import logging
-from h.api._compat import xrange
+import math
+import os
+import time
 
 import elasticsearch
 from elasticsearch import helpers as es_helpers
+import sqlalchemy as sa
 from sqlalchemy.orm import subqueryload
 
 from h.api import models
 from h.api import presenters
 from h.api.events import AnnotationTransformEvent
+from h.api.search.config import configure_index
+from h.api.search.config import check_aliasable
+from h.api.search.config import update_aliased_index
 
 
 log = logging.getLogger(__name__)
 
+# When reindexing into a new index, annotations updated up to this long
+# before the reindex started are indexed again after the alias is swapped,
+# to catch changes whose transactions were still open when it started.
+REPLAY_MARGIN = datetime.timedelta(minutes=5)
 
-class Window(namedtuple('Window', ['start', 'end'])):
-    pass
+# The number of annotations, and the maximum size in bytes, of each bulk
+# request sent when reindexing, and when bulk loading.
+CHUNK_SIZE = 100
+MAX_CHUNK_BYTES = 100 * 1024 * 1024
+BULK_LOAD_CHUNK_SIZE = 1000
+BULK_LOAD_MAX_CHUNK_BYTES = 15 * 1024 * 1024
+
+# The refresh interval of indices which don't set one
+DEFAULT_REFRESH_INTERVAL = '1s'
+
+
+class Partition(namedtuple('Partition', ['start', 'end'])):
+    """
+    A range of annotation ids, from `start` up to but not including `end`.
+
+    An `end` of None means the range is unbounded.
+    """
 
 
 def index(es, annotation, request):
@@ -78,25 +107,313 @@ def delete(es, annotation_id):
                       'search index, annotation id: %s', annotation_id)
 
 
-def reindex(session, es, request):
-    indexing = BatchIndexer(session, es, request)
-    indexing.index_all()
+def sync(session, es, request, actions):
+    """
+    Index and delete many annotations with a single bulk request.
+
+    All of the annotations to be indexed are loaded from the database in one
+    query. Annotations which no longer exist in the database are skipped, and
+    deleting an annotation which isn't in the search index is not an error.
+
+    :param actions: a mapping of annotation ids to the action to take for
+        each, either ``'index'`` or ``'delete'``
+    :type actions: dict
+
+    :returns: a set of the ids whose actions failed
+    :rtype: set
+    """
+    if not actions:
+        return set()
+
+    ids = [id_ for id_, action in actions.items() if action == 'index']
+    annotations = {}
+    if ids:
+        query = BatchIndexer(session, es, request).eager_loaded_query()
+        annotations = {a.id: a
+                       for a in query.filter(models.Annotation.id.in_(ids))}
+
+    def _actions():
+        for id_, action in actions.items():
+            if action == 'delete':
+                yield {'_op_type': 'delete',
+                       '_index': es.index,
+                       '_type': es.t.annotation,
+                       '_id': id_}
+            elif id_ in annotations:
+                annotation_dict = presenters.AnnotationSearchIndexPresenter(
+                    request, annotations[id_]).asdict()
+
+                event = AnnotationTransformEvent(request, annotation_dict)
+                request.registry.notify(event)
+
+                yield {'_op_type': 'index',
+                       '_index': es.index,
+                       '_type': es.t.annotation,
+                       '_id': id_,
+                       '_source': annotation_dict}
+
+    results = es_helpers.streaming_bulk(es.conn, _actions(),
+                                        chunk_size=500,
+                                        raise_on_error=False)
+    errored = set()
+    for ok, item in results:
+        op_type, result = item.popitem()
+        if not ok and not (op_type == 'delete' and result['status'] == 404):
+            errored.add(result['_id'])
+    return errored
+
+
+def reindex(session, es, request, bulk_load=False):
+    indexing = BatchIndexer(session, es, request, bulk_load=bulk_load)
+    if bulk_load:
+        with bulk_loading(es):
+            indexing.index_all()
+    else:
+        indexing.index_all()
 
     deleting = BatchDeleter(session, es)
     deleting.delete_all()
 
 
+@contextlib.contextmanager
+def bulk_loading(es, index=None, original=None):
+    """
+    Tune an index for loading many annotations during a ``with`` block.
+
+    Refreshing the index and replicating to replica shards are turned off
+    until the block exits. The index's original settings are then restored
+    and the index refreshed, whether or not the block succeeded.
+
+    :param index: the index (or alias) to tune, defaults to the client's
+    :param original: the settings to restore, as returned by
+        :py:func:`_tuned_settings`, defaults to the index's current settings
+    """
+    if index is None:
+        index = es.index
+
+    if original is None:
+        original = _tuned_settings(es, index)
+
+    try:
+        for name in original:
+            es.conn.indices.put_settings(index=name, body={
+                'index': {'refresh_interval': '-1', 'number_of_replicas': 0},
+            })
+        yield
+    finally:
+        for name, settings in original.items():
+            es.conn.indices.put_settings(index=name, body={'index': settings})
+        es.conn.indices.refresh(index=index)
+
+
+def _tuned_settings(es, index=None):
+    """Return the settings of an index which bulk loading changes."""
+    if index is None:
+        index = es.index
+
+    result = {}
+    for name, settings in es.conn.indices.get_settings(index=index).items():
+        current = settings['settings']['index']
+        result[name] = {
+            'refresh_interval': current.get('refresh_interval',
+                                            DEFAULT_REFRESH_INTERVAL),
+            'number_of_replicas': current['number_of_replicas'],
+        }
+    return result
+
+
+def reindex_into_new_index(session, es, request, checkpoint, bulk_load=False):
+    """
+    Reindex all annotations into a new index, and point the alias at it.
+
+    The new index is named after the `es.index` alias and the current time,
+    and configured with the current mappings. Once all the annotations have
+    been loaded into it, the alias is moved to it in one atomic operation,
+    so searches keep using the old index until then.
+
+    Annotations created or updated while the new index was loading, and
+    which so were only indexed into the old index, are indexed again into
+    the new one, and annotations deleted in the meantime are removed.
+
+    Progress is saved to `checkpoint` after each page of annotations, so an
+    interrupted reindex continues where it stopped when run again.
+
+    Raises RuntimeError before loading anything if `es.index` is the name of
+    a concrete index rather than an alias.
+
+    :param checkpoint: where to save progress
+    :type checkpoint: Checkpoint
+
+    :param bulk_load: whether to tune the new index for bulk loading until
+        all the annotations have been loaded into it
+    :type bulk_load: bool
+
+    :returns: the names of the new index and of the index the alias
+        previously pointed to (or None)
+    :rtype: tuple
+    """
+    check_aliasable(es)
+
+    state = checkpoint.load()
+    if (state is None or state['alias'] != es.index or
+            not es.conn.indices.exists(index=state['index'])):
+        started = datetime.datetime.utcnow()
+        state = {'alias': es.index,
+                 'index': '{}-{}'.format(es.index,
+                                         started.strftime('%Y%m%d%H%M%S')),
+                 'started': started,
+                 'position': None}
+        configure_index(es, index=state['index'])
+        checkpoint.save(state)
+    else:
+        log.info('Resuming reindex into %s', state['index'])
+
+    # A client for the new index, sharing the connection.
+    target = copy.copy(es)
+    target.index = state['index']
+    indexer = BatchIndexer(session, target, request, bulk_load=bulk_load)
+
+    if bulk_load:
+        # The settings to restore are saved before they are changed, so that
+        # if the load is interrupted, resuming it doesn't restore the bulk
+        # loading settings instead.
+        if state.get('settings') is None:
+            state['settings'] = _tuned_settings(target)
+            checkpoint.save(state)
+        with bulk_loading(target, original=state['settings']):
+            _load(indexer, state, checkpoint)
+    else:
+        _load(indexer, state, checkpoint)
+
+    old_index = update_aliased_index(es, state['index'])
+
+    # The new index is live: catch up with changes made during the load.
+    replay_from = (state['started'] - REPLAY_MARGIN, None)
+    for page in indexer.pages(after=replay_from):
+        errored = indexer.index_annotations(page)
+        if errored:
+            log.warning('Failed to index %d annotations into %s',
+                        len(errored), state['index'])
+
+    BatchDeleter(session, target).delete_all()
+
+    checkpoint.clear()
+    return (state['index'], old_index)
+
+
+def _load(indexer, state, checkpoint):
+    for page in indexer.pages(after=state['position']):
+        errored = indexer.index_annotations(page)
+        if errored:
+            errored = indexer.index(errored)
+        if errored:
+            log.warning('Failed to index %d annotations into %s',
+                        len(errored), state['index'])
+
+        state['position'] = (page[-1].updated, page[-1].id)
+        checkpoint.save(state)
+
+
+class Checkpoint(object):
+    """
+    The progress of a reindex into a new index, saved as JSON in a file.
+
+    :param path: the path of the checkpoint file
+    """
+
+    TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """Return the saved reindex state, or None if there isn't any."""
+        if not os.path.exists(self.path):
+            return None
+
+        with open(self.path) as f:
+            state = json.load(f)
+
+        state['started'] = self._parse(state['started'])
+        if state['position'] is not None:
+            updated, id_ = state['position']
+            state['position'] = (self._parse(updated), id_)
+        return state
+
+    def save(self, state):
+        """Save the reindex state, replacing any previously saved."""
+        data = dict(state)
+        data['started'] = data['started'].strftime(self.TIMESTAMP_FORMAT)
+        if data['position'] is not None:
+            updated, id_ = data['position']
+            data['position'] = [updated.strftime(self.TIMESTAMP_FORMAT), id_]
+
+        # Write to a temporary file and rename it over the checkpoint, so an
+        # interruption never leaves a partially written checkpoint.
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp, self.path)
+
+    def clear(self):
+        """Remove the saved reindex state."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _parse(self, timestamp):
+        return datetime.datetime.strptime(timestamp, self.TIMESTAMP_FORMAT)
+
+
+def partitions(session, count):
+    """
+    Split the annotations into disjoint ranges of ids of similar sizes.
+
+    :param count: the maximum number of partitions to return
+    :type count: int
+
+    :returns: a list of partitions which together cover every annotation id
+    :rtype: list of :py:class:`Partition`
+    """
+    total = session.query(sa.func.count(models.Annotation.id)).scalar()
+    if not total:
+        return [Partition(start=None, end=None)]
+
+    size = int(math.ceil(total / float(count)))
+    row_number = sa.func.row_number().over(order_by=models.Annotation.id)
+    numbered = session.query(models.Annotation.id.label('id'),
+                             row_number.label('row_number')).subquery()
+    starts = [id_ for (id_,) in session.query(numbered.c.id).
+              filter((numbered.c.row_number - 1) % size == 0).
+              order_by(numbered.c.id)]
+
+    # The first partition starts with the smallest id, so leave it unbounded
+    # below, and each partition ends where the next one starts.
+    starts[0] = None
+    ends = starts[1:] + [None]
+    return [Partition(start=s, end=e) for s, e in zip(starts, ends)]
+
+
 class BatchIndexer(object):
     """
     A convenience class for reindexing all annotations from the database to
     the search index.
+
+    With `bulk_load`, annotations are sent in larger bulk requests, to suit
+    an index tuned by :py:func:`bulk_loading`.
     """
 
-    def __init__(self, session, es_client, request):
+    def __init__(self, session, es_client, request, bulk_load=False):
         self.session = session
         self.es_client = es_client
         self.request = request
 
+        if bulk_load:
+            self.chunk_size = BULK_LOAD_CHUNK_SIZE
+            self.max_chunk_bytes = BULK_LOAD_MAX_CHUNK_BYTES
+        else:
+            self.chunk_size = CHUNK_SIZE
+            self.max_chunk_bytes = MAX_CHUNK_BYTES
+
     def index_all(self):
         """Reindex all annotations, and retry failed indexing operations once."""
 
@@ -124,15 +441,55 @@ class BatchIndexer(object):
         else:
             annotations = self._stream_filtered_annotations(annotation_ids)
 
-        indexing = es_helpers.streaming_bulk(self.es_client.conn, annotations,
-                                             chunk_size=100,
-                                             raise_on_error=False,
-                                             expand_action_callback=self._prepare)
+        return self.index_annotations(annotations)
+
+    def index_partition(self, partition):
+        """
+        Index the annotations in a partition, and retry failed ones once.
+
+        :param partition: the range of annotation ids to index
+        :type partition: Partition
+
+        :returns: the number of annotations indexed, and a set of the ids
+            which failed to index
+        :rtype: tuple
+        """
+        annotations = self._stream_partition_annotations(partition)
+
+        count = 0
         errored = set()
-        for ok, item in indexing:
+        for ok, item in self._bulk(annotations):
+            count += 1
             if not ok:
                 errored.add(item['index']['_id'])
-        return errored
+
+        if errored:
+            errored = self.index(errored)
+        return (count - len(errored), errored)
+
+    def _bulk(self, annotations):
+        # Send the annotations to streaming_bulk a chunk at a time, so that
+        # the indexing throughput of each chunk can be logged.
+        annotations = iter(annotations)
+        while True:
+            chunk = list(itertools.islice(annotations, self.chunk_size))
+            if not chunk:
+                break
+
+            started = time.time()
+            results = list(es_helpers.streaming_bulk(
+                self.es_client.conn, chunk,
+                chunk_size=self.chunk_size,
+                max_chunk_bytes=self.max_chunk_bytes,
+                raise_on_error=False,
+                expand_action_callback=self._prepare))
+            elapsed = time.time() - started
+
+            log.info('Indexed %d annotations in %.3fs (%.1f annotations/s)',
+                     len(chunk), elapsed, len(chunk) / elapsed if elapsed else 0)
+
+            for result in results:
+                yield result
 
     def _prepare(self, annotation):
         action = {'index': {'_index': self.es_client.index,
@@ -142,36 +499,90 @@ class BatchIndexer(object):
 
         return (action, data)
 
+    def index_annotations(self, annotations):
+        """
+        Index the given annotations.
+
+        :param annotations: the annotations to index
+        :type annotations: iterable of h.api.models.Annotation
+
+        :returns: a set of errored ids
+        :rtype: set
+        """
+        errored = set()
+        for ok, item in self._bulk(annotations):
+            if not ok:
+                errored.add(item['index']['_id'])
+        return errored
+
+    def pages(self, after=None, chunksize=2000, partition=None):
+        """
+        Load all annotations a page at a time, ordered by `updated` and `id`.
+
+        Each page starts after the last annotation of the previous one, so
+        memory use doesn't grow with the number of annotations, and every
+        annotation is loaded exactly once, even when several share the same
+        `updated` timestamp. Each page eagerloads its document data.
+
+        :param after: an `(updated, id)` position to start after, or an
+            `(updated, None)` position to start at the first annotation
+            updated at or after `updated`
+        :type after: tuple
+
+        :param partition: if given, only load the annotations in this range of
+            ids
+        :type partition: h.api.search.index.Partition
+
+        :returns: an iterator of lists of annotations
+        """
+        updated = models.Annotation.updated
+        id_ = models.Annotation.id
+        basequery = self.eager_loaded_query().order_by(updated.asc(), id_.asc())
+
+        if partition is not None and partition.start is not None:
+            basequery = basequery.filter(id_ >= partition.start)
+        if partition is not None and partition.end is not None:
+            basequery = basequery.filter(id_ < partition.end)
+
+        while True:
+            query = basequery
+            if after is not None:
+                # The leading `updated >=` condition lets the query use the
+                # index on `updated`.
+                query = query.filter(updated >= after[0])
+                if after[1] is not None:
+                    query = query.filter(sa.or_(updated > after[0],
+                                                id_ > after[1]))
+
+            page = query.limit(chunksize).all()
+            if page:
+                yield page
+
+            if len(page) < chunksize:
+                break
+
+            after = (page[-1].updated, page[-1].id)
+
     def _stream_all_annotations(self, chunksize=2000):
-        # This is using a windowed query for loading all annotations in batches.
-        # It is the most performant way of loading a big set of records from
-        # the database while still supporting eagerloading of associated
-        # document data.
-
-        updated = self.session.query(models.Annotation.updated). \
-                execution_options(stream_results=True). \
-                order_by(models.Annotation.updated.desc()).all()
-
-        count = len(updated)
-        windows = [Window(start=updated[min(x+chunksize, count)-1].updated,
-                          end=updated[x].updated)
-                   for x in xrange(0, count, chunksize)]
-        basequery = self._eager_loaded_query().order_by(models.Annotation.updated.asc())
-
-        for window in windows:
-            in_window = models.Annotation.updated.between(window.start, window.end)
-            for a in basequery.filter(in_window):
+        for page in self.pages(chunksize=chunksize):
+            for a in page:
                 yield a
 
     def _stream_filtered_annotations(self, annotation_ids):
-        annotations = self._eager_loaded_query(). \
+        annotations = self.eager_loaded_query(). \
             execution_options(stream_results=True). \
             filter(models.Annotation.id.in_(annotation_ids))
 
         for a in annotations:
             yield a
 
-    def _eager_loaded_query(self):
+    def _stream_partition_annotations(self, partition, chunksize=2000):
+        for page in self.pages(chunksize=chunksize, partition=partition):
+            for a in page:
+                yield a
+
+    def eager_loaded_query(self):
+        """Return a query for annotations which eagerloads their documents."""
         return self.session.query(models.Annotation).options(
             subqueryload(models.Annotation.document).subqueryload(models.Document.document_uris),
             subqueryload(models.Annotation.document).subqueryload(models.Document.meta)
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
+import base64
+import json
+
 from h.api import storage
 from h.api import uri
+from h.api.schemas import ValidationError
 
 LIMIT_DEFAULT = 20
 LIMIT_MAX = 200
@@ -10,11 +14,16 @@ class Builder(object):
 
     """
     Build a query for execution in Elasticsearch.
+
+    The `source` attribute selects the fields of the matching annotations
+    which are returned. It is None to return all of them, False to return only
+    their ids, or a list of fields (which may contain wildcards) to return.
     """
 
     def __init__(self):
         self.filters = []
         self.matchers = []
+        self.source = None
 
     def append_filter(self, f):
         self.filters.append(f)
@@ -26,6 +35,7 @@ class Builder(object):
         """Get the resulting query object from this query builder."""
         params = params.copy()
 
+        p_cursor = extract_cursor(params)
         p_from = extract_offset(params)
         p_size = extract_limit(params)
         p_sort = extract_sort(params)
@@ -35,6 +45,15 @@ class Builder(object):
         filters = [f for f in filters if f is not None]
         matchers = [m for m in matchers if m is not None]
 
+        if p_cursor is not None:
+            # Pages are selected by the sort values of the last result of the
+            # previous page rather than by offset, with the annotation id
+            # breaking ties between annotations with the same sort values.
+            p_from = 0
+            p_sort.append({"_uid": {"order": _sort_order(p_sort)}})
+            if p_cursor:
+                filters.append(cursor_filter(p_sort, p_cursor))
+
         # Remaining parameters are added as straightforward key-value matchers
         for key, value in params.items():
             matchers.append({"match": {key: value}})
@@ -52,13 +71,70 @@ class Builder(object):
                 }
             }
 
-        return {
+        body = {
             "from": p_from,
             "size": p_size,
             "sort": p_sort,
             "query": query,
         }
 
+        if self.source is not None:
+            body["_source"] = self.source
+
+        return body
+
+
+def extract_cursor(params):
+    """
+    Return the sort values encoded in the `cursor` parameter.
+
+    Returns None if there is no `cursor` parameter, and an empty list if the
+    cursor is empty, which selects the first page of results.
+
+    :raises ValidationError: if the cursor isn't one returned by a search
+    """
+    if "cursor" not in params:
+        return None
+    cursor = params.pop("cursor")
+    if not cursor:
+        return []
+    try:
+        values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError, UnicodeError):
+        values = None
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValidationError("cursor: 'cursor' is not a valid cursor")
+    return values
+
+
+def encode_cursor(sort_values):
+    """Return a `cursor` parameter for the page after a result."""
+    return base64.urlsafe_b64encode(json.dumps(sort_values))
+
+
+def cursor_filter(sort, cursor):
+    """
+    Return a filter selecting the results after `cursor` in the `sort` order.
+
+    Elasticsearch 1.x doesn't support `search_after`, so this is the
+    equivalent filter: results which sort after the cursor's value of the
+    sort field, or which have the same value and a later id.
+    """
+    field = sort[0].keys()[0]
+    value, uid = cursor
+    op = "gt" if _sort_order(sort) == "asc" else "lt"
+    return {"or": [
+        {"range": {field: {op: value}}},
+        {"and": [
+            {"term": {field: value}},
+            {"range": {"_uid": {op: uid}}},
+        ]},
+    ]}
+
+
+def _sort_order(sort):
+    return sort[0].values()[0]["order"]
+
 
 def extract_offset(params):
     try:
@@ -100,6 +176,14 @@ class TopLevelAnnotationsFilter(object):
         return {'missing': {'field': 'references'}}
 
 
+class RepliesFilter(object):
+
+    """Matches replies only, filters out top-level annotations."""
+
+    def __call__(self, _):
+        return {'exists': {'field': 'references'}}
+
+
 class AuthFilter(object):
 
     """
@@ -184,6 +268,22 @@ class UriFilter(object):
         return {"terms": {"target.scope": list(uris)}}
 
 
+class ScopeFilter(object):
+
+    """
+    A filter that selects only annotations on any of a given list of URIs.
+
+    Unlike :py:class:`UriFilter`, the URIs aren't expanded to the other URIs
+    of the same documents, so callers should expand them in advance.
+    """
+
+    def __init__(self, uris):
+        self.uris = uris
+
+    def __call__(self, params):
+        return {"terms": {"target.scope": [uri.normalize(u) for u in self.uris]}}
+
+
 class AnyMatcher(object):
 
     """
@@ -13,6 +13,7 @@ from sqlalchemy.orm import subqueryload
 from h.api import schemas
 from h.api import models
 from h.api.db import types
+from h.api.uri import normalize as normalize_uri
 
 
 _ = i18n.TranslationStringFactory(__package__)
@@ -173,7 +174,11 @@ def delete_annotation(session, id_):
     :param id_: the annotation ID
     :type id_: str
     """
-    session.query(models.Annotation).filter_by(id=id_).delete()
+    # The annotation is deleted through the session, rather than with a bulk
+    # delete query, so that flush event listeners see the deletion.
+    annotation = session.query(models.Annotation).get(id_)
+    if annotation is not None:
+        session.delete(annotation)
 
 
 def expand_uri(session, uri):
@@ -207,3 +212,45 @@ def expand_uri(session, uri):
             return [uri]
 
     return [docuri.uri for docuri in docuris]
+
+
+def expand_uris(session, uris):
+    """
+    Return the URIs which refer to the same documents as each of `uris`.
+
+    This is equivalent to calling :py:func:`expand_uri` for each URI, but
+    looks up the documents for all of the URIs in one query.
+
+    :param session: the database session
+    :type session: sqlalchemy.orm.session.Session
+
+    :param uris: URIs associated with documents
+    :type uris: list of str
+
+    :returns: a dict mapping each of `uris` to a list of equivalent URIs
+    :rtype: dict
+    """
+    uris = list(uris)
+    if not uris:
+        return {}
+
+    documents = (models.Document.find_by_uris(session, uris)
+                 .options(subqueryload(models.Document.document_uris))
+                 .all())
+
+    result = {}
+    for uri in uris:
+        uri_normalized = normalize_uri(uri)
+        matching = [doc for doc in documents
+                    if any(docuri.uri_normalized == uri_normalized
+                           for docuri in doc.document_uris)]
+        docuris = [docuri for doc in matching for docuri in doc.document_uris]
+
+        if not docuris or any(docuri.uri == uri and
+                              docuri.type == 'rel-canonical'
+                              for docuri in docuris):
+            result[uri] = [uri]
+        else:
+            result[uri] = [docuri.uri for docuri in docuris]
+
+    return result
@@ -16,6 +16,8 @@ particular, requests to the CRUD API endpoints are protected by the Pyramid
 authorization system. You can find the mapping between annotation "permissions"
 objects and Pyramid ACLs in :mod:`h.api.resources`.
 """
+import json
+
 from pyramid import i18n
 from pyramid import security
 from pyramid.view import view_config
@@ -24,12 +26,17 @@ from h.api import cors
 from h.api.events import AnnotationEvent
 from h.api.presenters import AnnotationJSONPresenter
 from h.api.presenters import AnnotationJSONLDPresenter
+from h.api.presenters import AnnotationSearchHitJSONPresenter
 from h.api import search as search_lib
 from h.api import schemas
 from h.api import storage
 
 _ = i18n.TranslationStringFactory(__package__)
 
+# The default offset beyond which paging search results by offset, rather than
+# with a cursor, is discouraged
+OFFSET_WARNING_DEPTH = 1000
+
 cors_policy = cors.policy(
     allow_headers=(
         'Authorization',
@@ -124,6 +131,11 @@ def index(context, request):
                 'url': request.route_url('api.search'),
                 'desc': 'Basic search API'
             },
+            'export': {
+                'method': 'GET',
+                'url': request.route_url('api.export'),
+                'desc': 'Export all annotations matching a search'
+            },
         }
     }
 
@@ -134,9 +146,12 @@ def search(request):
     params = request.params.copy()
 
     separate_replies = params.pop('_separate_replies', False)
+    replies_cursor = params.pop('_replies_cursor', None)
+    _discourage_deep_offsets(request, params)
     out = search_lib.search(request,
                             params,
-                            separate_replies=separate_replies)
+                            separate_replies=separate_replies,
+                            replies_cursor=replies_cursor)
 
     # Run the results through the JSON presenter
     out['rows'] = [_present_searchdict(request, a)
@@ -148,6 +163,45 @@ def search(request):
     return out
 
 
+@api_config(route_name='api.export', request_method='GET', accept=None)
+def export(request):
+    """
+    Stream all the annotations matching the given query.
+
+    The annotations are returned as newline-delimited JSON, one annotation per
+    line, in no particular order. They are read from the search index in
+    batches as the response is sent, rather than all at once, so exports of
+    any size can be made in one request.
+    """
+    params = request.params.copy()
+    rows = search_lib.scan(request, params)
+
+    response = request.response
+    response.content_type = 'application/x-ndjson'
+    response.app_iter = _ndjson(request, rows)
+    return response
+
+
+def _ndjson(request, rows):
+    for row in rows:
+        yield json.dumps(_present_searchdict(request, row)) + '\n'
+
+
+def _discourage_deep_offsets(request, params):
+    """Warn clients paging deep into search results by offset."""
+    settings = request.registry.settings
+    depth = int(settings.get('h.search.offset_warning_depth',
+                             OFFSET_WARNING_DEPTH))
+    try:
+        offset = int(params.get('offset', 0))
+    except ValueError:
+        return
+    if offset > depth and 'cursor' not in params:
+        request.response.headers['Warning'] = (
+            '299 - "Paging by offset beyond {} results is deprecated, use '
+            'the cursor parameter instead"'.format(depth))
+
+
 @api_config(route_name='api.annotations',
             request_method='POST',
             effective_principals=security.Authenticated)
@@ -236,8 +290,7 @@ def _json_payload(request):
 
 def _present_searchdict(request, mapping):
     """Run an object returned from search through a presenter."""
-    ann = storage.annotation_from_dict(mapping)
-    return AnnotationJSONPresenter(request, ann).asdict()
+    return AnnotationSearchHitJSONPresenter(request, mapping).asdict()
 
 
 def _publish_annotation_event(request,
@@ -2,4 +2,6 @@
 
 
 def includeme(config):
+    config.include('.blocklist')
+    config.include('.counts')
     config.include('.views')
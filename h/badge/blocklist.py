@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""
+An in-memory matcher for the badge blocklist.
+
+Checking a URI against the `blocklist` table with `LIKE` can't use an index,
+so it scans the whole table, and the badge API does this for every page a
+browser extension user visits. Instead, each process compiles the blocklist
+patterns into a single regular expression, and checks URIs against that.
+
+To pick up changes made by other processes, the compiled blocklist is checked
+against a version stamp from the database at most once every
+`h.badge.blocklist_refresh_interval` seconds, and recompiled if the blocklist
+has changed. Changes made through the admin pages in this process are picked
+up immediately.
+"""
+
+import re
+import threading
+import time
+
+import sqlalchemy as sa
+
+from h.badge.models import Blocklist
+
+DEFAULT_REFRESH_INTERVAL = 60
+
+
+class Matcher(object):
+
+    """
+    Matches URIs against a list of SQL `LIKE` patterns.
+
+    A URI matches if any pattern would match it with PostgreSQL's `LIKE`
+    operator: `%` matches any sequence of characters, `_` matches any single
+    character, and a backslash escapes the following character.
+    """
+
+    def __init__(self, patterns):
+        patterns = list(patterns)
+        if patterns:
+            regex = '(?:{})\\Z'.format('|'.join(_translate(p) for p in patterns))
+            self._regex = re.compile(regex, re.DOTALL | re.UNICODE)
+        else:
+            self._regex = None
+
+    def matches(self, uri):
+        if self._regex is None:
+            return False
+        return self._regex.match(uri) is not None
+
+
+class BlocklistCache(object):
+
+    """
+    A per-process cache of the compiled blocklist.
+
+    :param interval: the number of seconds between checks for changes to the
+        blocklist
+    """
+
+    def __init__(self, interval=DEFAULT_REFRESH_INTERVAL, clock=time.time):
+        self.interval = interval
+        self.clock = clock
+
+        self._matcher = Matcher([])
+        self._version = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def is_blocked(self, session, uri):
+        """Return True if the given URI is blocked."""
+        checked = self._checked
+        if checked is None or self.clock() - checked >= self.interval:
+            self.refresh(session)
+        return self._matcher.matches(uri)
+
+    def refresh(self, session):
+        """Recompile the blocklist if it has changed since it was compiled."""
+        with self._lock:
+            # Blocklist ids are never reused, so adding an entry always
+            # increases the maximum id, and removing entries always decreases
+            # the count.
+            version = session.query(sa.func.count(Blocklist.id),
+                                    sa.func.max(Blocklist.id)).one()
+            version = tuple(version)
+            if version != self._version:
+                patterns = [uri for (uri,) in session.query(Blocklist.uri)]
+                self._matcher = Matcher(patterns)
+                self._version = version
+            self._checked = self.clock()
+
+    def invalidate(self):
+        """Check for changes to the blocklist on the next lookup."""
+        self._checked = None
+
+
+BLOCKLIST = BlocklistCache()
+
+
+def _translate(pattern):
+    """Translate a SQL `LIKE` pattern into a regular expression."""
+    result = []
+    escaped = False
+    for char in pattern:
+        if escaped:
+            result.append(re.escape(char))
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '%':
+            result.append('.*')
+        elif char == '_':
+            result.append('.')
+        else:
+            result.append(re.escape(char))
+    if escaped:
+        result.append(re.escape('\\'))
+    return ''.join(result)
+
+
+def includeme(config):
+    settings = config.registry.settings
+
+    if 'h.badge.blocklist_refresh_interval' in settings:
+        BLOCKLIST.interval = int(settings['h.badge.blocklist_refresh_interval'])
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+"""
+Maintenance of the per-URI counts of public annotations.
+
+The counts in the `public_annotation_count` table are kept up to date as
+annotations are flushed to the database, in the same transaction, so they
+reflect annotations being created, deleted, shared, unshared, moved between
+groups, and moved to new URIs (as by the `move-uri` command).
+
+As in search results, the annotations of NIPSA'd users aren't counted, and
+their counts are adjusted when users are flagged or unflagged.
+
+The counts are only maintained while the `h.badge.precomputed_counts` setting
+is on. :py:func:`rebuild` recomputes all the counts from the annotations
+table, as is needed when turning the setting on.
+"""
+
+from collections import Counter
+
+from pyramid.settings import asbool
+import sqlalchemy as sa
+
+from h import db
+from h.api.models import Annotation
+from h.nipsa.models import NipsaUser
+
+PUBLIC_GROUP = '__world__'
+
+_INCREMENT = sa.text("""
+    INSERT INTO public_annotation_count (uri_normalized, total)
+    VALUES (:uri_normalized, :delta)
+    ON CONFLICT (uri_normalized) DO UPDATE
+    SET total = public_annotation_count.total + excluded.total
+""")
+
+_REBUILD = sa.text("""
+    INSERT INTO public_annotation_count (uri_normalized, total)
+    SELECT target_uri_normalized, count(*)
+    FROM annotation
+    WHERE shared AND groupid = :groupid AND target_uri_normalized IS NOT NULL
+    AND userid NOT IN (SELECT userid FROM nipsa)
+    GROUP BY target_uri_normalized
+""")
+
+_ADJUST_USER = sa.text("""
+    INSERT INTO public_annotation_count (uri_normalized, total)
+    SELECT target_uri_normalized, :sign * count(*)
+    FROM annotation
+    WHERE shared AND groupid = :groupid AND target_uri_normalized IS NOT NULL
+    AND userid = :userid
+    GROUP BY target_uri_normalized
+    ON CONFLICT (uri_normalized) DO UPDATE
+    SET total = public_annotation_count.total + excluded.total
+""")
+
+
+def update_counts(session, flush_context):
+    """
+    Update the counts for the annotations and NIPSA flags in a flush.
+
+    This is a SQLAlchemy `after_flush` session event listener.
+    """
+    # Map from `(uri_normalized, userid)` to the change in the count
+    deltas = Counter()
+
+    for obj in session.new:
+        if isinstance(obj, Annotation):
+            deltas[(_public_uri(obj), obj.userid)] += 1
+
+    for obj in session.deleted:
+        if isinstance(obj, Annotation):
+            deltas[(_public_uri(obj, previous=True), obj.userid)] -= 1
+
+    for obj in session.dirty:
+        if isinstance(obj, Annotation):
+            deltas[(_public_uri(obj, previous=True), obj.userid)] -= 1
+            deltas[(_public_uri(obj), obj.userid)] += 1
+
+    flagged = set(o.userid for o in session.new if isinstance(o, NipsaUser))
+    unflagged = set(o.userid for o in session.deleted
+                    if isinstance(o, NipsaUser))
+
+    # The changes to the annotations of users who were NIPSA'd before this
+    # flush aren't counted. The counts for users flagged or unflagged in this
+    # flush are then adjusted by all their annotations, as they now are.
+    userids = set(userid for _, userid in deltas) - flagged - unflagged
+    nipsad = unflagged.union(_nipsad(session, userids))
+
+    totals = Counter()
+    for (uri_normalized, userid), delta in deltas.items():
+        if uri_normalized is not None and userid not in nipsad:
+            totals[uri_normalized] += delta
+
+    for uri_normalized, delta in sorted(totals.items()):
+        if delta:
+            session.execute(_INCREMENT, {'uri_normalized': uri_normalized,
+                                         'delta': delta})
+
+    for changed, sign in ((flagged, -1), (unflagged, 1)):
+        for userid in sorted(changed):
+            session.execute(_ADJUST_USER, {'userid': userid,
+                                           'sign': sign,
+                                           'groupid': PUBLIC_GROUP})
+
+
+def rebuild(session):
+    """
+    Recompute the counts of public annotations from the annotations table.
+
+    Returns the number of URIs with public annotations.
+    """
+    session.execute('DELETE FROM public_annotation_count')
+    result = session.execute(_REBUILD, {'groupid': PUBLIC_GROUP})
+    return result.rowcount
+
+
+def _nipsad(session, userids):
+    """Return the NIPSA'd userids among `userids`."""
+    if not userids:
+        return set()
+    query = session.query(NipsaUser.userid). \
+        filter(NipsaUser.userid.in_(userids))
+    return set(userid for (userid,) in query)
+
+
+def _public_uri(annotation, previous=False):
+    """
+    Return the normalized URI of `annotation` if it is public, else None.
+
+    If `previous` is True, this is computed from the values the annotation
+    had before the current flush.
+    """
+    def value(key):
+        if previous:
+            history = sa.inspect(annotation).attrs[key].history
+            if history.deleted:
+                return history.deleted[0]
+        return getattr(annotation, key)
+
+    if not value('shared') or value('groupid') != PUBLIC_GROUP:
+        return None
+    return value('_target_uri_normalized')
+
+
+def includeme(config):
+    settings = config.registry.settings
+    if not asbool(settings.get('h.badge.precomputed_counts', False)):
+        return
+
+    if not sa.event.contains(db.Session, 'after_flush', update_counts):
+        sa.event.listen(db.Session, 'after_flush', update_counts)
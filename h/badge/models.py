@@ -24,6 +24,51 @@ class Blocklist(Base):
 
     @classmethod
     def is_blocked(cls, session, uri):
-        """Return True if the given URI is blocked."""
+        """Return True if the given URI is blocked.
+
+        This queries the database. The badge API uses the compiled blocklist
+        in :py:mod:`h.badge.blocklist` instead.
+
+        """
         uri_matches = expression.literal(uri).like(cls.uri)
         return session.query(cls).filter(uri_matches).count() > 0
+
+
+class PublicAnnotationCount(Base):
+
+    """The number of public annotations on each (normalized) URI.
+
+    These counts are maintained by :py:mod:`h.badge.counts` as annotations are
+    created, modified and deleted, so that the badge API can answer without
+    searching.
+
+    """
+
+    __tablename__ = 'public_annotation_count'
+
+    uri_normalized = sa.Column(sa.UnicodeText(), primary_key=True)
+    total = sa.Column(sa.Integer(),
+                      nullable=False,
+                      default=0,
+                      server_default='0')
+
+    def __repr__(self):
+        return '<PublicAnnotationCount {}: {}>'.format(self.uri_normalized,
+                                                       self.total)
+
+    @classmethod
+    def get(cls, session, uri_normalized):
+        """Return the number of public annotations on the given URI."""
+        count = session.query(cls).get(uri_normalized)
+        if count is None:
+            return 0
+        return count.total
+
+    @classmethod
+    def get_all(cls, session, uris_normalized):
+        """Return a dict of the numbers of public annotations on the URIs."""
+        totals = dict.fromkeys(uris_normalized, 0)
+        if totals:
+            query = session.query(cls).filter(cls.uri_normalized.in_(list(totals)))
+            totals.update((c.uri_normalized, c.total) for c in query)
+        return totals
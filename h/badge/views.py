@@ -1,8 +1,14 @@
 from pyramid import httpexceptions
+from pyramid.settings import asbool
 
 from h import models
+from h.badge import blocklist
 from h.util.view import json_view
 from h.api import search as search_lib
+from h.api import uri as uri_lib
+
+# The default maximum number of URIs in a batch badge request
+BATCH_MAX_URIS = 50
 
 
 @json_view(route_name='badge')
@@ -15,19 +21,63 @@ def badge(request):
     those pages. The Chrome extension is oblivious to this, we just tell it
     that there are 0 annotations.
 
+    If the `h.badge.precomputed_counts` setting is true, the number is read
+    from the maintained per-URI counts rather than found by searching. Only
+    annotations on the normalized URI itself are counted, and not those on
+    other URIs of the same document.
+
     """
     uri = request.params.get('uri')
 
     if not uri:
         raise httpexceptions.HTTPBadRequest()
 
-    if models.Blocklist.is_blocked(request.db, uri):
+    if blocklist.BLOCKLIST.is_blocked(request.db, uri):
         return {'total': 0}
 
+    settings = request.registry.settings
+    if asbool(settings.get('h.badge.precomputed_counts', False)):
+        return {'total': models.PublicAnnotationCount.get(
+            request.db, uri_lib.normalize(uri))}
+
     return {
         'total': search_lib.search(request, {'uri': uri, 'limit': 0})['total']}
 
 
+@json_view(route_name='badge_batch')
+def badge_batch(request):
+    """Return the numbers of public annotations on several pages at once.
+
+    The pages' URIs are given as repeated `uri` parameters, up to a maximum
+    of `h.badge.batch_max_uris`. The numbers are the same as :py:func:`badge`
+    would return for each URI, but are found with one search request.
+
+    """
+    uris = list(set(request.params.getall('uri')))
+    settings = request.registry.settings
+    max_uris = int(settings.get('h.badge.batch_max_uris', BATCH_MAX_URIS))
+
+    if not uris or len(uris) > max_uris:
+        raise httpexceptions.HTTPBadRequest()
+
+    totals = dict.fromkeys(uris, 0)
+    unblocked = [u for u in uris
+                 if not blocklist.BLOCKLIST.is_blocked(request.db, u)]
+    if not unblocked:
+        return {'totals': totals}
+
+    if asbool(settings.get('h.badge.precomputed_counts', False)):
+        normalized = {u: uri_lib.normalize(u) for u in unblocked}
+        counts = models.PublicAnnotationCount.get_all(request.db,
+                                                      normalized.values())
+        totals.update((u, counts[n]) for u, n in normalized.items())
+    else:
+        totals.update(search_lib.count_by_uri(request, unblocked))
+
+    return {'totals': totals}
+
+
 def includeme(config):
     config.scan(__name__)
     config.add_route('badge', '/api/badge')
+    config.add_route('badge_batch', '/api/badges')
@@ -17,8 +17,11 @@ from celery import Celery
 from celery import signals
 from celery.utils.log import get_task_logger
 from kombu import Exchange, Queue
+from pyramid.settings import asbool
 from raven.contrib.celery import register_signal, register_logger_signal
 
+from h.api import search
+
 __all__ = (
     'celery',
     'get_task_logger',
@@ -44,6 +47,7 @@ celery.conf.update(
         'h.indexer.add_annotation': 'indexer',
         'h.indexer.delete_annotation': 'indexer',
         'h.indexer.reindex_annotations': 'indexer',
+        'h.indexer.sync_annotation': 'indexer',
     },
     CELERY_TASK_SERIALIZER='json',
     CELERY_QUEUES=[
@@ -58,7 +62,9 @@ celery.conf.update(
     ],
     # Only accept one task at a time. This also probably isn't what we want
     # (especially not for, say, a search indexer task) but it makes the
-    # behaviour consistent with the previous NSQ-based worker:
+    # behaviour consistent with the previous NSQ-based worker. Workers which
+    # only consume batched indexer tasks lift this limit, see
+    # `bootstrap_worker`.
     CELERYD_PREFETCH_MULTIPLIER=1,
 )
 
@@ -72,6 +78,19 @@ def bootstrap_worker(sender, **kwargs):
     register_signal(request.sentry)
     register_logger_signal(request.sentry, loglevel=logging.ERROR)
 
+    # Batched tasks such as `h.indexer.sync_annotation` need whole batches
+    # prefetched, but other tasks should still be taken one at a time, so
+    # prefetching is only unlimited on workers of the indexer queue alone.
+    if asbool(request.registry.settings.get('h.indexer.batch')):
+        if set(sender.app.amqp.queues.consume_from) == set(['indexer']):
+            sender.prefetch_multiplier = 0
+        else:
+            log.warning('h.indexer.batch is enabled but this worker consumes '
+                        'queues other than "indexer", so batches of '
+                        'annotations to index will be small and slow. Run '
+                        'a separate worker for the indexer queue with '
+                        '"-Q indexer".')
+
 
 @signals.task_prerun.connect
 def reset_feature_flags(sender, **kwargs):
@@ -91,6 +110,12 @@ def transaction_abort(sender, **kwargs):
     sender.app.request.tm.abort()
 
 
+@signals.task_postrun.connect
+def report_search_pool_stats(sender, **kwargs):
+    """Periodically report Elasticsearch connection pool usage."""
+    search.report_pool_stats(sender.app.request.registry.settings)
+
+
 def start(argv, bootstrap):
     """Run the Celery CLI."""
     # We attach the bootstrap function directly to the Celery application
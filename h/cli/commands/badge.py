@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+import click
+
+from h.badge import counts
+
+
+@click.command('rebuild-badge-counts')
+@click.pass_context
+def rebuild_badge_counts(ctx):
+    """
+    Recompute the public annotation counts used by the badge API.
+
+    The counts are otherwise maintained as annotations change while
+    h.badge.precomputed_counts is on, so this is needed when turning it on
+    (again), or if the counts have become inaccurate.
+    """
+
+    request = ctx.obj['bootstrap']()
+
+    total = counts.rebuild(request.db)
+    request.tm.commit()
+
+    click.echo('Counted public annotations on {} URIs.'.format(total))
@@ -1,17 +1,141 @@
 # -*- coding: utf-8 -*-
 
+import functools
+import multiprocessing
+
 import click
 
 from h.api.search import index
 
+# The number of partitions to split the annotations into for each worker
+# process, so that workers which finish early can pick up more work, and so
+# that progress is reported regularly.
+PARTITIONS_PER_WORKER = 4
+
+# The bootstrapped request of a worker process
+_worker_request = None
+
 
 @click.command()
+@click.option('--parallel',
+              help='The number of worker processes to index annotations with.',
+              default=1,
+              type=click.IntRange(min=1))
+@click.option('--new-index',
+              help='Reindex into a new index, and then point the index '
+                   'alias at it.',
+              default=False,
+              is_flag=True)
+@click.option('--checkpoint',
+              help='Where to save the progress of a reindex into a new index.',
+              default='reindex-checkpoint.json',
+              show_default=True,
+              type=click.Path(dir_okay=False))
+@click.option('--bulk-load',
+              help='Turn off refreshes and replicas of the index being '
+                   'loaded, and send larger bulk requests, until loading '
+                   'finishes.',
+              default=False,
+              is_flag=True)
 @click.pass_context
-def reindex(ctx):
+def reindex(ctx, parallel, new_index, checkpoint, bulk_load):
     """
     Reindex all annotations from the PostgreSQL database to the Elasticsearch index.
+
+    With --parallel, the annotations are split into ranges of ids which are
+    indexed by a pool of worker processes, each with its own database and
+    Elasticsearch connections. Each worker sends one bulk request at a time.
+
+    With --new-index, the annotations are loaded into a new index with the
+    current mappings, and the index alias is moved to it once it is ready, so
+    searches are unaffected. If this is interrupted, running it again resumes
+    from the last checkpoint. The configured index name must be an alias, or
+    not exist yet: an existing index of that name isn't replaced.
+
+    With --bulk-load, the index being loaded isn't refreshed or replicated
+    until loading finishes, which makes loading much faster but means that
+    searches don't see the reindexed annotations until then. It is best
+    combined with --new-index.
     """
 
+    if new_index and parallel > 1:
+        raise click.UsageError('--new-index cannot be used with --parallel.')
+
     request = ctx.obj['bootstrap']()
 
-    index.reindex(request.db, request.es, request)
+    if new_index:
+        new, old = index.reindex_into_new_index(request.db,
+                                                request.es,
+                                                request,
+                                                index.Checkpoint(checkpoint),
+                                                bulk_load=bulk_load)
+        click.echo('The {} alias now points to {}.'.format(request.es.index,
+                                                           new))
+        if old is not None:
+            click.echo('The old index {} can be deleted.'.format(old))
+        return
+
+    if parallel == 1:
+        index.reindex(request.db, request.es, request, bulk_load=bulk_load)
+        return
+
+    partitions = index.partitions(request.db, parallel * PARTITIONS_PER_WORKER)
+
+    # Don't share database connections with the worker processes.
+    request.tm.abort()
+    request.db.get_bind().dispose()
+
+    if bulk_load:
+        with index.bulk_loading(request.es):
+            indexed, failed = _index_partitions(ctx.obj['bootstrap'],
+                                                parallel,
+                                                partitions,
+                                                bulk_load)
+    else:
+        indexed, failed = _index_partitions(ctx.obj['bootstrap'],
+                                            parallel,
+                                            partitions,
+                                            bulk_load)
+
+    deleting = index.BatchDeleter(request.db, request.es)
+    deleting.delete_all()
+
+    click.echo('Indexed {} annotations, {} failed.'.format(indexed, failed))
+
+
+def _index_partitions(bootstrap, parallel, partitions, bulk_load):
+    pool = multiprocessing.Pool(parallel, _init_worker, (bootstrap,))
+    try:
+        indexed = failed = 0
+        results = pool.imap_unordered(
+            functools.partial(_index_partition, bulk_load=bulk_load),
+            partitions)
+        for done, (count, errored) in enumerate(results, 1):
+            indexed += count
+            failed += len(errored)
+            click.echo('{}/{} partitions: indexed {} annotations, '
+                       '{} failed.'.format(done, len(partitions),
+                                           indexed, failed))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    return (indexed, failed)
+
+
+def _init_worker(bootstrap):
+    global _worker_request
+    _worker_request = bootstrap()
+
+
+def _index_partition(partition, bulk_load=False):
+    request = _worker_request
+    try:
+        indexing = index.BatchIndexer(request.db, request.es, request,
+                                      bulk_load=bulk_load)
+        return indexing.index_partition(partition)
+    finally:
+        request.tm.abort()
@@ -46,6 +46,9 @@ SETTINGS = [
     EnvSetting('broker_url', 'BROKER_URL'),
     EnvSetting('es.client_poolsize', 'ELASTICSEARCH_CLIENT_POOLSIZE',
                type=int),
+    EnvSetting('es.client_sniff', 'ELASTICSEARCH_CLIENT_SNIFF', type=asbool),
+    EnvSetting('es.client_sniffer_timeout',
+               'ELASTICSEARCH_CLIENT_SNIFFER_TIMEOUT', type=int),
     EnvSetting('es.client_timeout', 'ELASTICSEARCH_CLIENT_TIMEOUT', type=int),
     EnvSetting('es.host', 'ELASTICSEARCH_HOST'),
     EnvSetting('es.index', 'ELASTICSEARCH_INDEX'),
@@ -72,9 +75,30 @@ SETTINGS = [
     EnvSetting('h.bouncer_url', 'BOUNCER_URL'),
     EnvSetting('h.client_id', 'CLIENT_ID'),
     EnvSetting('h.client_secret', 'CLIENT_SECRET'),
+    EnvSetting('h.badge.batch_max_uris', 'BADGE_BATCH_MAX_URIS', type=int),
+    EnvSetting('h.badge.blocklist_refresh_interval',
+               'BADGE_BLOCKLIST_REFRESH_INTERVAL', type=int),
+    EnvSetting('h.badge.precomputed_counts', 'BADGE_PRECOMPUTED_COUNTS',
+               type=asbool),
     EnvSetting('h.db.should_create_all', 'MODEL_CREATE_ALL', type=asbool),
     EnvSetting('h.db.should_drop_all', 'MODEL_DROP_ALL', type=asbool),
+    EnvSetting('h.indexer.batch', 'INDEXER_BATCH', type=asbool),
+    EnvSetting('h.realtime.uri_routing', 'REALTIME_URI_ROUTING', type=asbool),
     EnvSetting('h.search.autoconfig', 'SEARCH_AUTOCONFIG', type=asbool),
+    EnvSetting('h.search.cache_size', 'SEARCH_CACHE_SIZE', type=int),
+    EnvSetting('h.search.cache_ttl', 'SEARCH_CACHE_TTL', type=int),
+    EnvSetting('h.search.offset_warning_depth', 'SEARCH_OFFSET_WARNING_DEPTH',
+               type=int),
+    EnvSetting('h.streamer.batch_size', 'STREAMER_BATCH_SIZE', type=int),
+    EnvSetting('h.streamer.batch_window', 'STREAMER_BATCH_WINDOW', type=int),
+    EnvSetting('h.streamer.catchup_size', 'STREAMER_CATCHUP_SIZE', type=int),
+    EnvSetting('h.streamer.coalesce_window', 'STREAMER_COALESCE_WINDOW',
+               type=int),
+    EnvSetting('h.streamer.outbox_size', 'STREAMER_OUTBOX_SIZE', type=int),
+    EnvSetting('h.streamer.slow_consumer_close_code',
+               'STREAMER_SLOW_CONSUMER_CLOSE_CODE', type=int),
+    EnvSetting('h.streamer.slow_consumer_policy',
+               'STREAMER_SLOW_CONSUMER_POLICY'),
     EnvSetting('h.websocket_url', 'WEBSOCKET_URL'),
     # The client Sentry DSN should be of the public kind, lacking the password
     # component in the DSN URI.
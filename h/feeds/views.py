@@ -11,7 +11,7 @@ _ = i18n.TranslationStringFactory(__package__)
 
 def _annotations(request):
     """Return the annotations from the search API."""
-    rows = search.search(request, request.params)['rows']
+    rows = search.search(request, request.params, source=False)['rows']
     ids = [r['id'] for r in rows]
     return storage.fetch_ordered_annotations(request.db, ids, load_documents=True)
 
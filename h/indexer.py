@@ -1,23 +1,43 @@
 # -*- coding: utf-8 -*-
 
+from __future__ import absolute_import
+
+from collections import OrderedDict
 import logging
 
+from celery.contrib.batches import Batches
+from pyramid.settings import asbool
+
 from h.celery import celery
 
 from h.api import storage
 from h.api.search.index import index
 from h.api.search.index import delete
 from h.api.search.index import reindex
+from h.api.search.index import sync
 
 __all__ = (
     'add_annotation',
     'delete_annotation',
     'reindex_annotations',
+    'sync_annotation',
 )
 
 
 log = logging.getLogger(__name__)
 
+# The maximum number of `sync_annotation` tasks handled in one bulk request,
+# and the number of seconds to wait for a batch to fill up before handling it
+# anyway.
+SYNC_BATCH_SIZE = 500
+SYNC_BATCH_INTERVAL = 1
+
+# The number of times a failed `sync_annotation` action is retried, and the
+# number of seconds to wait before the first retry, which doubles with each
+# retry after it.
+SYNC_MAX_RETRIES = 5
+SYNC_RETRY_DELAY = 2
+
 
 @celery.task
 def add_annotation(id_):
@@ -35,8 +55,66 @@ def reindex_annotations():
     reindex(celery.request.db, celery.request.es, celery.request)
 
 
+@celery.task(base=Batches,
+             flush_every=SYNC_BATCH_SIZE,
+             flush_interval=SYNC_BATCH_INTERVAL)
+def sync_annotation(requests):
+    """
+    Index or delete a batch of annotations with a single bulk request.
+
+    Each task is called with an annotation id and either ``'index'`` or
+    ``'delete'``. Only the last action for each annotation in the batch is
+    carried out.
+
+    The tasks in a batch are acknowledged once the whole batch has been
+    handled, so any whose actions failed are enqueued again first, to be
+    retried after a delay. Actions which still fail after
+    ``SYNC_MAX_RETRIES`` retries are logged and dropped.
+
+    Workers consuming these tasks must prefetch at least a batch of messages,
+    so they need a worker of their own which consumes only the indexer queue
+    (``-Q indexer``), on which prefetching isn't limited.
+    """
+    actions = OrderedDict()
+    retries = {}
+    for request in requests:
+        id_, action = request.args
+        actions.pop(id_, None)
+        actions[id_] = action
+        retries[id_] = request.kwargs.get('retries', 0)
+
+    try:
+        failed = sync(celery.request.db, celery.request.es, celery.request,
+                      actions)
+    except Exception:
+        log.exception('Failed to sync %d annotations', len(actions))
+        failed = set(actions)
+    finally:
+        # Batched tasks don't send the signals which normally end the
+        # transaction.
+        celery.request.tm.abort()
+
+    for id_, action in actions.items():
+        if id_ not in failed:
+            continue
+        if retries[id_] >= SYNC_MAX_RETRIES:
+            log.error('Giving up on %s of annotation %s after %d retries',
+                      action, id_, retries[id_])
+            continue
+        sync_annotation.apply_async(
+            (id_, action),
+            {'retries': retries[id_] + 1},
+            countdown=SYNC_RETRY_DELAY * 2 ** retries[id_])
+
+
 def subscribe_annotation_event(event):
-    if event.action in ['create', 'update']:
+    settings = event.request.registry.settings
+    if asbool(settings.get('h.indexer.batch')):
+        if event.action in ['create', 'update']:
+            sync_annotation.delay(event.annotation_id, 'index')
+        elif event.action == 'delete':
+            sync_annotation.delay(event.annotation_id, 'delete')
+    elif event.action in ['create', 'update']:
         add_annotation.delay(event.annotation_id)
     elif event.action == 'delete':
         delete_annotation.delay(event.annotation_id)
@@ -0,0 +1,28 @@
+"""Add the public_annotation_count table.
+
+Revision ID: 6e9c2b4f1d3a
+Revises: 467ea2898660
+Create Date: 2016-06-24 11:02:37.518244
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6e9c2b4f1d3a'
+down_revision = '467ea2898660'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'public_annotation_count',
+        sa.Column('uri_normalized', sa.UnicodeText(), nullable=False),
+        sa.Column('total', sa.Integer(), server_default='0', nullable=False),
+        sa.PrimaryKeyConstraint('uri_normalized',
+                                name=op.f('pk__public_annotation_count'))
+    )
+
+
+def downgrade():
+    op.drop_table('public_annotation_count')
@@ -20,6 +20,7 @@ __all__ = (
     'Feature',
     'Group',
     'NipsaUser',
+    'PublicAnnotationCount',
     'Subscriptions',
     'Token',
     'User',
@@ -32,6 +33,7 @@ Feature = features_models.Feature
 FeatureCohort = features_models.FeatureCohort
 Group = groups_models.Group
 NipsaUser = nipsa_models.NipsaUser
+PublicAnnotationCount = badge_models.PublicAnnotationCount
 Token = auth_models.Token
 Subscriptions = notification_models.Subscriptions
 User = accounts_models.User
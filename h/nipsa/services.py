@@ -50,7 +50,9 @@ class NipsaService(object):
         "remove_nipsa" message for the user will still be published to the
         queue).
         """
-        self._user_query(userid).delete()
+        nipsa_user = self._user_query(userid).one_or_none()
+        if nipsa_user is not None:
+            self.session.delete(nipsa_user)
 
         worker.remove_nipsa.delay(userid)
 
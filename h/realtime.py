@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import base64
+import hashlib
 import random
 import struct
 from datetime import datetime
@@ -8,6 +9,13 @@ from datetime import datetime
 import kombu
 from kombu.mixins import ConsumerMixin
 from kombu.pools import producers as producer_pool
+from pyramid.settings import asbool
+
+from h.streamer.filter import uni_fold
+
+# The routing key which matches annotation messages for every URI on the
+# exchange returned by `get_uri_exchange()`
+ANY_URI_ROUTING_KEY = 'annotation.#'
 
 
 class Consumer(ConsumerMixin):
@@ -94,6 +102,74 @@ class Consumer(ConsumerMixin):
         self.statsd_client.timing('streamer.msg.queueing', delta_millis)
 
 
+class RoutedConsumer(Consumer):
+    """
+    A realtime consumer of annotation messages for a changing set of URIs.
+
+    Rather than receiving every annotation message, the consumer's queue is
+    bound to the exchange returned by :py:func:`get_uri_exchange` with a
+    routing key for each URI the consumer is interested in, as returned by
+    the `routing_keys` callable. The bindings are brought up to date on each
+    iteration of the consumer loop, and so lag changes to the set of routing
+    keys by up to a second.
+
+    :param routing_keys: a function returning the set of routing keys to
+        which the queue should currently be bound
+    """
+
+    def __init__(self,
+                 connection,
+                 routing_key,
+                 handler,
+                 routing_keys,
+                 sentry_client=None,
+                 statsd_client=None):
+        super(RoutedConsumer, self).__init__(connection,
+                                             routing_key,
+                                             handler,
+                                             sentry_client=sentry_client,
+                                             statsd_client=statsd_client)
+        self.exchange = get_uri_exchange()
+        self.routing_keys = routing_keys
+        self.queue = None
+        self.bound = set()
+
+    def get_consumers(self, consumer_factory, channel):
+        # The queue may be bound after it has been declared, so the exchange
+        # must exist even if there is nothing to bind to yet.
+        self.exchange(channel).declare()
+
+        self.bound = set(self.routing_keys())
+        bindings = [kombu.binding(self.exchange, routing_key=key)
+                    for key in sorted(self.bound)]
+        queue = kombu.Queue(self.generate_queue_name(),
+                            durable=False,
+                            auto_delete=True,
+                            bindings=bindings)
+        consumer = consumer_factory(queues=[queue],
+                                    callbacks=[self.handle_message])
+
+        # The consumer binds a copy of the queue to the channel, and only
+        # that copy can be bound to and unbound from the exchange later.
+        self.queue = consumer.queues[0]
+        return [consumer]
+
+    def on_iteration(self):
+        self.update_bindings()
+
+    def update_bindings(self):
+        """Bind and unbind the queue to match the current routing keys."""
+        if self.queue is None:
+            return
+
+        wanted = set(self.routing_keys())
+        for key in sorted(wanted - self.bound):
+            self.queue.bind_to(self.exchange, routing_key=key)
+        for key in sorted(self.bound - wanted):
+            self.queue.unbind_from(self.exchange, routing_key=key)
+        self.bound = wanted
+
+
 class Publisher(object):
     """
     A realtime publisher for publishing messages to all subscribers.
@@ -104,24 +180,44 @@ class Publisher(object):
     :param request: a `pyramid.request.Request`
     """
     def __init__(self, request):
-        self.connection = get_connection(request.registry.settings)
+        settings = request.registry.settings
+        self.connection = get_connection(settings)
         self.exchange = get_exchange()
+        self.uri_routing = asbool(settings.get('h.realtime.uri_routing', False))
+
+    def publish_annotation(self, payload, uri=None, group=None):
+        """
+        Publish an annotation message with the routing key 'annotation'.
 
-    def publish_annotation(self, payload):
-        """Publish an annotation message with the routing key 'annotation'."""
+        If routing by URI is enabled, and the target URI of the annotation is
+        passed, then the message is also published to the URI exchange, with
+        the annotation's URI and group in its headers.
+        """
         self._publish('annotation', payload)
 
+        if self.uri_routing and uri is not None:
+            headers = {'uri': uri}
+            if group is not None:
+                headers['group'] = group
+            self._publish(uri_routing_key(uri),
+                          payload,
+                          exchange=get_uri_exchange(),
+                          headers=headers)
+
     def publish_user(self, payload):
         """Publish a user message with the routing key 'user'."""
         self._publish('user', payload)
 
-    def _publish(self, routing_key, payload):
-        headers = {'timestamp': datetime.utcnow().isoformat() + 'Z'}
+    def _publish(self, routing_key, payload, exchange=None, headers=None):
+        if exchange is None:
+            exchange = self.exchange
+        headers = dict(headers or {},
+                       timestamp=datetime.utcnow().isoformat() + 'Z')
 
         with producer_pool[self.connection].acquire(block=True) as producer:
             producer.publish(payload,
-                             exchange=self.exchange,
-                             declare=[self.exchange],
+                             exchange=exchange,
+                             declare=[exchange],
                              routing_key=routing_key,
                              headers=headers)
 
@@ -135,6 +231,36 @@ def get_exchange():
                           delivery_mode='transient')
 
 
+def get_uri_exchange():
+    """
+    Returns the `kombu.Exchange` for annotation messages routed by URI.
+
+    Messages on this exchange are published with the routing key returned by
+    :py:func:`uri_routing_key` for the annotation's target URI.
+    """
+
+    return kombu.Exchange('realtime-uri',
+                          type='topic',
+                          durable=False,
+                          delivery_mode='transient')
+
+
+def uri_routing_key(uri):
+    """
+    Return the routing key for annotation messages about `uri`.
+
+    URIs are folded in the same way as when the streamer matches annotations
+    against its clients' filters, so that every annotation which might match a
+    filter is routed to the streamer workers that hold it. As URIs can be
+    longer than AMQP allows routing keys to be, the key contains a digest of
+    the folded URI.
+    """
+    folded = uni_fold(uri)
+    if not isinstance(folded, bytes):
+        folded = folded.encode('utf-8')
+    return 'annotation.' + hashlib.sha1(folded).hexdigest()
+
+
 def get_connection(settings):
     """Returns a `kombu.Connection` based on the application's settings."""
 
@@ -2,8 +2,10 @@
 
 
 def includeme(config):
+    config.include('h.streamer.catchup')
     config.include('h.streamer.streamer')
     config.include('h.streamer.views')
+    config.include('h.streamer.websocket')
 
     config.add_route('ws', 'ws')
     config.add_subscriber('h.streamer.streamer.start',
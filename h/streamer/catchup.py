@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""
+A log of recent annotation events, so reconnecting clients can catch up.
+
+When a streamer worker restarts or the network drops, every connected client
+reconnects at once. Rather than each of them searching the API to find out
+what changed while they were disconnected, clients can send the cursor of the
+last notification they received, and be sent only the events they missed.
+
+Each annotation notification carries a cursor, made up of an identifier for
+the log (which changes each time the streamer starts) and the sequence number
+of the event in the log. The log is bounded: if a client's cursor is from a
+different log, or refers to an event which has been dropped from the log, the
+client must resynchronize in full.
+
+The log also caches the prepared (loaded and presented) form of each event, so
+that when many clients reconnect at once each event is only loaded from the
+database and presented once.
+
+When annotation messages are routed by URI (`h.realtime.uri_routing`), a
+worker only receives the events for the URIs its clients are currently
+subscribed to, so its log can't tell a reconnecting client what it missed on
+other pages, and resuming isn't supported.
+"""
+
+from collections import deque
+import base64
+import itertools
+import os
+
+
+class EventLog(object):
+
+    """A bounded in-memory log of annotation event payloads."""
+
+    def __init__(self, size):
+        self.epoch = base64.urlsafe_b64encode(os.urandom(6)).decode('ascii')
+        self.events = deque(maxlen=size)
+        self.last = 0
+        self._counter = itertools.count(1)
+
+        # Map from sequence number to the prepared form of the event
+        self._prepared = {}
+
+    def resize(self, size):
+        """Change the number of events retained, keeping the newest."""
+        self.events = deque(self.events, maxlen=size)
+        self._forget_dropped()
+
+    def append(self, payload):
+        """Record an event and return its cursor."""
+        if self.events and len(self.events) == self.events.maxlen:
+            self._prepared.pop(self.events[0][0], None)
+
+        self.last = next(self._counter)
+        self.events.append((self.last, payload))
+        return self.cursor(self.last)
+
+    def cache(self, cursor, prepared):
+        """Cache the prepared form of the event identified by `cursor`."""
+        seq = self._seq(cursor)
+        if seq is not None and self.events and seq >= self.events[0][0]:
+            self._prepared[seq] = prepared
+
+    def cached(self, cursors):
+        """
+        Return the cached prepared forms of the events identified by `cursors`.
+
+        Returns a dict mapping each of the cursors whose event has a cached
+        prepared form to that prepared form.
+        """
+        result = {}
+        for cursor in cursors:
+            seq = self._seq(cursor)
+            if seq in self._prepared:
+                result[cursor] = self._prepared[seq]
+        return result
+
+    def cursor(self, seq):
+        return '{}:{}'.format(self.epoch, seq)
+
+    def since(self, cursor):
+        """
+        Return the events recorded after the one identified by `cursor`.
+
+        Returns a list of `(cursor, payload)` pairs, or None if the events
+        following `cursor` are no longer (or were never) in the log.
+        """
+        seq = self._seq(cursor)
+        if seq is None:
+            return None
+
+        oldest = self.events[0][0] if self.events else self.last + 1
+        if seq < oldest - 1:
+            return None
+
+        return [(self.cursor(s), payload)
+                for s, payload in self.events
+                if s > seq]
+
+    def _seq(self, cursor):
+        """Return the sequence number of a valid cursor, or None."""
+        try:
+            epoch, seq = cursor.rsplit(':', 1)
+            seq = int(seq)
+        except (AttributeError, ValueError):
+            return None
+
+        if epoch != self.epoch or seq < 0 or seq > self.last:
+            return None
+        return seq
+
+    def _forget_dropped(self):
+        oldest = self.events[0][0] if self.events else self.last + 1
+        for seq in [s for s in self._prepared if s < oldest]:
+            del self._prepared[seq]
+
+
+EVENTS = EventLog(size=1000)
+
+
+def includeme(config):
+    settings = config.registry.settings
+
+    if 'h.streamer.catchup_size' in settings:
+        EVENTS.resize(int(settings['h.streamer.catchup_size']))
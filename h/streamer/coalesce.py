@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""
+Coalescing of bursts of events for the same annotation.
+
+The client saves an annotation repeatedly while it is being edited, and each
+save publishes a separate annotation event. Each of those would otherwise be
+fetched, presented and sent to every interested socket in turn, although the
+clients only need the latest state of the annotation.
+
+A :py:class:`Coalescer` sits in front of the streamer's work queue and holds
+back create and update events for a short window. Any further create or update
+events for the same annotation which arrive during the window replace the
+held event, so that only one is queued, when the window closes. A delete event
+is queued immediately and discards any held event for the annotation.
+"""
+
+import logging
+
+import gevent
+from gevent.queue import Full
+
+log = logging.getLogger(__name__)
+
+COALESCED_ACTIONS = ('create', 'update')
+
+
+class Coalescer(object):
+
+    """
+    A wrapper around a work queue which coalesces annotation events.
+
+    :param work_queue: the queue to which messages are passed on
+    :param window: the number of seconds for which to hold back the first
+        create or update event for an annotation
+    """
+
+    def __init__(self, work_queue, window):
+        self.work_queue = work_queue
+        self.window = window
+
+        # Held messages, and the greenlets which will flush them, keyed by
+        # annotation id
+        self.pending = {}
+        self._timers = {}
+
+    def put(self, message, timeout=None):
+        """
+        Queue `message`, or hold it back to be coalesced with later messages.
+
+        This has the same signature as :py:meth:`gevent.queue.Queue.put`, and
+        raises :py:exc:`gevent.queue.Full` in the same circumstances when
+        `message` is passed on to the work queue immediately.
+        """
+        payload = message.payload
+        annotation_id = payload.get('annotation_id')
+        action = payload.get('action')
+
+        if action == 'delete':
+            self._discard(annotation_id)
+            self.work_queue.put(message, timeout=timeout)
+            return
+
+        if action not in COALESCED_ACTIONS:
+            self.work_queue.put(message, timeout=timeout)
+            return
+
+        held = self.pending.get(annotation_id)
+        if held is None:
+            self._timers[annotation_id] = gevent.spawn_later(self.window,
+                                                             self.flush,
+                                                             annotation_id)
+        elif held.payload['action'] == 'create':
+            # Clients which haven't yet been told about the annotation need
+            # to see it as a new one.
+            message = message._replace(payload=dict(payload, action='create'))
+        self.pending[annotation_id] = message
+
+    def flush(self, annotation_id):
+        """Pass on the message held for `annotation_id`, if there is one."""
+        self._timers.pop(annotation_id, None)
+        message = self.pending.pop(annotation_id, None)
+        if message is None:
+            return
+        try:
+            self.work_queue.put(message, timeout=0.1)
+        except Full:
+            log.warn('Streamer work queue full! Unable to queue coalesced '
+                     'message having waited 0.1s: giving up.')
+
+    def _discard(self, annotation_id):
+        self.pending.pop(annotation_id, None)
+        timer = self._timers.pop(annotation_id, None)
+        if timer is not None:
+            timer.kill(block=False)
@@ -4,6 +4,7 @@ import copy
 import operator
 import unicodedata
 
+from jsonpointer import JsonPointer
 from jsonpointer import resolve_pointer
 from h._compat import text_type
 
@@ -159,6 +160,104 @@ class FilterHandler(object):
             return False
 
 
+class CompiledFilter(object):
+
+    """
+    A filter compiled into a predicate when it is received.
+
+    Matches exactly as :py:class:`FilterHandler` does, but all the work which
+    doesn't depend on the annotation being matched -- folding the clause
+    values, parsing the JSON pointers, and looking up the operators and match
+    policy -- is done once, up front, rather than on every evaluation.
+    """
+
+    def __init__(self, filter_json):
+        self.filter = filter_json
+        self._actions = filter_json['actions']
+
+        clauses = [_compile_clause(c) for c in filter_json['clauses']]
+        if clauses:
+            self._predicate = _compile_policy(filter_json['match_policy'],
+                                              clauses)
+        else:
+            self._predicate = lambda target: True
+
+    def match(self, target, action=None):
+        if not action or action == 'past' or action in self._actions:
+            return self._predicate(target)
+        else:
+            return False
+
+
+def _compile_policy(match_policy, clauses):
+    if match_policy == 'include_any':
+        return lambda target: any(c(target) for c in clauses)
+    if match_policy == 'include_all':
+        return lambda target: all(c(target) for c in clauses)
+    if match_policy == 'exclude_all':
+        return lambda target: not all(c(target) for c in clauses)
+    if match_policy == 'exclude_any':
+        return lambda target: not any(c(target) for c in clauses)
+    raise ValueError('unknown match policy: {}'.format(match_policy))
+
+
+def _compile_clause(clause):
+    if isinstance(clause['field'], list):
+        alternatives = [_compile_clause(dict(clause, field=f))
+                        for f in clause['field']]
+        return lambda target: any(a(target) for a in alternatives)
+
+    pointer = JsonPointer(clause['field'])
+    name = clause['operator']
+    op = getattr(operator, FilterHandler.operators[name])
+    cval = _fold(clause['value'])
+
+    # See FilterHandler.evaluate_clause: when the clause value is a list, the
+    # containment operators test whether a single field value is one of the
+    # clause values, rather than whether the clause value is contained in the
+    # field value.
+    if name in ['one_of', 'matches'] and isinstance(cval, list):
+        members = _frozenset_or_none(cval)
+
+        def predicate(target):
+            field_value = pointer.resolve(target, None)
+            if field_value is None:
+                return False
+            if isinstance(field_value, list):
+                return op(_fold(field_value), cval)
+            return _is_member(uni_fold(field_value), members, cval)
+        return predicate
+
+    def predicate(target):
+        field_value = pointer.resolve(target, None)
+        if field_value is None:
+            return False
+        return op(_fold(field_value), cval)
+    return predicate
+
+
+def _fold(value):
+    if isinstance(value, list):
+        return [uni_fold(v) for v in value]
+    return uni_fold(value)
+
+
+def _frozenset_or_none(values):
+    try:
+        return frozenset(values)
+    except TypeError:
+        return None
+
+
+def _is_member(value, members, values):
+    if members is not None:
+        try:
+            return value in members
+        except TypeError:
+            pass
+    return value in values
+
+
 def first_of(a, b):
     return a[0] == b
 setattr(operator, 'first_of', first_of)
@@ -5,12 +5,14 @@ import json
 import logging
 
 from gevent.queue import Full
+from pyramid.settings import asbool
 
 from h import realtime
-from h.realtime import Consumer
+from h.realtime import Consumer, RoutedConsumer
 from h.api import presenters
 from h.api import storage
 from h.auth.util import translate_annotation_principals
+from h.streamer import catchup
 from h.streamer import websocket
 import h.sentry
 import h.stats
@@ -21,8 +23,24 @@ log = logging.getLogger(__name__)
 # An incoming message from a subscribed realtime consumer
 Message = namedtuple('Message', ['topic', 'payload'])
 
+# A run of incoming messages from the annotation topic, to be processed together
+AnnotationBatch = namedtuple('AnnotationBatch', ['payloads'])
 
-def process_messages(settings, routing_key, work_queue, raise_error=True):
+# An annotation event which has been loaded and presented once, ready to be
+# matched against each connected socket
+PreparedEvent = namedtuple('PreparedEvent', ['action',
+                                             'annotation',
+                                             'userid',
+                                             'nipsa',
+                                             'read_principals',
+                                             'notification'])
+
+
+def process_messages(settings,
+                     routing_key,
+                     work_queue,
+                     raise_error=True,
+                     routing_keys=None):
     """
     Configure, start, and monitor a realtime consumer for the specified
     routing key.
@@ -30,6 +48,10 @@ def process_messages(settings, routing_key, work_queue, raise_error=True):
     This sets up a :py:class:`h.realtime.Consumer` to route messages from
     `routing_key` to the passed `work_queue`, and starts it. The consumer
     should never return. If it does, this function will raise an exception.
+
+    If `routing_keys` is passed, then a :py:class:`h.realtime.RoutedConsumer`
+    is used instead, which only receives the messages routed with the keys
+    returned by `routing_keys`.
     """
 
     def _handler(payload):
@@ -43,27 +65,55 @@ def process_messages(settings, routing_key, work_queue, raise_error=True):
     conn = realtime.get_connection(settings)
     sentry_client = h.sentry.get_client(settings)
     statsd_client = h.stats.get_client(settings)
-    consumer = Consumer(connection=conn,
-                        routing_key=routing_key,
-                        handler=_handler,
-                        sentry_client=sentry_client,
-                        statsd_client=statsd_client)
+    if routing_keys is None:
+        consumer = Consumer(connection=conn,
+                            routing_key=routing_key,
+                            handler=_handler,
+                            sentry_client=sentry_client,
+                            statsd_client=statsd_client)
+    else:
+        consumer = RoutedConsumer(connection=conn,
+                                  routing_key=routing_key,
+                                  handler=_handler,
+                                  routing_keys=routing_keys,
+                                  sentry_client=sentry_client,
+                                  statsd_client=statsd_client)
     consumer.run()
 
     if raise_error:
         raise RuntimeError('Realtime consumer quit unexpectedly!')
 
 
+def annotation_routing_keys():
+    """
+    Return the routing keys for the annotation messages the sockets might want.
+
+    These are the keys under which annotation messages are published to the
+    URI exchange by :py:meth:`h.realtime.Publisher.publish_annotation`.
+    """
+    uris = websocket.WebSocket.subscriptions.uris()
+    if uris is None:
+        return set([realtime.ANY_URI_ROUTING_KEY])
+    return set(realtime.uri_routing_key(uri) for uri in uris)
+
+
 def handle_message(message, topic_handlers):
     """
     Deserialize and process a message from the reader.
 
-    For each message, `handler` is called with the deserialized message and a
-    single :py:class:`h.streamer.WebSocket` instance, and should return the
-    message to be sent to the client on that socket. The handler can return
-    `None`, to signify that no message should be sent, or a JSON-serializable
-    object. It is assumed that there is a 1:1 request-reply mapping between
-    incoming messages and messages to be sent out over the websockets.
+    The handler for the message's topic is called with the deserialized
+    message, and should return an iterable of `(socket, reply)` pairs, where
+    each `socket` is a :py:class:`h.streamer.websocket.WebSocket` instance and
+    each `reply` is the JSON-serializable object to be sent to the client on
+    that socket. Sockets which should not receive a message are simply omitted.
+    Replies are queued on each socket rather than sent immediately, so a slow
+    client doesn't delay the processing of messages. Handlers should yield the
+    same reply object for all sockets receiving identical replies, as each
+    distinct reply object is only serialized once.
+
+    This allows handlers to do any work which is common to all recipients
+    (such as loading the subject of the message from the database) once per
+    message rather than once per connected socket.
     """
     data = message.payload
 
@@ -73,107 +123,293 @@ def handle_message(message, topic_handlers):
         raise RuntimeError("Don't know how to handle message from topic: "
                            "{}".format(message.topic))
 
-    # N.B. We iterate over a non-weak list of instances because there's nothing
-    # to stop connections being added or dropped during iteration, and if that
-    # happens Python will throw a "Set changed size during iteration" error.
-    sockets = list(websocket.WebSocket.instances)
-    for socket in sockets:
-        reply = handler(data, socket)
-        if reply is None:
-            continue
-        if not socket.terminated:
-            socket.send(json.dumps(reply))
+    _send_replies(handler(data))
 
 
-def handle_annotation_event(message, socket):
+def handle_annotation_batch(batch):
+    """
+    Process a batch of messages from the annotation topic together.
+
+    All the annotations referred to by the batch are loaded from the database
+    at once, and then each event is sent to the interested sockets in turn.
     """
-    Get message about annotation event `message` to be sent to `socket`.
+    _send_replies(handle_annotation_events(batch.payloads))
 
-    Inspects the embedded annotation event and decides whether or not the
-    passed socket should receive notification of the event.
 
-    Returns None if the socket should not receive any message about this
-    annotation event, otherwise a dict containing information about the event.
+def handle_annotation_event(message):
     """
-    action = message['action']
+    Get messages about annotation event `message` to be sent to sockets.
 
-    if action == 'read':
-        return None
+    Inspects the embedded annotation event and decides which connected sockets
+    should receive notification of the event. The annotation is loaded and
+    presented only once, however many sockets are connected, and only those
+    sockets whose subscriptions might match the annotation are considered.
 
-    if message['src_client_id'] == socket.client_id:
-        return None
+    Returns an iterator of `(socket, notification)` pairs.
+    """
+    return handle_annotation_events([message])
 
-    # We don't send anything until we have received a filter from the client
-    if socket.filter is None:
-        return None
 
-    notification = {
-        'type': 'annotation-notification',
-        'options': {'action': action},
-    }
-    id_ = message['annotation_id']
+def handle_annotation_events(payloads):
+    """
+    Get messages about a sequence of annotation events to be sent to sockets.
 
-    # Return early when action is delete
-    serialized = None
-    if action == 'delete':
-        serialized = message['annotation_dict']
-    else:
-        annotation = storage.fetch_annotation(socket.request.db, id_)
-        if annotation is None:
-            return None
+    This is :py:func:`handle_annotation_event` for several events at once:
+    all the annotations are loaded with a single query before the events are
+    matched against sockets, in order.
 
-        serialized = presenters.AnnotationJSONPresenter(
-            socket.request, annotation).asdict()
+    Returns an iterator of `(socket, notification)` pairs.
+    """
+    payloads = [p for p in payloads if p['action'] != 'read']
+    if not payloads:
+        return
+
+    # Events are logged even if nobody is listening right now, as that is
+    # exactly what happens while clients are reconnecting.
+    cursors = [catchup.EVENTS.append(p) for p in payloads]
+
+    # We don't send anything to sockets until we have received a filter from
+    # the client, so if no socket has a filter there's no work to do.
+    subscriptions = websocket.WebSocket.subscriptions
+    if not subscriptions:
+        return
+
+    # The annotations are presented using the request of any subscribed
+    # socket: all that is used is the database session, the services, and
+    # route generation, which are the same for every socket.
+    request = next(iter(subscriptions)).request
+
+    events = prepare_annotation_events(payloads, request, cursors=cursors)
+    for cursor, event in zip(cursors, events):
+        catchup.EVENTS.cache(cursor, event)
+
+    for message, event in zip(payloads, events):
+        if event is None:
+            continue
 
-    userid = serialized.get('user')
-    nipsa_service = socket.request.find_service(name='nipsa')
-    if nipsa_service.is_flagged(userid) and socket.request.authenticated_userid != userid:
-        return None
+        # Sockets with identical filters share a filter object, so each
+        # distinct filter need only be evaluated once for each event.
+        matches = {}
 
-    permissions = serialized.get('permissions')
-    if not _authorized_to_read(socket.request, permissions):
-        return None
+        for socket in subscriptions.candidates(event.annotation):
+            if not _subscribed(socket, message):
+                continue
+            if _should_receive(event, socket, matches):
+                yield socket, event.notification
 
-    if not socket.filter.match(serialized, action):
-        return None
 
-    notification['payload'] = [serialized]
-    if action == 'delete':
-        notification['payload'] = [{'id': id_}]
-    return notification
+def handle_resume(socket, cursor):
+    """
+    Send `socket` the annotation events it missed since `cursor`.
+
+    The missed events are matched against the socket's current filter, so the
+    client should send its filter first. If the events since `cursor` are no
+    longer available, the client is told to resynchronize in full instead.
 
+    Events are loaded and presented at most once while they are in the log,
+    however many clients resume past them.
 
-def handle_user_event(message, socket):
+    When annotation messages are routed by URI, this worker may not have
+    received the events the client missed, so the client is always told to
+    resynchronize.
     """
-    Get message about user event `message` to be sent to `socket`.
+    _send_replies(_resume_replies(socket, cursor))
+
+
+def _resume_replies(socket, cursor):
+    settings = socket.request.registry.settings
+    if asbool(settings.get('h.realtime.uri_routing', False)):
+        yield socket, {'type': 'resync-required'}
+        return
+
+    missed = catchup.EVENTS.since(cursor)
+    if missed is None:
+        yield socket, {'type': 'resync-required'}
+        return
+
+    missed = [(c, p) for c, p in missed if _subscribed(socket, p)]
+    if not missed:
+        return
+
+    events = catchup.EVENTS.cached([c for c, _ in missed])
+    unprepared = [(c, p) for c, p in missed if c not in events]
+    if unprepared:
+        cursors, payloads = zip(*unprepared)
+        prepared = prepare_annotation_events(payloads,
+                                             socket.request,
+                                             cursors=cursors)
+        for c, event in zip(cursors, prepared):
+            catchup.EVENTS.cache(c, event)
+            events[c] = event
+
+    for c, _ in missed:
+        event = events[c]
+        if event is not None and _should_receive(event, socket, {}):
+            yield socket, event.notification
+
+
+def prepare_annotation_events(payloads, request, cursors=None):
+    """
+    Load and present the annotations referred to by `payloads`.
+
+    Does all the work needed to notify sockets about annotation events which
+    doesn't depend on the recipient: fetching and presenting the annotations,
+    looking up whether their authors are NIPSA'd, and translating their read
+    permissions into principals. All the annotations are fetched with a single
+    query.
 
-    Inspects the embedded user event and decides whether or not the passed
-    socket should receive notification of the event.
+    If `cursors` is passed, each notification includes the corresponding
+    cursor, which the client can later use to resume from that event.
 
-    Returns None if the socket should not receive any message about this user
-    event, otherwise a dict containing information about the event.
+    Returns a list containing a :py:class:`PreparedEvent` for each payload,
+    or None where the annotation could not be loaded.
     """
-    if socket.request.authenticated_userid != message['userid']:
-        return None
+    ids = [p['annotation_id'] for p in payloads if p['action'] != 'delete']
+    annotations = storage.fetch_ordered_annotations(request.db,
+                                                    list(set(ids)),
+                                                    load_documents=True)
+    annotations = {a.id: a for a in annotations}
+
+    nipsa_service = request.find_service(name='nipsa')
+    nipsa = {}
+
+    events = []
+    for i, message in enumerate(payloads):
+        action = message['action']
+        id_ = message['annotation_id']
+
+        if action == 'delete':
+            serialized = message['annotation_dict']
+        elif id_ in annotations:
+            serialized = presenters.AnnotationJSONPresenter(
+                request, annotations[id_]).asdict()
+        else:
+            events.append(None)
+            continue
+
+        userid = serialized.get('user')
+        if userid not in nipsa:
+            nipsa[userid] = nipsa_service.is_flagged(userid)
+
+        permissions = serialized.get('permissions')
+        read_permissions = permissions.get('read', [])
+        read_principals = translate_annotation_principals(read_permissions)
+
+        notification = {
+            'type': 'annotation-notification',
+            'options': {'action': action},
+            'payload': [serialized],
+        }
+        if action == 'delete':
+            notification['payload'] = [{'id': id_}]
+        if cursors is not None:
+            notification['cursor'] = cursors[i]
+
+        events.append(PreparedEvent(action=action,
+                                    annotation=serialized,
+                                    userid=userid,
+                                    nipsa=nipsa[userid],
+                                    read_principals=frozenset(read_principals),
+                                    notification=notification))
+
+    return events
+
+
+def handle_user_event(message):
+    """
+    Get messages about user event `message` to be sent to sockets.
+
+    Inspects the embedded user event and decides which connected sockets
+    should receive notification of the event: only sockets authenticated as
+    the user in question will.
+
+    Returns an iterator of `(socket, notification)` pairs.
+    """
+    sockets = [s for s in list(websocket.WebSocket.instances)
+               if s.request.authenticated_userid == message['userid']]
+    if not sockets:
+        return
 
     # for session state change events, the full session model
     # is included so that clients can update themselves without
     # further API requests
-    return {
+    notification = {
         'type': 'session-change',
         'action': message['type'],
         'model': message['session_model']
     }
 
+    for socket in sockets:
+        yield socket, notification
+
+
+def _send_replies(replies):
+    """Queue each of the `(socket, reply)` pairs in `replies` for sending."""
+    # Handlers typically yield the same reply object for every recipient, so
+    # each distinct reply is serialized only once and the resulting string is
+    # shared between all the sockets it is sent to. The reply itself is kept
+    # in the cache so that its id can't be reused while we're iterating.
+    encoded = {}
+
+    for socket, reply in replies:
+        try:
+            _, frame, key = encoded[id(reply)]
+        except KeyError:
+            frame = json.dumps(reply)
+            key = _supersession_key(reply)
+            encoded[id(reply)] = (reply, frame, key)
+        socket.queue_send(frame, key=key)
+
+
+def _supersession_key(reply):
+    """
+    Return a key identifying replies which supersede one another.
+
+    A notification about an annotation supersedes any earlier notification
+    about the same annotation which hasn't yet been sent to the client.
+    """
+    if reply.get('type') == 'annotation-notification':
+        return ('annotation', reply['payload'][0]['id'])
+    return None
+
+
+def _subscribed(socket, message):
+    """Return True if `socket` could be interested in annotation `message`."""
+    # We don't send anything until we have received a filter from the client
+    if socket.filter is None:
+        return False
+
+    # Clients aren't sent notifications about their own actions
+    if message['src_client_id'] == socket.client_id:
+        return False
+
+    return True
+
+
+def _should_receive(event, socket, matches):
+    """
+    Return True if `socket` should be notified of annotation `event`.
+
+    `matches` caches the result of matching each filter against the event.
+    """
+    if event.nipsa and socket.request.authenticated_userid != event.userid:
+        return False
+
+    if not _authorized_to_read(socket.request, event.read_principals):
+        return False
+
+    filter_ = socket.filter
+    if filter_ not in matches:
+        matches[filter_] = filter_.match(event.annotation, event.action)
+    return matches[filter_]
+
 
-def _authorized_to_read(request, permissions):
+def _authorized_to_read(request, read_principals):
     """Return True if the passed request is authorized to read the annotation.
 
     If the annotation belongs to a private group, this will return False if the
     authenticated user isn't a member of that group.
     """
-    read_permissions = permissions.get('read', [])
-    read_principals = translate_annotation_principals(read_permissions)
-    if set(read_principals).intersection(request.effective_principals):
+    if read_principals.intersection(request.effective_principals):
         return True
     return False
@@ -2,12 +2,17 @@
 
 import logging
 import sys
+import time
 
 import gevent
+from gevent.queue import Empty
+from pyramid.settings import asbool
 
 from h import db
 from h import stats
+from h.api import search
 from h.streamer import messages
+from h.streamer.coalesce import Coalescer
 from h.streamer import websocket
 
 log = logging.getLogger(__name__)
@@ -36,14 +41,32 @@ def start(event):
     This subscriber is called when the application is booted, and kicks off
     greenlets running `process_queue` for each message queue we subscribe to.
     The function does not block.
+
+    If the `h.streamer.coalesce_window` setting is nonzero, then create and
+    update events for an annotation are held back for that many milliseconds,
+    and only the last of those received in that time is processed.
+
+    If the `h.realtime.uri_routing` setting is true, then only annotation
+    messages about URIs that the connected clients are subscribed to are
+    received from the message queue.
     """
     settings = event.app.registry.settings
+    annotation_queue = WORK_QUEUE
+    coalesce_window = float(settings.get('h.streamer.coalesce_window', 0))
+    if coalesce_window > 0:
+        annotation_queue = Coalescer(WORK_QUEUE, coalesce_window / 1000)
+
+    annotation_routing_keys = None
+    if asbool(settings.get('h.realtime.uri_routing', False)):
+        annotation_routing_keys = messages.annotation_routing_keys
+
     greenlets = [
         # Start greenlets to process messages from RabbitMQ
         gevent.spawn(messages.process_messages,
                      settings,
                      ANNOTATION_TOPIC,
-                     WORK_QUEUE),
+                     annotation_queue,
+                     routing_keys=annotation_routing_keys),
         gevent.spawn(messages.process_messages,
                      settings,
                      USER_TOPIC,
@@ -67,6 +90,12 @@ def process_work_queue(settings, queue, session_factory=db.Session):
     dispatching them as appropriate. The handling of each message is wrapped in
     code that ensures the database session is appropriately committed and
     closed between messages.
+
+    If the `h.streamer.batch_size` setting is greater than one, then up to that
+    many messages are taken from the queue at a time, waiting at most
+    `h.streamer.batch_window` milliseconds for more messages to arrive after
+    the first. Consecutive annotation messages in such a batch are processed
+    together, in a single transaction.
     """
     s = stats.get_client(settings).pipeline()
     session = session_factory()
@@ -74,39 +103,94 @@ def process_work_queue(settings, queue, session_factory=db.Session):
         ANNOTATION_TOPIC: messages.handle_annotation_event,
         USER_TOPIC: messages.handle_user_event,
     }
+    batch_size = int(settings.get('h.streamer.batch_size', 1))
+    batch_window = float(settings.get('h.streamer.batch_window', 50)) / 1000
+
+    for batch in _batches(queue, batch_size, batch_window):
+        for msg in _group_annotation_messages(batch):
+            t_total = s.timer('streamer.msg.handler_total')
+            t_total.start()
+            try:
+                # All access to the database in the streamer is currently
+                # read-only, so enforce that:
+                session.execute("SET TRANSACTION "
+                                "ISOLATION LEVEL SERIALIZABLE "
+                                "READ ONLY "
+                                "DEFERRABLE")
+
+                if isinstance(msg, messages.Message):
+                    with s.timer('streamer.msg.handler_message'):
+                        messages.handle_message(msg, topic_handlers=topic_handlers)
+                elif isinstance(msg, messages.AnnotationBatch):
+                    with s.timer('streamer.msg.handler_batch'):
+                        messages.handle_annotation_batch(msg)
+                elif isinstance(msg, websocket.Message):
+                    with s.timer('streamer.msg.handler_websocket'):
+                        websocket.handle_message(msg)
+                else:
+                    raise UnknownMessageType(repr(msg))
+
+            except (KeyboardInterrupt, SystemExit):
+                session.rollback()
+                raise
+            except:
+                log.exception('Caught exception handling streamer message:')
+                session.rollback()
+            else:
+                session.commit()
+            finally:
+                session.close()
+            t_total.stop()
+            s.send()
+
+
+def _batches(queue, size, window):
+    """
+    Yield lists of messages from `queue`.
 
+    Each list contains up to `size` messages: having received the first, we
+    wait at most `window` seconds for the rest to arrive.
+    """
     for msg in queue:
-        t_total = s.timer('streamer.msg.handler_total')
-        t_total.start()
-        try:
-            # All access to the database in the streamer is currently
-            # read-only, so enforce that:
-            session.execute("SET TRANSACTION "
-                            "ISOLATION LEVEL SERIALIZABLE "
-                            "READ ONLY "
-                            "DEFERRABLE")
-
-            if isinstance(msg, messages.Message):
-                with s.timer('streamer.msg.handler_message'):
-                    messages.handle_message(msg, topic_handlers=topic_handlers)
-            elif isinstance(msg, websocket.Message):
-                with s.timer('streamer.msg.handler_websocket'):
-                    websocket.handle_message(msg)
-            else:
-                raise UnknownMessageType(repr(msg))
-
-        except (KeyboardInterrupt, SystemExit):
-            session.rollback()
-            raise
-        except:
-            log.exception('Caught exception handling streamer message:')
-            session.rollback()
-        else:
-            session.commit()
-        finally:
-            session.close()
-        t_total.stop()
-        s.send()
+        batch = [msg]
+        deadline = time.time() + window
+        while len(batch) < size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(queue.get(timeout=timeout))
+            except Empty:
+                break
+        yield batch
+
+
+def _group_annotation_messages(batch):
+    """
+    Group runs of consecutive annotation messages in `batch` together.
+
+    Yields the messages in `batch` in order, except that any run of two or
+    more consecutive messages from the annotation topic is replaced by a
+    single :py:class:`h.streamer.messages.AnnotationBatch`.
+    """
+    run = []
+    for msg in batch:
+        if isinstance(msg, messages.Message) and msg.topic == ANNOTATION_TOPIC:
+            run.append(msg)
+            continue
+        for work in _annotation_run(run):
+            yield work
+        run = []
+        yield msg
+    for work in _annotation_run(run):
+        yield work
+
+
+def _annotation_run(run):
+    if len(run) == 1:
+        yield run[0]
+    elif run:
+        yield messages.AnnotationBatch(payloads=[m.payload for m in run])
 
 
 def report_stats(settings):
@@ -115,6 +199,19 @@ def report_stats(settings):
         client.gauge('streamer.connected_clients',
                      len(websocket.WebSocket.instances))
         client.gauge('streamer.queue_length', WORK_QUEUE.qsize())
+
+        backlogs = [len(s.outbox) for s in list(websocket.WebSocket.instances)]
+        client.gauge('streamer.outbox.backlog_total', sum(backlogs))
+        client.gauge('streamer.outbox.backlog_max', max(backlogs or [0]))
+        client.incr('streamer.outbox.evictions',
+                    websocket.WebSocket.evictions)
+        client.incr('streamer.outbox.slow_disconnects',
+                    websocket.WebSocket.slow_disconnects)
+        websocket.WebSocket.evictions = 0
+        websocket.WebSocket.slow_disconnects = 0
+
+        search.report_pool_stats(settings)
+
         gevent.sleep(10)
 
 
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+"""
+An inverted index of websocket subscriptions.
+
+Almost all streamer clients subscribe with a filter made up of equality
+clauses (in practice, a `/uri` `one_of` clause listing the expanded URIs of the
+page the client is on). Rather than evaluating every incoming annotation
+against every connected socket's filter, the streamer maintains an index from
+`(field, value)` to the sockets whose filters could match an annotation with
+that value in that field, and only evaluates the filters of those candidates.
+
+The index is only ever used to narrow down the set of sockets to consider: it
+may return sockets whose filters don't match, but it never omits a socket
+whose filter would match. Sockets whose filters can't be indexed are always
+returned as candidates.
+"""
+
+from collections import defaultdict
+import weakref
+
+from jsonpointer import resolve_pointer
+
+from h._compat import string_types
+from h.streamer.filter import uni_fold
+
+
+class SubscriptionIndex(object):
+
+    """An index from annotation field values to subscribed sockets."""
+
+    def __init__(self):
+        # All sockets with a registered filter
+        self._sockets = weakref.WeakSet()
+
+        # Sockets whose filters can't be indexed, and so must be considered as
+        # candidates for every annotation
+        self._unindexed = weakref.WeakSet()
+
+        # Sockets indexed on each field, and on each (field, value) pair
+        self._by_field = defaultdict(weakref.WeakSet)
+        self._by_value = defaultdict(weakref.WeakSet)
+
+        # The index entries for each socket, so they can be removed again
+        self._entries = weakref.WeakKeyDictionary()
+
+    def __len__(self):
+        return len(self._sockets)
+
+    def __iter__(self):
+        return iter(self._sockets)
+
+    def add(self, socket, filter_json):
+        """
+        Register `socket` as subscribed with the passed filter.
+
+        Any previous registration for the socket is replaced.
+        """
+        self.remove(socket)
+        self._sockets.add(socket)
+
+        clauses = _indexable_clauses(filter_json)
+        if clauses is None:
+            self._unindexed.add(socket)
+            self._entries[socket] = []
+            return
+
+        entries = []
+        for field, keys in clauses:
+            self._by_field[field].add(socket)
+            entries.append((self._by_field, field))
+            for key in keys:
+                self._by_value[(field, key)].add(socket)
+                entries.append((self._by_value, (field, key)))
+        self._entries[socket] = entries
+
+    def remove(self, socket):
+        """Remove any registration for `socket`. Does nothing if absent."""
+        self._sockets.discard(socket)
+        self._unindexed.discard(socket)
+
+        for mapping, key in self._entries.pop(socket, []):
+            sockets = mapping.get(key)
+            if sockets is None:
+                continue
+            sockets.discard(socket)
+            if not sockets:
+                del mapping[key]
+
+    def candidates(self, target):
+        """
+        Return the set of sockets whose filters might match `target`.
+
+        :param target: the presented annotation
+        :type target: dict
+        """
+        result = set(self._unindexed)
+
+        for field, sockets in list(self._by_field.items()):
+            value = resolve_pointer(target, field, None)
+            if value is None:
+                continue
+
+            # The filter operators compare list-valued (and object-valued)
+            # fields in ways which can't be answered from the index, so every
+            # socket indexed on such a field is a candidate.
+            if isinstance(value, (list, dict)):
+                result.update(sockets)
+                continue
+
+            result.update(self._by_value.get((field, uni_fold(value)), ()))
+
+        return result
+
+    def uris(self):
+        """
+        Return the folded URIs of annotations which the sockets might match.
+
+        Returns None if some socket's filter might match annotations on any
+        URI.
+        """
+        if self._unindexed:
+            return None
+        for field, sockets in self._by_field.items():
+            if field != '/uri' and sockets:
+                return None
+        return set(value for (field, value), sockets in self._by_value.items()
+                   if field == '/uri' and sockets)
+
+
+def _indexable_clauses(filter_json):
+    """
+    Return the `(field, keys)` pairs under which to index a filter.
+
+    Returns None if the filter can't be indexed, meaning that it must be
+    evaluated against every annotation.
+    """
+    clauses = filter_json.get('clauses', [])
+    if not clauses:
+        return None
+
+    policy = filter_json.get('match_policy')
+    indexed = [_clause_keys(c) for c in clauses]
+
+    # For an "include_all" filter to match, every clause must match, so
+    # indexing on any one clause is sufficient. Prefer the `/uri` clause,
+    # which is typically the most selective.
+    if policy == 'include_all':
+        indexed = [i for i in indexed if i is not None]
+        if not indexed:
+            return None
+        indexed.sort(key=lambda i: i[0] != '/uri')
+        return indexed[:1]
+
+    # For an "include_any" filter to match, at least one clause must match,
+    # so the filter must be indexed on every clause.
+    if policy == 'include_any':
+        if None in indexed:
+            return None
+        return indexed
+
+    return None
+
+
+def _clause_keys(clause):
+    """
+    Return the `(field, keys)` pair for an equality clause.
+
+    When the annotation's field holds a single value, the clause can only
+    match if that value (after folding) is one of the returned keys. Returns
+    None if the clause isn't an equality test on a single field.
+    """
+    field = clause.get('field')
+    if not isinstance(field, string_types):
+        return None
+
+    operator = clause.get('operator')
+    value = clause.get('value')
+
+    if operator == 'one_of':
+        # A "one_of" clause with a single value is a substring test
+        if not isinstance(value, list):
+            return None
+        values = value
+    elif operator == 'equals':
+        # An "equals" clause with a list value can never match a single value
+        values = [] if isinstance(value, list) else [value]
+    else:
+        return None
+
+    keys = set()
+    for v in values:
+        v = uni_fold(v)
+        try:
+            hash(v)
+        except TypeError:
+            return None
+        keys.add(v)
+
+    return field, keys
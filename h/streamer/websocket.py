@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 
+from collections import deque
 from collections import namedtuple
 import json
 import logging
 import weakref
 
+import gevent
 from gevent.queue import Full
 import jsonschema
 from pyramid.threadlocal import get_current_request
@@ -12,18 +14,54 @@ from ws4py.websocket import WebSocket as _WebSocket
 
 from h.api import storage
 from h.streamer import filter
+from h.streamer.subscriptions import SubscriptionIndex
 
 log = logging.getLogger(__name__)
 
 # An incoming message from a WebSocket client.
 Message = namedtuple('Message', ['socket', 'payload'])
 
+# Compiled filters, keyed by their canonical JSON serialization. Clients on the
+# same page typically send identical filters, so sockets with identical
+# filters share a single compiled filter, which is kept for as long as any
+# socket is using it.
+FILTERS = weakref.WeakValueDictionary()
+
+# What to do when a socket's outbox is full because the client isn't reading
+# messages as fast as they are being sent to it:
+#
+# - "drop_oldest": discard the oldest unsent message
+# - "coalesce": discard unsent messages superseded by the new message (such as
+#   earlier notifications about the same annotation), falling back to
+#   discarding the oldest unsent message
+# - "disconnect": discard all unsent messages and close the socket
+SLOW_CONSUMER_POLICIES = ('drop_oldest', 'coalesce', 'disconnect')
+
+# The number of seconds to spend trying to send a close frame to a client
+# being disconnected for being too slow, before dropping the connection
+SLOW_CONSUMER_CLOSE_TIMEOUT = 1
+
 
 class WebSocket(_WebSocket):
     # All instances of WebSocket, allowing us to iterate over open websockets
     instances = weakref.WeakSet()
+    # An index of the filters of all open websockets, allowing us to find the
+    # websockets which might be interested in an annotation
+    subscriptions = SubscriptionIndex()
     origins = []
 
+    # Outbound message buffering, configured from the application settings
+    # (see `includeme`)
+    outbox_size = 256
+    slow_consumer_policy = 'drop_oldest'
+    slow_consumer_close_code = 1013
+
+    # The number of messages dropped from the outboxes of all sockets, and the
+    # number of sockets disconnected for being too slow, since they were last
+    # reported (see `h.streamer.streamer.report_stats`)
+    evictions = 0
+    slow_disconnects = 0
+
     # Instance attributes
     client_id = None
     filter = None
@@ -35,6 +73,17 @@ class WebSocket(_WebSocket):
         super(WebSocket, self).__init__(*args, **kwargs)
         self.request = get_current_request()
 
+        # Messages waiting to be sent to the client, as (key, data) pairs, and
+        # the greenlet sending them.
+        self.outbox = deque()
+        self.evicted = 0
+        self._writer = None
+
+        # Whether the writer is partway through sending a message, and whether
+        # the socket is being disconnected for being too slow.
+        self._sending = False
+        self._disconnecting = False
+
     def __new__(cls, *args, **kwargs):
         instance = super(WebSocket, cls).__new__(cls, *args, **kwargs)
         cls.instances.add(instance)
@@ -49,11 +98,109 @@ class WebSocket(_WebSocket):
             log.warn('Streamer work queue full! Unable to queue message from '
                      'WebSocket client having waited 0.1s: giving up.')
 
+    @property
+    def closing(self):
+        """Whether the socket is closing, so no more messages can be sent."""
+        return (self._disconnecting or
+                self.client_terminated or
+                self.server_terminated)
+
+    def queue_send(self, data, key=None):
+        """
+        Queue `data` to be sent to the client, without blocking.
+
+        Messages are sent in order by a greenlet dedicated to this socket, so
+        a client which is slow to read its messages doesn't hold up sending
+        messages to other clients. If the client falls too far behind, the
+        configured slow consumer policy is applied.
+
+        :param data: the message to send
+        :param key: identifies messages which supersede each other, for the
+            "coalesce" slow consumer policy
+        """
+        if self.closing:
+            return
+
+        if len(self.outbox) >= self.outbox_size and not self._make_room(key):
+            return
+
+        self.outbox.append((key, data))
+        if self._writer is None:
+            self._writer = gevent.spawn(self._drain_outbox)
+
+    def _make_room(self, key):
+        """Apply the slow consumer policy. Return False if the socket closed."""
+        policy = self.slow_consumer_policy
+
+        if policy == 'disconnect':
+            self._evict(len(self.outbox))
+            self.outbox.clear()
+            WebSocket.slow_disconnects += 1
+            self._disconnecting = True
+            gevent.spawn(self._disconnect,
+                         self.slow_consumer_close_code,
+                         'Client too slow to receive messages')
+            return False
+
+        if policy == 'coalesce' and key is not None:
+            pending = deque(item for item in self.outbox if item[0] != key)
+            self._evict(len(self.outbox) - len(pending))
+            self.outbox = pending
+            if len(self.outbox) < self.outbox_size:
+                return True
+
+        self.outbox.popleft()
+        self._evict(1)
+        return True
+
+    def _evict(self, count):
+        self.evicted += count
+        WebSocket.evictions += count
+
+    def _drain_outbox(self):
+        try:
+            while self.outbox and not self.closing:
+                _, data = self.outbox.popleft()
+                self._sending = True
+                self.send(data)
+                self._sending = False
+        except Exception:
+            log.debug('Failed to send queued messages to WebSocket client',
+                      exc_info=True)
+            self.outbox.clear()
+        finally:
+            self._writer = None
+
+    def _disconnect(self, code, reason):
+        """
+        Close the connection to a client which isn't keeping up.
+
+        Only one greenlet can write to the socket at a time, so the writer,
+        which is probably blocked sending to the client, is stopped first. If
+        it was stopped partway through a message, no close frame can follow
+        it. Otherwise a close frame is sent if that can be done quickly. The
+        connection is then dropped without waiting for the client to reply.
+        """
+        writer = self._writer
+        if writer is not None:
+            writer.kill()
+
+        if not self._sending:
+            with gevent.Timeout(SLOW_CONSUMER_CLOSE_TIMEOUT, False):
+                try:
+                    self.close(code, reason)
+                except Exception:
+                    log.debug('Failed to send close frame to slow WebSocket '
+                              'client', exc_info=True)
+
+        self.close_connection()
+
     def closed(self, code, reason=None):
         try:
             self.instances.remove(self)
         except KeyError:
             pass
+        self.subscriptions.remove(self)
 
 
 def handle_message(message):
@@ -74,9 +221,14 @@ def handle_message(message):
             # Add backend expands for clauses
             _expand_clauses(socket.request, payload)
 
-            socket.filter = filter.FilterHandler(payload)
+            socket.filter = _intern_filter(payload)
+            WebSocket.subscriptions.add(socket, payload)
         elif msg_type == 'client_id':
             socket.client_id = data.get('value')
+        elif msg_type == 'resume_from':
+            # Imported here as h.streamer.messages depends on this module
+            from h.streamer import messages
+            messages.handle_resume(socket, data.get('value'))
     except:
         # TODO: clean this up, catch specific errors, narrow the scope
         log.exception("Parsing filter: %s", data)
@@ -84,6 +236,15 @@ def handle_message(message):
         raise
 
 
+def _intern_filter(payload):
+    """Return the shared compiled filter for `payload`, creating if needed."""
+    key = json.dumps(payload, sort_keys=True)
+    compiled = FILTERS.get(key)
+    if compiled is None:
+        compiled = FILTERS[key] = filter.CompiledFilter(payload)
+    return compiled
+
+
 def _expand_clauses(request, payload):
     for clause in payload['clauses']:
         if clause['field'] == '/uri':
@@ -100,4 +261,23 @@ def _expand_uris(session, clause):
     for item in uris:
         expanded.update(storage.expand_uri(session, item))
 
-    clause['value'] = list(expanded)
+    # Sorted, so that filters for the same page serialize identically
+    clause['value'] = sorted(expanded)
+
+
+def includeme(config):
+    settings = config.registry.settings
+
+    if 'h.streamer.outbox_size' in settings:
+        WebSocket.outbox_size = int(settings['h.streamer.outbox_size'])
+
+    policy = settings.get('h.streamer.slow_consumer_policy')
+    if policy is not None:
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError('h.streamer.slow_consumer_policy must be one of '
+                             '{}'.format(', '.join(SLOW_CONSUMER_POLICIES)))
+        WebSocket.slow_consumer_policy = policy
+
+    if 'h.streamer.slow_consumer_close_code' in settings:
+        WebSocket.slow_consumer_close_code = int(
+            settings['h.streamer.slow_consumer_close_code'])
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+from pyramid.settings import asbool
 
 from h import __version__
 from h import emails
@@ -34,8 +35,28 @@ def publish_annotation_event(event):
     }
     if event.annotation_dict:
         data['annotation_dict'] = event.annotation_dict
+        uri = event.annotation_dict.get('uri')
+        group = event.annotation_dict.get('group')
+    else:
+        annotation = storage.fetch_annotation(event.request.db,
+                                              event.annotation_id)
+        if annotation is None:
+            uri = group = None
+        else:
+            uri, group = annotation.target_uri, annotation.groupid
+
+    # Consumers such as the search caches of every web process need to know
+    # which page changed without looking the annotation up.
+    data['uri'] = uri
+
+    settings = event.request.registry.settings
+    if not asbool(settings.get('h.realtime.uri_routing', False)):
+        event.request.realtime.publish_annotation(data)
+        return
 
-    event.request.realtime.publish_annotation(data)
+    # Route the message by the annotation's target URI, so that it only
+    # reaches the streamer workers with clients on that page.
+    event.request.realtime.publish_annotation(data, uri=uri, group=group)
 
 
 def send_reply_notifications(event,
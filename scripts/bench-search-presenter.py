@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Compare the cost of presenting a page of search results by loading each hit
+into an annotation model and presenting it with the AnnotationJSONPresenter,
+and by presenting the hit directly with the AnnotationSearchHitJSONPresenter.
+"""
+
+from __future__ import print_function
+
+from argparse import ArgumentParser
+import timeit
+
+from pyramid import testing
+
+from h.api import presenters
+from h.api import storage
+
+SOURCE = {
+    'id': 'AVWBmhGGg3wEb1aYKQXz',
+    'created': '2016-06-24T11:02:37.518244+00:00',
+    'updated': '2016-06-24T11:05:00.000001+00:00',
+    'user': 'acct:bob@example.com',
+    'uri': 'http://example.com/research/papers/2015-discoveries.html',
+    'text': u'Some text',
+    'tags': [u'foo', u'bar'],
+    'group': '__world__',
+    'permissions': {'read': ['group:__world__'],
+                    'admin': ['acct:bob@example.com'],
+                    'update': ['acct:bob@example.com'],
+                    'delete': ['acct:bob@example.com']},
+    'target': [{
+        'source': 'http://example.com/research/papers/2015-discoveries.html',
+        'selector': [{'type': 'TextQuoteSelector', 'exact': u'discoveries'}],
+        'scope': ['httpx://example.com/research/papers/2015-discoveries.html'],
+    }],
+    'document': {
+        'title': [u'Discoveries of 2015'],
+        'link': [
+            {'href': 'http://example.com/research/papers/2015-discoveries.html'},
+        ],
+    },
+}
+
+
+def model_presenter(request, source):
+    annotation = storage.annotation_from_dict(source)
+    return presenters.AnnotationJSONPresenter(request, annotation).asdict()
+
+
+def hit_presenter(request, source):
+    return presenters.AnnotationSearchHitJSONPresenter(request, source).asdict()
+
+
+def make_request():
+    config = testing.setUp(settings={'h.bouncer_url': 'https://hyp.is/'})
+    config.include('h.api.presenters')
+    config.include('h.links')
+    config.add_route('api.annotation', '/api/annotations/{id}')
+    config.add_route('annotation', '/a/{id}')
+    return testing.DummyRequest()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=200,
+                        help='number of search hits per response')
+    parser.add_argument('--number', type=int, default=20,
+                        help='number of responses per timing run')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of timing runs')
+    args = parser.parse_args()
+
+    request = make_request()
+    hits = [dict(SOURCE) for _ in range(args.rows)]
+    implementations = [
+        ('AnnotationJSONPresenter', model_presenter),
+        ('SearchHitPresenter', hit_presenter),
+    ]
+
+    for name, present in implementations:
+        timer = timeit.Timer(lambda: [present(request, h) for h in hits])
+        best = min(timer.repeat(repeat=args.repeat, number=args.number))
+        print('{:<24} {:8.2f} ms/response'.format(name,
+                                                  best / args.number * 1e3))
+
+
+if __name__ == '__main__':
+    main()
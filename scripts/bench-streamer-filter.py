@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Compare the cost of matching annotations against streamer filters using the
+interpreting FilterHandler and the CompiledFilter.
+"""
+
+from __future__ import print_function
+
+from argparse import ArgumentParser
+import timeit
+
+from h.streamer import filter
+
+ANNOTATION = {
+    'id': 'abc123',
+    'uri': u'http://example.com/research/papers/2015-discoveries.html',
+    'user': 'acct:bob@example.com',
+    'text': u'Some text',
+    'tags': [u'foo', u'bar'],
+    'permissions': {'read': ['group:__world__']},
+}
+
+
+def make_filter(uris):
+    return {
+        'match_policy': 'include_any',
+        'clauses': [{
+            'field': '/uri',
+            'operator': 'one_of',
+            'value': ['http://example.com/research/papers/{}.html'.format(i)
+                      for i in range(uris)],
+        }],
+        'actions': {'create': True, 'update': True, 'delete': True},
+    }
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--uris', type=int, default=10,
+                        help='number of expanded URIs in the filter clause')
+    parser.add_argument('--number', type=int, default=20000,
+                        help='number of matches per timing run')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of timing runs')
+    args = parser.parse_args()
+
+    filter_json = make_filter(args.uris)
+    implementations = [
+        ('FilterHandler', filter.FilterHandler(filter_json)),
+        ('CompiledFilter', filter.CompiledFilter(filter_json)),
+    ]
+
+    for name, impl in implementations:
+        timer = timeit.Timer(lambda: impl.match(ANNOTATION, 'create'))
+        best = min(timer.repeat(repeat=args.repeat, number=args.number))
+        print('{:<16} {:8.2f} us/match'.format(name,
+                                               best / args.number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -671,11 +671,10 @@ class TestActivateController(object):
             pyramid_request,
             user_model):
         pyramid_request.matchdict = {'id': '123', 'code': 'abc456'}
-        pyramid_request.db.delete = mock.create_autospec(pyramid_request.db.delete,
-                                                         return_value=None)
         user_model.get_by_activation.return_value.id = 123
 
-        views.ActivateController(pyramid_request).get_when_not_logged_in()
+        with mock.patch.object(pyramid_request.db, 'delete', autospec=True):
+            views.ActivateController(pyramid_request).get_when_not_logged_in()
 
         user_model.get_by_activation.return_value.activate.assert_called_once_with()
 
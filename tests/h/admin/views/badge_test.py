@@ -3,6 +3,7 @@
 import mock
 import pytest
 from pyramid import httpexceptions
+import transaction
 
 from h import models
 from h.admin.views import badge as views
@@ -29,6 +30,26 @@ class TestBadgeAddRemove(object):
 
         assert models.Blocklist.is_blocked(pyramid_request.db, 'test_uri')
 
+    def test_add_invalidates_compiled_blocklist_after_commit(self,
+                                                             pyramid_request,
+                                                             blocklist):
+        pyramid_request.params = {'add': 'test_uri'}
+
+        views.badge_add(pyramid_request)
+
+        assert not blocklist.BLOCKLIST.invalidate.called
+        pyramid_request.tm.commit()
+        blocklist.BLOCKLIST.invalidate.assert_called_once_with()
+
+    def test_add_does_not_invalidate_compiled_blocklist_on_abort(
+            self, pyramid_request, blocklist):
+        pyramid_request.params = {'add': 'test_uri'}
+
+        views.badge_add(pyramid_request)
+        pyramid_request.tm.abort()
+
+        assert not blocklist.BLOCKLIST.invalidate.called
+
     def test_add_redirects_to_index(self, pyramid_request):
         pyramid_request.params = {'add': 'test_uri'}
 
@@ -60,6 +81,16 @@ class TestBadgeAddRemove(object):
 
         assert not models.Blocklist.is_blocked(pyramid_request.db, 'blocked2')
 
+    def test_remove_invalidates_compiled_blocklist_after_commit(
+            self, pyramid_request, blocklist):
+        pyramid_request.params = {'remove': 'blocked2'}
+
+        views.badge_remove(pyramid_request)
+
+        assert not blocklist.BLOCKLIST.invalidate.called
+        pyramid_request.tm.commit()
+        blocklist.BLOCKLIST.invalidate.assert_called_once_with()
+
     def test_remove_redirects_to_index(self, pyramid_request):
         pyramid_request.params = {'remove': 'blocked1'}
 
@@ -90,6 +121,20 @@ def blocked_uris(db_session):
     return uris
 
 
+@pytest.fixture
+def blocklist(patch):
+    return patch('h.admin.views.badge.blocklist')
+
+
+@pytest.fixture
+def pyramid_request(pyramid_request):
+    # The database session isn't joined to this transaction manager, so
+    # committing it only runs the commit hooks.
+    pyramid_request.tm = transaction.TransactionManager()
+    pyramid_request.tm.begin()
+    return pyramid_request
+
+
 @pytest.fixture
 def routes(pyramid_config):
     pyramid_config.add_route('admin_badge', '/adm/badge')
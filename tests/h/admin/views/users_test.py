@@ -258,7 +258,8 @@ def test_delete_user_queries_annotations(elasticsearch_helpers, fake_db_session,
                     'filter': {'term': {'user': u'acct:bob@example.com'}},
                     'query': {'match_all': {}}
                 }
-            }
+            },
+            '_source': False,
         }
     )
 
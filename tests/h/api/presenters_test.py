@@ -7,6 +7,7 @@ from pyramid import testing
 
 from h.api.presenters import AnnotationBasePresenter
 from h.api.presenters import AnnotationJSONPresenter
+from h.api.presenters import AnnotationSearchHitJSONPresenter
 from h.api.presenters import AnnotationSearchIndexPresenter
 from h.api.presenters import AnnotationJSONLDPresenter
 from h.api.presenters import DocumentJSONPresenter
@@ -14,6 +15,7 @@ from h.api.presenters import DocumentMetaJSONPresenter
 from h.api.presenters import DocumentURIJSONPresenter
 from h.api.presenters import add_annotation_link_generator
 from h.api.presenters import utc_iso8601, deep_merge_dict
+from h.api import storage
 
 
 @pytest.mark.usefixtures('routes')
@@ -350,6 +352,101 @@ class TestAnnotationSearchIndexPresenter(object):
         return class_
 
 
+class TestAnnotationSearchHitJSONPresenter(object):
+    def test_asdict_returns_stored_fields(self, pyramid_request, source):
+        result = AnnotationSearchHitJSONPresenter(pyramid_request,
+                                                  source).asdict()
+
+        assert result == {
+            'id': 'foo',
+            'created': '2016-02-24T18:03:25.000768+00:00',
+            'updated': '2016-02-29T10:24:05.000564+00:00',
+            'user': 'acct:luke',
+            'uri': 'http://example.com',
+            'text': 'It is magical!',
+            'tags': ['magic'],
+            'group': '__world__',
+            'permissions': {'read': ['group:__world__'],
+                            'admin': ['acct:luke'],
+                            'update': ['acct:luke'],
+                            'delete': ['acct:luke']},
+            'target': [{'source': 'http://example.com',
+                        'selector': [{'TestSelector': 'foobar'}]}],
+            'document': {'title': ['Example'],
+                         'link': [{'href': 'http://example.com'}]},
+            'references': ['AVWBmhGGg3wEb1aYKQXy'],
+            'extra-1': 'foo',
+            'links': result['links'],
+        }
+        assert result['links']['giraffe'] == 'http://giraffe.com'
+        assert result['links']['elephant'] == 'https://elephant.org'
+
+    def test_asdict_does_not_modify_source(self, pyramid_request, source):
+        AnnotationSearchHitJSONPresenter(pyramid_request, source).asdict()
+
+        assert 'links' not in source
+        assert source['target'][0]['scope'] == ['http://example.com']
+
+    def test_asdict_defaults_missing_text_and_tags(self,
+                                                   pyramid_request,
+                                                   source):
+        del source['text']
+        source['tags'] = None
+
+        result = AnnotationSearchHitJSONPresenter(pyramid_request,
+                                                  source).asdict()
+
+        assert result['text'] == ''
+        assert result['tags'] == []
+
+    def test_asdict_matches_AnnotationJSONPresenter(self,
+                                                    pyramid_request,
+                                                    source):
+        expected = AnnotationJSONPresenter(
+            pyramid_request,
+            storage.annotation_from_dict(dict(source))).asdict()
+
+        result = AnnotationSearchHitJSONPresenter(pyramid_request,
+                                                  source).asdict()
+
+        assert result == expected
+
+    @pytest.fixture
+    def pyramid_request(self, pyramid_request):
+        registry = pyramid_request.registry
+        add_annotation_link_generator(registry,
+                                      'giraffe',
+                                      lambda r, a: 'http://giraffe.com')
+        add_annotation_link_generator(registry,
+                                      'elephant',
+                                      lambda r, a: 'https://elephant.org')
+        return pyramid_request
+
+    @pytest.fixture
+    def source(self):
+        return {
+            'id': 'foo',
+            'created': '2016-02-24T18:03:25.000768+00:00',
+            'updated': '2016-02-29T10:24:05.000564+00:00',
+            'user': 'acct:luke',
+            'uri': 'http://example.com',
+            'text': 'It is magical!',
+            'tags': ['magic'],
+            'group': '__world__',
+            'permissions': {'read': ['group:__world__'],
+                            'admin': ['acct:luke'],
+                            'update': ['acct:luke'],
+                            'delete': ['acct:luke']},
+            'target': [{'source': 'http://example.com',
+                        'selector': [{'TestSelector': 'foobar'}],
+                        'scope': ['http://example.com']}],
+            'document': {'title': ['Example'],
+                         'link': [{'href': 'http://example.com'}]},
+            'references': ['AVWBmhGGg3wEb1aYKQXy'],
+            'extra-1': 'foo',
+        }
+
+
 @pytest.mark.usefixtures('routes')
 class TestAnnotationJSONLDPresenter(object):
 
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+import mock
+import pytest
+
+from h.api import search
+from h.api import uri
+from h.api.events import AnnotationEvent
+
+
+class TestGetClient(object):
+    def test_passes_pool_options(self, Client):
+        search._get_client({'es.host': 'http://es:9200',
+                            'es.index': 'hypothesis',
+                            'es.client_poolsize': 20})
+
+        Client.assert_called_once_with('http://es:9200',
+                                       'hypothesis',
+                                       timeout=10,
+                                       maxsize=20)
+
+    def test_enables_sniffing(self, Client):
+        search._get_client({'es.host': 'http://es:9200',
+                            'es.index': 'hypothesis',
+                            'es.client_sniff': True,
+                            'es.client_sniffer_timeout': 30})
+
+        Client.assert_called_once_with('http://es:9200',
+                                       'hypothesis',
+                                       timeout=10,
+                                       sniff_on_start=True,
+                                       sniff_on_connection_fail=True,
+                                       sniffer_timeout=30)
+
+    def test_legacy_client_uses_the_same_options(self, Client):
+        search._legacy_get_client({'es.host': 'http://es:9200',
+                                   'legacy.es.index': 'annotator',
+                                   'es.client_poolsize': 20})
+
+        Client.assert_called_once_with('http://es:9200',
+                                       'annotator',
+                                       timeout=10,
+                                       maxsize=20)
+
+    @pytest.fixture
+    def Client(self, patch):
+        return patch('h.api.search.Client')
+
+
+class TestInvalidateSearchCache(object):
+    def test_invalidates_the_annotations_uri(self, cache, fetch_annotation):
+        fetch_annotation.return_value.target_uri = 'http://Example.com/'
+
+        search._invalidate_search_cache(self.event())
+
+        cache.invalidate.assert_called_once_with(
+            uri.normalize('http://Example.com/'))
+
+    def test_uses_annotation_dict_for_deletes(self, cache, fetch_annotation):
+        event = self.event(annotation_dict={'uri': 'http://example.com'})
+
+        search._invalidate_search_cache(event)
+
+        assert not fetch_annotation.called
+        cache.invalidate.assert_called_once_with(
+            uri.normalize('http://example.com'))
+
+    def test_clears_cache_if_annotation_not_found(self, cache, fetch_annotation):
+        fetch_annotation.return_value = None
+
+        search._invalidate_search_cache(self.event())
+
+        cache.clear.assert_called_once_with()
+
+    def test_does_nothing_if_cache_disabled(self, fetch_annotation):
+        search._invalidate_search_cache(self.event())
+
+        assert not fetch_annotation.called
+
+    def event(self, annotation_dict=None):
+        return AnnotationEvent(self.request, 'id', 'update', annotation_dict)
+
+    @pytest.fixture(autouse=True)
+    def request_(self, pyramid_request):
+        self.request = pyramid_request
+
+    @pytest.fixture
+    def cache(self, pyramid_config):
+        cache = mock.Mock(spec_set=['invalidate', 'clear'])
+        pyramid_config.registry[search.CACHE_KEY] = cache
+        return cache
+
+    @pytest.fixture
+    def fetch_annotation(self, patch):
+        return patch('h.api.search.storage.fetch_annotation')
+
+
+class TestInvalidateFromMessage(object):
+    def test_invalidates_the_messages_uri(self, cache):
+        search._invalidate_from_message(cache, {'action': 'update',
+                                                'annotation_id': 'id',
+                                                'uri': 'http://Example.com/'})
+
+        cache.invalidate.assert_called_once_with(
+            uri.normalize('http://Example.com/'))
+
+    def test_clears_cache_if_message_has_no_uri(self, cache):
+        search._invalidate_from_message(cache, {'action': 'update',
+                                                'annotation_id': 'id',
+                                                'uri': None})
+
+        cache.clear.assert_called_once_with()
+
+    @pytest.fixture
+    def cache(self):
+        return mock.Mock(spec_set=['invalidate', 'clear'])
+
+
+class TestStartCacheInvalidator(object):
+    def test_consumes_annotation_messages_in_a_thread(self, Consumer, threading):
+        search._start_cache_invalidator(self.event)
+
+        assert Consumer.call_args[1]['routing_key'] == 'annotation'
+        threading.Thread.assert_called_once_with(
+            target=Consumer.return_value.run,
+            name='search-cache-invalidator')
+        thread = threading.Thread.return_value
+        assert thread.daemon
+        thread.start.assert_called_once_with()
+
+    def test_messages_invalidate_the_registry_cache(self, Consumer, threading):
+        search._start_cache_invalidator(self.event)
+        handler = Consumer.call_args[1]['handler']
+
+        handler({'uri': 'http://example.com'})
+
+        self.cache.invalidate.assert_called_once_with(
+            uri.normalize('http://example.com'))
+
+    def test_starts_once_per_process(self, Consumer, getpid, threading):
+        search._start_cache_invalidator(self.event)
+        search._start_cache_invalidator(self.event)
+        assert threading.Thread.call_count == 1
+
+        getpid.return_value = 2
+        search._start_cache_invalidator(self.event)
+        assert threading.Thread.call_count == 2
+
+    @pytest.fixture(autouse=True)
+    def setup(self, pyramid_config, pyramid_request):
+        self.cache = mock.Mock(spec_set=['invalidate', 'clear'])
+        pyramid_config.registry[search.CACHE_KEY] = self.cache
+        self.event = mock.Mock(request=pyramid_request)
+
+    @pytest.fixture
+    def Consumer(self, patch):
+        return patch('h.api.search.realtime.Consumer')
+
+    @pytest.fixture(autouse=True)
+    def getpid(self, patch):
+        getpid = patch('h.api.search.os.getpid')
+        getpid.return_value = 1
+        return getpid
+
+    @pytest.fixture(autouse=True)
+    def invalidator_started(self, monkeypatch):
+        monkeypatch.setitem(search._invalidator_started, 'pid', None)
+
+    @pytest.fixture
+    def threading(self, patch):
+        return patch('h.api.search.threading')
+
+
+class TestReportPoolStats(object):
+    def test_sends_gauges(self, statsd):
+        search.report_pool_stats({})
+
+        statsd.gauge.assert_any_call('es.pool.in_use', 1)
+        statsd.gauge.assert_any_call('es.pool.requests', 10)
+        statsd.gauge.assert_any_call('es.pool.reuse_ratio', 0.8)
+        statsd.send.assert_called_once_with()
+
+    def test_throttles_reports(self, statsd, time):
+        search.report_pool_stats({})
+        time.time.return_value += search.POOL_STATS_INTERVAL - 1
+        search.report_pool_stats({})
+
+        assert statsd.send.call_count == 1
+
+        time.time.return_value += 1
+        search.report_pool_stats({})
+
+        assert statsd.send.call_count == 2
+
+    @pytest.fixture(autouse=True)
+    def pool_stats(self, patch):
+        pool_stats = patch('h.api.search.pool_stats')
+        pool_stats.return_value = {'size': 10,
+                                   'in_use': 1,
+                                   'idle': 2,
+                                   'connections_opened': 2,
+                                   'requests': 10}
+        return pool_stats
+
+    @pytest.fixture(autouse=True)
+    def reported(self, monkeypatch):
+        monkeypatch.setattr(search, '_pool_stats_reported', {'at': None})
+
+    @pytest.fixture
+    def statsd(self, patch):
+        stats = patch('h.api.search.stats')
+        return stats.get_client.return_value.pipeline.return_value
+
+    @pytest.fixture
+    def time(self, patch):
+        time = patch('h.api.search.time')
+        time.time.return_value = 1000.0
+        return time
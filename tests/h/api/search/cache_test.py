@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from h.api.search.cache import SearchCache
+from h.api.search.cache import cache_key
+from h.api.search.cache import query_scopes
+
+
+class TestSearchCache(object):
+    def test_get_returns_cached_value(self, cache):
+        cache.set('key', 'value')
+
+        assert cache.get('key') == 'value'
+
+    def test_get_returns_none_if_missing(self, cache):
+        assert cache.get('key') is None
+
+    def test_entries_expire(self, cache, clock):
+        cache.set('key', 'value')
+        clock.now += 10
+
+        assert cache.get('key') is None
+        assert cache._scopes == {}
+
+    def test_evicts_least_recently_used_entry_when_full(self, cache):
+        cache.set('one', 1)
+        cache.set('two', 2)
+        cache.set('three', 3)
+        cache.get('one')
+
+        cache.set('four', 4)
+
+        assert cache.get('two') is None
+        assert [cache.get(k) for k in ['one', 'three', 'four']] == [1, 3, 4]
+
+    def test_set_replaces_existing_entry(self, cache):
+        cache.set('key', 'old', scopes=['http://example.com'])
+        cache.set('key', 'new', scopes=['http://example.org'])
+
+        cache.invalidate('http://example.com')
+
+        assert cache.get('key') == 'new'
+        assert len(cache) == 1
+
+    def test_invalidate_removes_entries_with_the_uri_in_scope(self, cache):
+        cache.set('one', 1, scopes=['http://example.com', 'http://example.org'])
+        cache.set('two', 2, scopes=['http://example.net'])
+
+        cache.invalidate('http://example.org')
+
+        assert cache.get('one') is None
+        assert cache.get('two') == 2
+
+    def test_invalidate_removes_unscoped_entries(self, cache):
+        cache.set('one', 1)
+
+        cache.invalidate('http://example.com')
+
+        assert cache.get('one') is None
+
+    def test_clear_removes_everything(self, cache):
+        cache.set('one', 1)
+        cache.set('two', 2, scopes=['http://example.com'])
+
+        cache.clear()
+
+        assert len(cache) == 0
+
+    def test_does_not_cache_invalidated_scopes_until_ttl_passes(self,
+                                                                cache,
+                                                                clock):
+        cache.invalidate('http://example.com')
+        cache.set('one', 1, scopes=['http://example.com'])
+        cache.set('two', 2)
+        cache.set('three', 3, scopes=['http://example.org'])
+
+        assert cache.get('one') is None
+        assert cache.get('two') is None
+        assert cache.get('three') == 3
+
+        clock.now += 10
+        cache.set('one', 1, scopes=['http://example.com'])
+        cache.set('two', 2)
+
+        assert cache.get('one') == 1
+        assert cache.get('two') == 2
+
+    def test_does_not_cache_anything_until_ttl_passes_after_clear(self,
+                                                                  cache,
+                                                                  clock):
+        cache.clear()
+        cache.set('one', 1, scopes=['http://example.com'])
+
+        assert cache.get('one') is None
+
+        clock.now += 10
+        cache.set('one', 1, scopes=['http://example.com'])
+
+        assert cache.get('one') == 1
+
+    @pytest.fixture
+    def clock(self):
+        class Clock(object):
+            now = 1000.0
+
+            def __call__(self):
+                return self.now
+        return Clock()
+
+    @pytest.fixture
+    def cache(self, clock):
+        return SearchCache(size=3, ttl=10, clock=clock)
+
+
+class TestCacheKey(object):
+    def test_ignores_principal_order(self):
+        assert (cache_key('index', {}, ['a', 'b']) ==
+                cache_key('index', {}, ['b', 'a']))
+
+    def test_differs_by_principals(self):
+        assert (cache_key('index', {}, ['a']) !=
+                cache_key('index', {}, ['a', 'b']))
+
+    def test_differs_by_body(self):
+        assert (cache_key('index', {'size': 1}, []) !=
+                cache_key('index', {'size': 2}, []))
+
+    def test_differs_by_index(self):
+        assert cache_key('one', {}, []) != cache_key('two', {}, [])
+
+
+class TestQueryScopes(object):
+    def test_returns_the_uri_filter_scopes(self):
+        body = {'query': {'filtered': {
+            'filter': {'and': [{'terms': {'permissions.read': ['a']}},
+                               {'terms': {'target.scope': ['http://a.com']}}]},
+            'query': {'match_all': {}},
+        }}}
+
+        assert query_scopes(body) == ['http://a.com']
+
+    def test_returns_none_if_not_restricted_by_uri(self):
+        body = {'query': {'filtered': {
+            'filter': {'and': [{'terms': {'permissions.read': ['a']}}]},
+            'query': {'match_all': {}},
+        }}}
+
+        assert query_scopes(body) is None
+
+    def test_returns_none_for_unfiltered_query(self):
+        assert query_scopes({'query': {'match_all': {}}}) is None
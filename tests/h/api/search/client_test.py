@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import mock
+import pytest
+
+from h.api.search import client
+
+
+class TestClient(object):
+    def test_clients_share_a_connection(self, Elasticsearch):
+        first = client.Client('http://es:9200', 'hypothesis', timeout=10)
+        second = client.Client('http://es:9200', 'annotator', timeout=10)
+
+        assert first.conn is second.conn
+        Elasticsearch.assert_called_once_with(['http://es:9200'],
+                                              verify_certs=True,
+                                              timeout=10)
+
+    def test_clients_with_different_options_do_not_share(self, Elasticsearch):
+        first = client.Client('http://es:9200', 'hypothesis', timeout=10)
+        second = client.Client('http://es:9200', 'hypothesis', timeout=20)
+
+        assert Elasticsearch.call_count == 2
+        assert first.conn is not second.conn
+
+    def test_stores_the_index(self, Elasticsearch):
+        assert client.Client('http://es:9200', 'hypothesis').index == 'hypothesis'
+
+
+class TestGetConnection(object):
+    def test_creates_new_connection_in_forked_process(self, Elasticsearch, getpid):
+        getpid.return_value = 1
+        parent = client.get_connection('http://es:9200')
+        getpid.return_value = 2
+        child = client.get_connection('http://es:9200')
+
+        assert parent is not child
+        assert Elasticsearch.call_count == 2
+
+    def test_forgets_connections_from_parent_process(self, Elasticsearch, getpid):
+        getpid.return_value = 1
+        client.get_connection('http://es:9200')
+        getpid.return_value = 2
+        client.get_connection('http://es:9200')
+
+        assert [k[0] for k in client._CONNECTIONS] == [2]
+
+
+class TestPoolStats(object):
+    def test_counts_pooled_connections(self, Elasticsearch):
+        conn = client.get_connection('http://es:9200')
+        conn.transport.connection_pool.connections = [
+            fake_connection(maxsize=4, checked_out=1, idle=2,
+                            num_connections=3, num_requests=30),
+            fake_connection(maxsize=4, checked_out=0, idle=1,
+                            num_connections=1, num_requests=5),
+        ]
+
+        assert client.pool_stats() == {'size': 8,
+                                       'in_use': 1,
+                                       'idle': 3,
+                                       'connections_opened': 4,
+                                       'requests': 35}
+
+    def test_ignores_unpooled_connections(self, Elasticsearch):
+        conn = client.get_connection('http://es:9200')
+        conn.transport.connection_pool.connections = [mock.Mock(spec=[])]
+
+        assert client.pool_stats()['size'] == 0
+
+
+def fake_connection(maxsize, checked_out, idle, num_connections, num_requests):
+    connection = mock.Mock(spec=['pool'])
+    connection.pool.pool.maxsize = maxsize
+    connection.pool.pool.queue = ([None] * (maxsize - checked_out - idle) +
+                                  [mock.sentinel.connection] * idle)
+    connection.pool.num_connections = num_connections
+    connection.pool.num_requests = num_requests
+    return connection
+
+
+@pytest.fixture(autouse=True)
+def connections(monkeypatch):
+    monkeypatch.setattr(client, '_CONNECTIONS', {})
+
+
+@pytest.fixture
+def Elasticsearch(patch):
+    Elasticsearch = patch('h.api.search.client.elasticsearch.Elasticsearch')
+    Elasticsearch.side_effect = lambda *args, **kwargs: mock.Mock()
+    return Elasticsearch
+
+
+@pytest.fixture
+def getpid(patch):
+    return patch('h.api.search.client.os.getpid')
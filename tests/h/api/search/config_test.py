@@ -4,7 +4,13 @@ import itertools
 import re
 import urllib
 
+import mock
+import pytest
+
 from h.api.search.config import ANNOTATION_ANALYSIS
+from h.api.search.config import check_aliasable
+from h.api.search.config import get_aliased_index
+from h.api.search.config import update_aliased_index
 
 
 def test_strip_scheme_char_filter():
@@ -51,6 +57,91 @@ def test_uri_part_tokenizer():
     ])
 
 
+class TestGetAliasedIndex(object):
+    def test_it_returns_the_aliased_index(self, client):
+        client.conn.indices.get_alias.return_value = {
+            'hypothesis-20160801': {'aliases': {'hypothesis': {}}}}
+
+        assert get_aliased_index(client) == 'hypothesis-20160801'
+        client.conn.indices.get_alias.assert_called_once_with(name='hypothesis')
+
+    def test_it_returns_none_if_the_index_is_not_an_alias(self, client):
+        client.conn.indices.exists_alias.return_value = False
+
+        assert get_aliased_index(client) is None
+
+    def test_it_raises_if_the_alias_points_to_several_indices(self, client):
+        client.conn.indices.get_alias.return_value = {'one': {}, 'two': {}}
+
+        with pytest.raises(RuntimeError):
+            get_aliased_index(client)
+
+
+class TestUpdateAliasedIndex(object):
+    def test_it_moves_the_alias_atomically(self, client):
+        client.conn.indices.get_alias.return_value = {'hypothesis-old': {}}
+
+        old = update_aliased_index(client, 'hypothesis-new')
+
+        assert old == 'hypothesis-old'
+        client.conn.indices.update_aliases.assert_called_once_with(body={
+            'actions': [
+                {'remove': {'index': 'hypothesis-old', 'alias': 'hypothesis'}},
+                {'add': {'index': 'hypothesis-new', 'alias': 'hypothesis'}},
+            ],
+        })
+        assert not client.conn.indices.delete.called
+
+    def test_it_refuses_to_replace_a_concrete_index(self, client):
+        client.conn.indices.exists_alias.return_value = False
+        client.conn.indices.exists.return_value = True
+
+        with pytest.raises(RuntimeError):
+            update_aliased_index(client, 'hypothesis-new')
+
+        assert not client.conn.indices.delete.called
+        assert not client.conn.indices.update_aliases.called
+
+    def test_it_creates_the_alias_if_there_is_no_index(self, client):
+        client.conn.indices.exists_alias.return_value = False
+        client.conn.indices.exists.return_value = False
+
+        update_aliased_index(client, 'hypothesis-new')
+
+        assert not client.conn.indices.delete.called
+        assert client.conn.indices.update_aliases.called
+
+
+class TestCheckAliasable(object):
+    def test_it_allows_an_alias(self, client):
+        client.conn.indices.get_alias.return_value = {'hypothesis-old': {}}
+
+        check_aliasable(client)
+
+    def test_it_allows_a_missing_index(self, client):
+        client.conn.indices.exists_alias.return_value = False
+        client.conn.indices.exists.return_value = False
+
+        check_aliasable(client)
+
+    def test_it_raises_for_a_concrete_index(self, client):
+        client.conn.indices.exists_alias.return_value = False
+        client.conn.indices.exists.return_value = True
+
+        with pytest.raises(RuntimeError) as exc:
+            check_aliasable(client)
+
+        assert 'hypothesis is an index, not an alias' in str(exc.value)
+        assert not client.conn.indices.delete.called
+
+
+@pytest.fixture
+def client():
+    client = mock.Mock(index='hypothesis')
+    client.conn.indices.exists_alias.return_value = True
+    return client
+
+
 def captures(patterns, text):
     return list(itertools.chain(*(groups(p, text) for p in patterns)))
 
@@ -2,6 +2,8 @@ import mock
 import pytest
 
 from h.api.search import core
+from h.api.search import query as query_lib
+from h.api.search.cache import SearchCache
 
 search_fixtures = pytest.mark.usefixtures('query', 'log')
 
@@ -76,8 +78,8 @@ def test_search_returns_replies(pyramid_request):
 
 
 @search_fixtures
-def test_search_logs_a_warning_if_there_are_too_many_replies(log, pyramid_request):
-    """It should log a warning if there's more than one page of replies."""
+def test_search_returns_a_replies_cursor_if_there_are_too_many_replies(pyramid_request):
+    """It should return a cursor if there's more than one page of replies."""
     parent_results = dummy_search_results(count=3)
     replies_results = dummy_search_results(count=100, name='reply')
     # The second call to search() returns 'total': 11000 but only returns
@@ -85,22 +87,292 @@ def test_search_logs_a_warning_if_there_are_too_many_replies(log, pyramid_reques
     replies_results['hits']['total'] = 11000
     pyramid_request.es.conn.search.side_effect = [parent_results, replies_results]
 
-    core.search(pyramid_request, {}, separate_replies=True)
+    result = core.search(pyramid_request, {}, separate_replies=True)
 
-    assert log.warn.call_count == 1
+    assert result['replies_cursor'] == '100'
 
 
 @search_fixtures
-def test_search_does_not_log_a_warning_if_there_are_not_too_many_replies(log, pyramid_request):
-    """It should not log a warning if there's less than one page of replies."""
+def test_search_does_not_return_a_replies_cursor_if_there_are_not_too_many_replies(pyramid_request):
+    """It should not return a cursor if there's less than one page of replies."""
     pyramid_request.es.conn.search.side_effect = [
         dummy_search_results(count=3),
         dummy_search_results(count=100, start=4, name='reply'),
     ]
 
-    core.search(pyramid_request, {}, separate_replies=True)
+    result = core.search(pyramid_request, {}, separate_replies=True)
+
+    assert 'replies_cursor' not in result
+
+
+@search_fixtures
+def test_search_fetches_the_page_of_replies_after_the_cursor(query, pyramid_request):
+    builder = mock.Mock()
+    query.Builder.side_effect = [mock.Mock(), builder]
+    pyramid_request.es.conn.search.side_effect = [
+        dummy_search_results(count=3),
+        dummy_search_results(count=100, start=4, name='reply'),
+    ]
+
+    core.search(pyramid_request, {}, separate_replies=True,
+                replies_cursor='200')
+
+    builder.build.assert_called_once_with({'limit': core.REPLIES_LIMIT,
+                                           'offset': 200})
+
+
+@search_fixtures
+def test_search_sets_source(query, pyramid_request):
+    core.search(pyramid_request, {}, source=False)
+
+    assert query.Builder.return_value.source is False
+
+
+@search_fixtures
+def test_search_returns_ids_of_hits_without_source(pyramid_request):
+    pyramid_request.es.conn.search.return_value = {
+        'hits': {'total': 2, 'hits': [{'_id': 'id_1'}, {'_id': 'id_2'}]}}
+
+    result = core.search(pyramid_request, {}, source=False)
+
+    assert result['rows'] == [{'id': 'id_1'}, {'id': 'id_2'}]
 
-    assert not log.warn.called
+
+@pytest.mark.usefixtures('log')
+class TestScan(object):
+    def test_scans_with_the_default_query(self, helpers, pyramid_request):
+        core.scan(pyramid_request, {'group': 'abc123'})
+
+        _, kwargs = helpers.scan.call_args
+        assert kwargs['index'] == pyramid_request.es.index
+        filters = kwargs['query']['query']['filtered']['filter']['and']
+        assert {'term': {'group': 'abc123'}} in filters
+        assert kwargs['query'].keys() == ['query']
+
+    def test_builds_the_query_before_iteration(self, helpers, pyramid_request):
+        core.scan(pyramid_request, {})
+
+        assert helpers.scan.called
+
+    def test_returns_annotations(self, helpers, pyramid_request):
+        helpers.scan.return_value = iter(
+            dummy_search_results(count=2)['hits']['hits'])
+
+        result = core.scan(pyramid_request, {})
+
+        assert list(result) == [{'name': 'annotation_1', 'id': 'id_1'},
+                                {'name': 'annotation_2', 'id': 'id_2'}]
+
+    @pytest.fixture
+    def helpers(self, patch):
+        return patch('h.api.search.core.helpers')
+
+    @pytest.fixture
+    def pyramid_request(self, pyramid_request):
+        pyramid_request.registry[core.FILTERS_KEY] = []
+        pyramid_request.registry[core.MATCHERS_KEY] = []
+        return pyramid_request
+
+
+@pytest.mark.usefixtures('log')
+class TestCursorSearch(object):
+    def test_returns_next_cursor_for_full_page(self, pyramid_request):
+        result = core.search(pyramid_request, {'cursor': '', 'limit': 2})
+
+        assert result['next_cursor'] == query_lib.encode_cursor(
+            [2, 'annotation#id_2'])
+
+    def test_next_cursor_selects_the_following_results(self, pyramid_request):
+        result = core.search(pyramid_request, {'cursor': '', 'limit': 2})
+
+        core.search(pyramid_request, {'cursor': result['next_cursor'],
+                                      'limit': 2})
+
+        _, kwargs = pyramid_request.es.conn.search.call_args
+        filters = kwargs['body']['query']['filtered']['filter']['and']
+        assert filters[-1]['or'][0] == {'range': {'updated': {'lt': 2}}}
+
+    def test_no_next_cursor_for_last_page(self, pyramid_request):
+        result = core.search(pyramid_request, {'cursor': '', 'limit': 3})
+
+        assert 'next_cursor' not in result
+
+    def test_no_next_cursor_without_cursor_param(self, pyramid_request):
+        result = core.search(pyramid_request, {'limit': 2})
+
+        assert 'next_cursor' not in result
+
+    @pytest.fixture
+    def pyramid_request(self, pyramid_request):
+        pyramid_request.registry[core.FILTERS_KEY] = []
+        pyramid_request.registry[core.MATCHERS_KEY] = []
+        results = dummy_search_results(count=2)
+        for i, hit in enumerate(results['hits']['hits'], 1):
+            hit['sort'] = [i, 'annotation#' + hit['_id']]
+        pyramid_request.es.conn.search.return_value = results
+        return pyramid_request
+
+
+@pytest.mark.usefixtures('log')
+class TestThreadedSearch(object):
+    def test_searches_for_annotations_and_replies_in_one_request(self,
+                                                                 pyramid_request):
+        core.search(pyramid_request, {'uri': 'http://example.com'},
+                    separate_replies=True)
+
+        assert not pyramid_request.es.conn.search.called
+        assert pyramid_request.es.conn.msearch.call_count == 1
+        _, kwargs = pyramid_request.es.conn.msearch.call_args
+        assert len(kwargs['body']) == 4
+
+    def test_searches_for_top_level_annotations(self, pyramid_request):
+        core.search(pyramid_request, {'uri': 'http://example.com'},
+                    separate_replies=True)
+
+        body = self.msearch_bodies(pyramid_request)[0]
+        filters = body['query']['filtered']['filter']['and']
+        assert {'missing': {'field': 'references'}} in filters
+
+    def test_searches_for_replies_on_the_same_uri(self, pyramid_request):
+        core.search(pyramid_request, {'uri': 'http://example.com',
+                                      'user': 'acct:luke@example.com',
+                                      'limit': 10},
+                    separate_replies=True)
+
+        body = self.msearch_bodies(pyramid_request)[1]
+        filters = body['query']['filtered']['filter']['and']
+        assert {'exists': {'field': 'references'}} in filters
+        assert {'terms': {'target.scope': ['http://example.com']}} in filters
+        assert body['query']['filtered']['query'] == {'match_all': {}}
+        assert body['size'] == core.REPLIES_LIMIT
+        assert body['sort'][0]['updated']['order'] == 'asc'
+
+    def test_returns_annotations(self, pyramid_request):
+        result = core.search(pyramid_request, {'uri': 'http://example.com'},
+                             separate_replies=True)
+
+        assert result['total'] == 2
+        assert result['rows'] == [{'name': 'annotation_1', 'id': 'id_1'},
+                                  {'name': 'annotation_2', 'id': 'id_2'}]
+
+    def test_returns_only_replies_to_the_annotations(self, pyramid_request):
+        result = core.search(pyramid_request, {'uri': 'http://example.com'},
+                             separate_replies=True)
+
+        assert [r['id'] for r in result['replies']] == ['id_3', 'id_5']
+
+    def test_does_not_return_a_replies_cursor(self, pyramid_request):
+        result = core.search(pyramid_request, {'uri': 'http://example.com'},
+                             separate_replies=True)
+
+        assert 'replies_cursor' not in result
+
+    def test_searches_for_replies_by_id_if_there_are_more_replies_on_the_uri(
+            self, pyramid_request):
+        replies = pyramid_request.es.conn.msearch.return_value['responses'][1]
+        replies['hits']['total'] = 10
+        pyramid_request.es.conn.search.return_value = dummy_search_results(
+            start=6, count=2, name='reply')
+
+        result = core.search(pyramid_request, {'uri': 'http://example.com'},
+                             separate_replies=True)
+
+        _, kwargs = pyramid_request.es.conn.search.call_args
+        matchers = kwargs['body']['query']['filtered']['query']['bool']['must']
+        assert {'terms': {'references': ['id_1', 'id_2']}} in matchers
+        assert [r['id'] for r in result['replies']] == ['id_6', 'id_7']
+
+    def test_falls_back_to_a_second_request_if_replies_overflow_the_limit(
+            self, pyramid_request):
+        replies = dummy_search_results(start=3, count=core.REPLIES_LIMIT,
+                                       name='reply')
+        for hit in replies['hits']['hits']:
+            hit['_source']['references'] = ['id_1']
+        replies['hits']['total'] = core.REPLIES_LIMIT + 1
+        pyramid_request.es.conn.msearch.return_value['responses'][1] = replies
+        pyramid_request.es.conn.search.return_value = dummy_search_results(
+            start=1000, count=1, name='reply')
+
+        result = core.search(pyramid_request, {'uri': 'http://example.com'},
+                             separate_replies=True)
+
+        assert pyramid_request.es.conn.msearch.call_count == 1
+        assert pyramid_request.es.conn.search.call_count == 1
+        assert [r['id'] for r in result['replies']] == ['id_1000']
+
+    def test_does_not_fall_back_if_replies_exactly_fill_the_limit(
+            self, pyramid_request):
+        replies = dummy_search_results(start=3, count=core.REPLIES_LIMIT,
+                                       name='reply')
+        for hit in replies['hits']['hits']:
+            hit['_source']['references'] = ['id_1']
+        pyramid_request.es.conn.msearch.return_value['responses'][1] = replies
+
+        result = core.search(pyramid_request, {'uri': 'http://example.com'},
+                             separate_replies=True)
+
+        assert not pyramid_request.es.conn.search.called
+        assert len(result['replies']) == core.REPLIES_LIMIT
+
+    def test_returns_a_replies_cursor_counting_only_replies_to_the_annotations(
+            self, pyramid_request):
+        replies = pyramid_request.es.conn.msearch.return_value['responses'][1]
+        replies['hits']['total'] = 10
+        reply_results = dummy_search_results(start=6, count=2, name='reply')
+        reply_results['hits']['total'] = 4
+        pyramid_request.es.conn.search.return_value = reply_results
+
+        result = core.search(pyramid_request, {'uri': 'http://example.com'},
+                             separate_replies=True)
+
+        assert result['replies_cursor'] == '2'
+
+    def test_fetches_the_page_of_replies_after_the_cursor_by_id(
+            self, pyramid_request):
+        pyramid_request.es.conn.search.side_effect = [
+            dummy_search_results(count=2),
+            dummy_search_results(start=6, count=2, name='reply'),
+        ]
+
+        core.search(pyramid_request, {'uri': 'http://example.com'},
+                    separate_replies=True,
+                    replies_cursor='200')
+
+        assert not pyramid_request.es.conn.msearch.called
+        _, kwargs = pyramid_request.es.conn.search.call_args
+        assert kwargs['body']['from'] == 200
+        matchers = kwargs['body']['query']['filtered']['query']['bool']['must']
+        assert {'terms': {'references': ['id_1', 'id_2']}} in matchers
+
+    def test_uses_the_search_cache(self, pyramid_config, pyramid_request):
+        pyramid_config.registry[core.CACHE_KEY] = SearchCache(size=10, ttl=60)
+
+        for _ in range(2):
+            result = core.search(pyramid_request, {'uri': 'http://example.com'},
+                                 separate_replies=True)
+
+        assert pyramid_request.es.conn.msearch.call_count == 1
+        assert [r['id'] for r in result['replies']] == ['id_3', 'id_5']
+
+    def msearch_bodies(self, pyramid_request):
+        _, kwargs = pyramid_request.es.conn.msearch.call_args
+        return kwargs['body'][1::2]
+
+    @pytest.fixture
+    def pyramid_request(self, pyramid_request):
+        pyramid_request.es.index = 'hypothesis'
+        pyramid_request.stats = mock.Mock(spec_set=['incr'])
+        pyramid_request.registry[core.FILTERS_KEY] = []
+        pyramid_request.registry[core.MATCHERS_KEY] = []
+        replies = dummy_search_results(start=3, count=3, name='reply')
+        references = [['id_1'], ['other'], ['other', 'id_2']]
+        for hit, refs in zip(replies['hits']['hits'], references):
+            hit['_source']['references'] = refs
+        pyramid_request.es.conn.msearch.return_value = {'responses': [
+            dummy_search_results(count=2),
+            replies,
+        ]}
+        return pyramid_request
 
 
 @pytest.mark.parametrize('private', [True, False])
@@ -164,6 +436,136 @@ class instance_of_type(object):
         return '<matcher for instance of type "{}">'.format(self.typename)
 
 
+@pytest.mark.usefixtures('log', 'search_cache')
+class TestSearchCache(object):
+    def test_caches_results(self, pyramid_request):
+        first = core.search(pyramid_request, {'limit': 10})
+        second = core.search(pyramid_request, {'limit': 10})
+
+        assert pyramid_request.es.conn.search.call_count == 1
+        assert first == second
+
+    def test_reports_hits_and_misses(self, pyramid_request):
+        core.search(pyramid_request, {'limit': 10})
+        core.search(pyramid_request, {'limit': 10})
+
+        assert pyramid_request.stats.incr.call_args_list == [
+            mock.call('search.cache.miss'),
+            mock.call('search.cache.hit'),
+        ]
+
+    def test_does_not_share_results_between_different_queries(self,
+                                                              pyramid_request):
+        core.search(pyramid_request, {'limit': 10})
+        core.search(pyramid_request, {'limit': 20})
+
+        assert pyramid_request.es.conn.search.call_count == 2
+
+    def test_does_not_share_results_between_different_principals(self,
+                                                                 pyramid_config,
+                                                                 pyramid_request):
+        core.search(pyramid_request, {'limit': 10}, private=False)
+        pyramid_config.testing_securitypolicy('acct:bob@example.com',
+                                              groupids=['group:foo'])
+        core.search(pyramid_request, {'limit': 10}, private=False)
+
+        assert pyramid_request.es.conn.search.call_count == 2
+
+    def test_bypasses_cache_if_use_cache_false(self, pyramid_request):
+        core.search(pyramid_request, {'limit': 10})
+        core.search(pyramid_request, {'limit': 10}, use_cache=False)
+
+        assert pyramid_request.es.conn.search.call_count == 2
+
+    @pytest.fixture
+    def search_cache(self, pyramid_config):
+        cache = SearchCache(size=10, ttl=60)
+        pyramid_config.registry[core.CACHE_KEY] = cache
+        return cache
+
+    @pytest.fixture
+    def pyramid_request(self, pyramid_request):
+        pyramid_request.es.index = 'hypothesis'
+        pyramid_request.stats = mock.Mock(spec_set=['incr'])
+        return pyramid_request
+
+
+@pytest.mark.usefixtures('storage')
+class TestCountByURI(object):
+    def test_expands_uris_in_one_query(self, pyramid_request, storage):
+        core.count_by_uri(pyramid_request, ['http://example.com',
+                                            'http://example.org'])
+
+        storage.expand_uris.assert_called_once_with(pyramid_request.db,
+                                                    ['http://example.com',
+                                                     'http://example.org'])
+
+    def test_counts_with_one_msearch_request(self, pyramid_request):
+        core.count_by_uri(pyramid_request, ['http://example.com',
+                                            'http://example.org'])
+
+        assert pyramid_request.es.conn.msearch.call_count == 1
+        _, kwargs = pyramid_request.es.conn.msearch.call_args
+        assert kwargs['index'] == pyramid_request.es.index
+        body = kwargs['body']
+        assert len(body) == 4
+        assert body[0] == body[2] == {}
+        assert body[1]['size'] == body[3]['size'] == 0
+
+    def test_filters_by_expanded_uris(self, pyramid_request):
+        core.count_by_uri(pyramid_request, ['http://example.com',
+                                            'http://example.org'])
+
+        _, kwargs = pyramid_request.es.conn.msearch.call_args
+        filters = [q['query']['filtered']['filter']['and']
+                   for q in kwargs['body'][1::2]]
+        assert {'terms': {'target.scope': ['http://example.com',
+                                           'http://example.com/alt']}} in filters[0]
+        assert {'terms': {'target.scope': ['http://example.org']}} in filters[1]
+
+    def test_returns_counts_by_uri(self, pyramid_request):
+        result = core.count_by_uri(pyramid_request, ['http://example.com',
+                                                     'http://example.org'])
+
+        assert result == {'http://example.com': 3, 'http://example.org': 5}
+
+    def test_raises_if_a_search_fails(self, pyramid_request):
+        pyramid_request.es.conn.msearch.return_value = {'responses': [
+            {'hits': {'total': 3}},
+            {'error': 'SearchPhaseExecutionException'},
+        ]}
+
+        with pytest.raises(RuntimeError):
+            core.count_by_uri(pyramid_request, ['http://example.com',
+                                                'http://example.org'])
+
+    def test_returns_empty_dict_for_no_uris(self, pyramid_request, storage):
+        assert core.count_by_uri(pyramid_request, []) == {}
+        assert not storage.expand_uris.called
+        assert not pyramid_request.es.conn.msearch.called
+
+    @pytest.fixture
+    def storage(self, patch):
+        storage = patch('h.api.search.core.storage')
+        storage.expand_uris.return_value = {
+            'http://example.com': ['http://example.com',
+                                   'http://example.com/alt'],
+            'http://example.org': ['http://example.org'],
+        }
+        return storage
+
+    @pytest.fixture
+    def pyramid_request(self, pyramid_request):
+        pyramid_request.es.index = 'hypothesis'
+        pyramid_request.registry[core.FILTERS_KEY] = []
+        pyramid_request.registry[core.MATCHERS_KEY] = []
+        pyramid_request.es.conn.msearch.return_value = {'responses': [
+            {'hits': {'total': 3, 'hits': []}},
+            {'hits': {'total': 5, 'hits': []}},
+        ]}
+        return pyramid_request
+
+
 def dummy_search_results(start=1, count=0, name='annotation'):
     """Generate some dummy search results."""
     out = {'hits': {'total': 0, 'hits': []}}
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+from collections import OrderedDict
+import datetime
+
 import mock
 import pytest
 
@@ -108,13 +111,115 @@ class TestDeleteAnnotation:
         return patch('h.api.search.index.log')
 
 
+@pytest.mark.usefixtures('presenters', 'AnnotationTransformEvent')
+class TestSync(object):
+
+    def test_it_does_nothing_without_actions(self, db_session, es, pyramid_request,
+                                             streaming_bulk):
+        assert index.sync(db_session, es, pyramid_request, {}) == set()
+        assert not streaming_bulk.called
+
+    def test_it_sends_one_bulk_request(self, db_session, es, pyramid_request,
+                                       presenters, streaming_bulk):
+        ann_1, ann_2 = self.annotation(db_session), self.annotation(db_session)
+        presenters.AnnotationSearchIndexPresenter.return_value.asdict.side_effect = [
+            {'id': ann_1.id}, {'id': ann_2.id}]
+        streaming_bulk.side_effect = None
+        streaming_bulk.return_value = []
+
+        index.sync(db_session, es, pyramid_request,
+                   OrderedDict([(ann_1.id, 'index'),
+                                ('deleted-id', 'delete'),
+                                (ann_2.id, 'index')]))
+
+        streaming_bulk.assert_called_once_with(
+            es.conn,
+            GeneratorEquals([
+                {'_op_type': 'index', '_index': 'hypothesis',
+                 '_type': 'annotation', '_id': ann_1.id,
+                 '_source': {'id': ann_1.id}},
+                {'_op_type': 'delete', '_index': 'hypothesis',
+                 '_type': 'annotation', '_id': 'deleted-id'},
+                {'_op_type': 'index', '_index': 'hypothesis',
+                 '_type': 'annotation', '_id': ann_2.id,
+                 '_source': {'id': ann_2.id}},
+            ]),
+            chunk_size=mock.ANY, raise_on_error=False)
+
+    def test_it_notifies_transform_event(self, db_session, es, pyramid_request,
+                                         AnnotationTransformEvent, presenters,
+                                         streaming_bulk):
+        ann = self.annotation(db_session)
+        pyramid_request.registry.notify = mock.Mock()
+
+        index.sync(db_session, es, pyramid_request, {ann.id: 'index'})
+
+        annotation_dict = presenters.AnnotationSearchIndexPresenter.return_value.asdict.return_value
+        AnnotationTransformEvent.assert_called_once_with(pyramid_request,
+                                                         annotation_dict)
+        pyramid_request.registry.notify.assert_called_once_with(
+            AnnotationTransformEvent.return_value)
+
+    def test_it_skips_annotations_missing_from_the_database(self,
+                                                            db_session,
+                                                            es,
+                                                            pyramid_request,
+                                                            streaming_bulk):
+        ann = self.annotation(db_session)
+        db_session.delete(ann)
+        db_session.flush()
+
+        index.sync(db_session, es, pyramid_request, {ann.id: 'index'})
+
+        streaming_bulk.assert_called_once_with(es.conn, GeneratorEquals([]),
+                                               chunk_size=mock.ANY,
+                                               raise_on_error=False)
+
+    def test_it_returns_failed_actions(self, db_session, es, pyramid_request,
+                                       streaming_bulk):
+        streaming_bulk.side_effect = None
+        streaming_bulk.return_value = [
+            (True, {'index': {'_id': 'ok', 'status': 200}}),
+            (False, {'index': {'_id': 'failed-index', 'status': 500}}),
+            (False, {'delete': {'_id': 'failed-delete', 'status': 503}}),
+            (False, {'delete': {'_id': 'not-found', 'status': 404}}),
+        ]
+
+        result = index.sync(db_session, es, pyramid_request, {'x': 'delete'})
+
+        assert result == set(['failed-index', 'failed-delete'])
+
+    @pytest.fixture
+    def presenters(self, patch):
+        return patch('h.api.search.index.presenters')
+
+    @pytest.fixture
+    def AnnotationTransformEvent(self, patch):
+        return patch('h.api.search.index.AnnotationTransformEvent')
+
+    @pytest.fixture
+    def streaming_bulk(self, patch):
+        streaming_bulk = patch('h.api.search.index.es_helpers.streaming_bulk')
+        streaming_bulk.side_effect = lambda client, actions, **kwargs: [
+            (True, {a['_op_type']: {'_id': a['_id'], 'status': 200}})
+            for a in actions]
+        return streaming_bulk
+
+    def annotation(self, db_session):
+        ann = models.Annotation(userid="bob", target_uri="http://example.com")
+        db_session.add(ann)
+        db_session.flush()
+        return ann
+
+
 @pytest.mark.usefixtures('BatchIndexer', 'BatchDeleter')
 class TestReindex(object):
     def test_it_indexes_all_annotations(self, BatchIndexer):
         index.reindex(mock.sentinel.session, mock.sentinel.es, mock.sentinel.request)
 
         BatchIndexer.assert_called_once_with(
-            mock.sentinel.session, mock.sentinel.es, mock.sentinel.request)
+            mock.sentinel.session, mock.sentinel.es, mock.sentinel.request,
+            bulk_load=False)
         assert BatchIndexer.return_value.index_all.called
 
     def test_it_removes_all_deleted_annotations(self, BatchDeleter):
@@ -123,6 +228,25 @@ class TestReindex(object):
         BatchDeleter.assert_called_once_with(mock.sentinel.session, mock.sentinel.es)
         assert BatchDeleter.return_value.delete_all.called
 
+    def test_it_does_not_tune_the_index_by_default(self, bulk_loading):
+        index.reindex(mock.sentinel.session, mock.sentinel.es, mock.sentinel.request)
+
+        assert not bulk_loading.called
+
+    def test_it_indexes_with_bulk_load_tuning(self, BatchIndexer, bulk_loading):
+        bulk_loading.return_value.__enter__.side_effect = \
+            lambda: assert_not_called(BatchIndexer.return_value.index_all)
+
+        index.reindex(mock.sentinel.session, mock.sentinel.es, mock.sentinel.request,
+                      bulk_load=True)
+
+        BatchIndexer.assert_called_once_with(
+            mock.sentinel.session, mock.sentinel.es, mock.sentinel.request,
+            bulk_load=True)
+        bulk_loading.assert_called_once_with(mock.sentinel.es)
+        assert BatchIndexer.return_value.index_all.called
+        assert bulk_loading.return_value.__exit__.called
+
     @pytest.fixture
     def BatchIndexer(self, patch):
         return patch('h.api.search.index.BatchIndexer')
@@ -131,6 +255,409 @@ class TestReindex(object):
     def BatchDeleter(self, patch):
         return patch('h.api.search.index.BatchDeleter')
 
+    @pytest.fixture
+    def bulk_loading(self, patch):
+        return patch('h.api.search.index.bulk_loading')
+
+
+class TestBulkLoading(object):
+    def test_it_disables_refreshes_and_replicas(self, es):
+        with index.bulk_loading(es):
+            es.conn.indices.put_settings.assert_called_once_with(
+                index='hypothesis-20160801', body={
+                    'index': {'refresh_interval': '-1',
+                              'number_of_replicas': 0}})
+
+    def test_it_tunes_the_given_index(self, es):
+        with index.bulk_loading(es, index='hypothesis-new'):
+            pass
+
+        es.conn.indices.get_settings.assert_called_once_with(
+            index='hypothesis-new')
+        es.conn.indices.refresh.assert_called_once_with(index='hypothesis-new')
+
+    def test_it_restores_the_original_settings_and_refreshes(self, es):
+        with index.bulk_loading(es):
+            pass
+
+        assert es.conn.indices.put_settings.call_args_list[-1] == mock.call(
+            index='hypothesis-20160801', body={
+                'index': {'refresh_interval': '30s',
+                          'number_of_replicas': '2'}})
+        es.conn.indices.refresh.assert_called_once_with(index='hypothesis')
+
+    def test_it_restores_the_default_refresh_interval(self, es):
+        del es.conn.indices.get_settings.return_value[
+            'hypothesis-20160801']['settings']['index']['refresh_interval']
+
+        with index.bulk_loading(es):
+            pass
+
+        assert es.conn.indices.put_settings.call_args_list[-1] == mock.call(
+            index='hypothesis-20160801', body={
+                'index': {'refresh_interval': '1s',
+                          'number_of_replicas': '2'}})
+
+    def test_it_restores_the_original_settings_on_failure(self, es):
+        with pytest.raises(RuntimeError):
+            with index.bulk_loading(es):
+                raise RuntimeError('indexing failed')
+
+        assert es.conn.indices.put_settings.call_args_list[-1] == mock.call(
+            index='hypothesis-20160801', body={
+                'index': {'refresh_interval': '30s',
+                          'number_of_replicas': '2'}})
+        assert es.conn.indices.refresh.called
+
+    @pytest.fixture
+    def es(self, es):
+        es.conn.indices.get_settings.return_value = {
+            'hypothesis-20160801': {'settings': {'index': {
+                'refresh_interval': '30s',
+                'number_of_replicas': '2',
+            }}},
+        }
+        return es
+
+
+@pytest.mark.usefixtures('BatchIndexer', 'BatchDeleter', 'check_aliasable',
+                         'configure_index', 'update_aliased_index')
+class TestReindexIntoNewIndex(object):
+    def test_it_refuses_to_replace_a_concrete_index(self,
+                                                    BatchIndexer,
+                                                    check_aliasable,
+                                                    checkpoint,
+                                                    configure_index,
+                                                    es):
+        check_aliasable.side_effect = RuntimeError('hypothesis is an index')
+
+        with pytest.raises(RuntimeError):
+            index.reindex_into_new_index(mock.sentinel.session, es,
+                                         mock.sentinel.request, checkpoint)
+
+        check_aliasable.assert_called_once_with(es)
+        assert not configure_index.called
+        assert not BatchIndexer.called
+
+    def test_it_creates_a_new_index(self, checkpoint, configure_index, es):
+        index.reindex_into_new_index(mock.sentinel.session, es,
+                                     mock.sentinel.request, checkpoint)
+
+        configure_index.assert_called_once_with(es, index=mock.ANY)
+        new_index = configure_index.call_args[1]['index']
+        assert new_index.startswith('hypothesis-')
+
+    def test_it_loads_the_new_index(self, BatchIndexer, checkpoint, es):
+        index.reindex_into_new_index(mock.sentinel.session, es,
+                                     mock.sentinel.request, checkpoint)
+
+        target = BatchIndexer.call_args[0][1]
+        assert target.index == self.new_index(checkpoint)
+        assert target.conn == es.conn
+        indexer = BatchIndexer.return_value
+        assert indexer.pages.call_args_list[0] == mock.call(after=None)
+        assert indexer.index_annotations.call_args_list[:2] == [
+            mock.call(self.pages[0]), mock.call(self.pages[1])]
+
+    def test_it_retries_failed_annotations_once(self, BatchIndexer, checkpoint, es):
+        indexer = BatchIndexer.return_value
+        indexer.index_annotations.side_effect = [set(['id-1']), set(), set()]
+
+        index.reindex_into_new_index(mock.sentinel.session, es,
+                                     mock.sentinel.request, checkpoint)
+
+        indexer.index.assert_called_once_with(set(['id-1']))
+
+    def test_it_checkpoints_after_each_page(self, checkpoint, es):
+        positions = []
+        checkpoint.save.side_effect = lambda s: positions.append(s['position'])
+
+        index.reindex_into_new_index(mock.sentinel.session, es,
+                                     mock.sentinel.request, checkpoint)
+
+        assert positions == [
+            None,
+            (self.pages[0][-1].updated, self.pages[0][-1].id),
+            (self.pages[1][-1].updated, self.pages[1][-1].id),
+        ]
+
+    def test_it_resumes_from_the_checkpoint(self,
+                                            BatchIndexer,
+                                            checkpoint,
+                                            configure_index,
+                                            es):
+        position = (datetime.datetime(2016, 8, 1, 12), 'some-id')
+        checkpoint.load.return_value = {
+            'alias': 'hypothesis',
+            'index': 'hypothesis-20160801000000',
+            'started': datetime.datetime(2016, 8, 1),
+            'position': position,
+        }
+        es.conn.indices.exists.return_value = True
+
+        index.reindex_into_new_index(mock.sentinel.session, es,
+                                     mock.sentinel.request, checkpoint)
+
+        assert not configure_index.called
+        assert BatchIndexer.call_args[0][1].index == 'hypothesis-20160801000000'
+        assert BatchIndexer.return_value.pages.call_args_list[0] == mock.call(
+            after=position)
+
+    def test_it_starts_again_if_the_checkpointed_index_is_gone(self,
+                                                               checkpoint,
+                                                               configure_index,
+                                                               es):
+        checkpoint.load.return_value = {
+            'alias': 'hypothesis',
+            'index': 'hypothesis-20160801000000',
+            'started': datetime.datetime(2016, 8, 1),
+            'position': None,
+        }
+        es.conn.indices.exists.return_value = False
+
+        index.reindex_into_new_index(mock.sentinel.session, es,
+                                     mock.sentinel.request, checkpoint)
+
+        assert configure_index.called
+
+    def test_it_swaps_the_alias(self, checkpoint, es, update_aliased_index):
+        update_aliased_index.return_value = 'hypothesis-old'
+
+        result = index.reindex_into_new_index(mock.sentinel.session, es,
+                                              mock.sentinel.request, checkpoint)
+
+        update_aliased_index.assert_called_once_with(es, self.new_index(checkpoint))
+        assert result == (self.new_index(checkpoint), 'hypothesis-old')
+
+    def test_it_replays_changes_made_during_the_load(self,
+                                                     BatchIndexer,
+                                                     checkpoint,
+                                                     es):
+        index.reindex_into_new_index(mock.sentinel.session, es,
+                                     mock.sentinel.request, checkpoint)
+
+        started = checkpoint.save.call_args_list[0][0][0]['started']
+        indexer = BatchIndexer.return_value
+        assert indexer.pages.call_args_list[1] == mock.call(
+            after=(started - index.REPLAY_MARGIN, None))
+        indexer.index_annotations.assert_called_with(self.pages[2])
+
+    def test_it_removes_deleted_annotations(self, BatchDeleter, checkpoint, es):
+        index.reindex_into_new_index(mock.sentinel.session, es,
+                                     mock.sentinel.request, checkpoint)
+
+        target = BatchDeleter.call_args[0][1]
+        assert target.index == self.new_index(checkpoint)
+        assert BatchDeleter.return_value.delete_all.called
+
+    def test_it_bulk_loads_the_new_index(self, BatchIndexer, checkpoint, es,
+                                         patch, update_aliased_index):
+        bulk_loading = patch('h.api.search.index.bulk_loading')
+        bulk_loading.return_value.__exit__.side_effect = \
+            lambda *args: assert_not_called(update_aliased_index)
+
+        index.reindex_into_new_index(mock.sentinel.session, es,
+                                     mock.sentinel.request, checkpoint,
+                                     bulk_load=True)
+
+        assert BatchIndexer.call_args[1] == {'bulk_load': True}
+        target = bulk_loading.call_args[0][0]
+        assert target.index == self.new_index(checkpoint)
+        assert bulk_loading.return_value.__exit__.called
+
+    def test_it_saves_the_settings_to_restore_before_bulk_loading(
+            self, checkpoint, es, patch):
+        bulk_loading = patch('h.api.search.index.bulk_loading')
+        saved = []
+        bulk_loading.return_value.__enter__.side_effect = \
+            lambda *args: saved.append(checkpoint.save.call_args[0][0].copy())
+
+        index.reindex_into_new_index(mock.sentinel.session, es,
+                                     mock.sentinel.request, checkpoint,
+                                     bulk_load=True)
+
+        settings = {self.new_index(checkpoint): {'refresh_interval': '1s',
+                                                 'number_of_replicas': '1'}}
+        assert bulk_loading.call_args[1] == {'original': settings}
+        assert saved[0]['settings'] == settings
+
+    def test_it_restores_the_saved_settings_when_resuming_a_bulk_load(
+            self, checkpoint, es):
+        checkpoint.load.return_value = {
+            'alias': 'hypothesis',
+            'index': 'hypothesis-20160801000000',
+            'started': datetime.datetime(2016, 8, 1),
+            'position': None,
+            'settings': {'hypothesis-20160801000000': {
+                'refresh_interval': '1s', 'number_of_replicas': '1'}},
+        }
+        es.conn.indices.exists.return_value = True
+        # The interrupted load left the index tuned for bulk loading.
+        es.conn.indices.get_settings.side_effect = None
+        es.conn.indices.get_settings.return_value = {
+            'hypothesis-20160801000000': {'settings': {'index': {
+                'refresh_interval': '-1', 'number_of_replicas': '0'}}}}
+
+        index.reindex_into_new_index(mock.sentinel.session, es,
+                                     mock.sentinel.request, checkpoint,
+                                     bulk_load=True)
+
+        assert es.conn.indices.put_settings.call_args_list[-1] == mock.call(
+            index='hypothesis-20160801000000', body={
+                'index': {'refresh_interval': '1s',
+                          'number_of_replicas': '1'}})
+
+    def test_it_clears_the_checkpoint(self, checkpoint, es):
+        index.reindex_into_new_index(mock.sentinel.session, es,
+                                     mock.sentinel.request, checkpoint)
+
+        assert checkpoint.clear.called
+
+    def new_index(self, checkpoint):
+        return checkpoint.save.call_args_list[0][0][0]['index']
+
+    pages = [
+        [mock.Mock(updated=datetime.datetime(2016, 8, 1), id='id-1')],
+        [mock.Mock(updated=datetime.datetime(2016, 8, 2), id='id-2')],
+        [mock.Mock(updated=datetime.datetime(2016, 8, 3), id='id-3')],
+    ]
+
+    @pytest.fixture
+    def BatchIndexer(self, patch):
+        BatchIndexer = patch('h.api.search.index.BatchIndexer')
+        BatchIndexer.return_value.pages.side_effect = [self.pages[:2],
+                                                       self.pages[2:]]
+        BatchIndexer.return_value.index_annotations.return_value = set()
+        BatchIndexer.return_value.index.return_value = set()
+        return BatchIndexer
+
+    @pytest.fixture
+    def BatchDeleter(self, patch):
+        return patch('h.api.search.index.BatchDeleter')
+
+    @pytest.fixture
+    def check_aliasable(self, patch):
+        return patch('h.api.search.index.check_aliasable')
+
+    @pytest.fixture
+    def configure_index(self, patch):
+        return patch('h.api.search.index.configure_index')
+
+    @pytest.fixture
+    def update_aliased_index(self, patch):
+        return patch('h.api.search.index.update_aliased_index')
+
+    @pytest.fixture
+    def es(self):
+        es = client.Client('http://localhost:9200', 'hypothesis')
+        es.conn = mock.Mock()
+        es.conn.indices.get_settings.side_effect = lambda index: {
+            index: {'settings': {'index': {'refresh_interval': '1s',
+                                           'number_of_replicas': '1'}}}}
+        return es
+
+    @pytest.fixture
+    def checkpoint(self):
+        checkpoint = mock.Mock(spec=index.Checkpoint('unused'))
+        checkpoint.load.return_value = None
+        return checkpoint
+
+
+class TestCheckpoint(object):
+    def test_load_returns_none_without_a_checkpoint(self, checkpoint):
+        assert checkpoint.load() is None
+
+    @pytest.mark.parametrize('position', [
+        None,
+        (datetime.datetime(2016, 8, 1, 12, 30, 0, 250), 'some-id'),
+        (datetime.datetime(2016, 8, 1, 12, 30), 'some-id'),
+    ])
+    def test_load_returns_the_saved_state(self, checkpoint, position):
+        state = {'alias': 'hypothesis',
+                 'index': 'hypothesis-20160801000000',
+                 'started': datetime.datetime(2016, 8, 1),
+                 'position': position}
+
+        checkpoint.save(state)
+
+        assert checkpoint.load() == state
+
+    def test_save_replaces_the_saved_state(self, checkpoint):
+        state = {'alias': 'hypothesis',
+                 'index': 'hypothesis-20160801000000',
+                 'started': datetime.datetime(2016, 8, 1),
+                 'position': None}
+        checkpoint.save(state)
+
+        state['position'] = (datetime.datetime(2016, 8, 2), 'some-id')
+        checkpoint.save(state)
+
+        assert checkpoint.load() == state
+
+    def test_load_returns_the_saved_index_settings(self, checkpoint):
+        state = {'alias': 'hypothesis',
+                 'index': 'hypothesis-20160801000000',
+                 'started': datetime.datetime(2016, 8, 1),
+                 'position': None,
+                 'settings': {'hypothesis-20160801000000': {
+                     'refresh_interval': '1s', 'number_of_replicas': '1'}}}
+
+        checkpoint.save(state)
+
+        assert checkpoint.load() == state
+
+    def test_clear_removes_the_saved_state(self, checkpoint):
+        checkpoint.save({'alias': 'hypothesis',
+                         'index': 'hypothesis-20160801000000',
+                         'started': datetime.datetime(2016, 8, 1),
+                         'position': None})
+
+        checkpoint.clear()
+
+        assert checkpoint.load() is None
+
+    def test_clear_does_nothing_without_a_checkpoint(self, checkpoint):
+        checkpoint.clear()
+
+    @pytest.fixture
+    def checkpoint(self, tmpdir):
+        return index.Checkpoint(str(tmpdir.join('checkpoint.json')))
+
+
+class TestPartitions(object):
+    def test_it_returns_one_unbounded_partition_without_annotations(self, db_session):
+        assert index.partitions(db_session, 4) == [
+            index.Partition(start=None, end=None)]
+
+    @pytest.mark.parametrize('count', [1, 2, 3, 7, 10])
+    def test_partitions_cover_all_annotations_once(self, db_session, count):
+        annotations = [models.Annotation(userid="bob", target_uri="http://example.com")
+                       for _ in range(7)]
+        db_session.add_all(annotations)
+        db_session.flush()
+
+        partitions = index.partitions(db_session, count)
+
+        ids = []
+        for partition in partitions:
+            ids.extend(a.id for a in self.annotations_in(db_session, partition))
+        assert sorted(ids) == sorted(a.id for a in annotations)
+        assert len(partitions) == min(count, 7)
+
+    def test_partitions_have_similar_sizes(self, db_session):
+        db_session.add_all([models.Annotation(userid="bob", target_uri="http://example.com")
+                            for _ in range(10)])
+        db_session.flush()
+
+        partitions = index.partitions(db_session, 3)
+
+        sizes = [len(self.annotations_in(db_session, p)) for p in partitions]
+        assert sizes == [4, 4, 2]
+
+    def annotations_in(self, db_session, partition):
+        indexer = index.BatchIndexer(db_session, mock.MagicMock(), mock.Mock())
+        return list(indexer._stream_partition_annotations(partition))
+
 
 class TestBatchIndexer(object):
     def test_index_all(self, indexer, index):
@@ -154,7 +681,8 @@ class TestBatchIndexer(object):
 
         streaming_bulk.assert_called_once_with(
             indexer.es_client.conn, GeneratorEquals([ann_1, ann_2]),
-            chunk_size=mock.ANY, raise_on_error=False, expand_action_callback=mock.ANY)
+            chunk_size=mock.ANY, max_chunk_bytes=mock.ANY, raise_on_error=False,
+            expand_action_callback=mock.ANY)
 
     def test_index_indexes_filtered_annotations_to_es(self, db_session, indexer, streaming_bulk):
         ann_1, ann_2 = self.annotation(), self.annotation()
@@ -165,7 +693,8 @@ class TestBatchIndexer(object):
 
         streaming_bulk.assert_called_once_with(
             indexer.es_client.conn, GeneratorEquals([ann_2]),
-            chunk_size=mock.ANY, raise_on_error=False, expand_action_callback=mock.ANY)
+            chunk_size=mock.ANY, max_chunk_bytes=mock.ANY, raise_on_error=False,
+            expand_action_callback=mock.ANY)
 
     def test_index_correctly_presents_bulk_actions(self,
                                                    db_session,
@@ -216,10 +745,136 @@ class TestBatchIndexer(object):
         result = indexer.index()
         assert result == set([ann_fail_1.id, ann_fail_2.id])
 
+    @pytest.mark.parametrize('chunksize', [1, 2, 3, 5, 100])
+    def test_stream_all_annotations_yields_each_annotation_once(self,
+                                                                db_session,
+                                                                indexer,
+                                                                chunksize):
+        # Several annotations share timestamps, so pages split between them.
+        timestamps = [datetime.datetime(2016, 1, 1)] * 3 + \
+                     [datetime.datetime(2016, 1, 2)] * 2
+        annotations = [self.annotation() for _ in timestamps]
+        for annotation, timestamp in zip(annotations, timestamps):
+            annotation.updated = timestamp
+        db_session.add_all(annotations)
+        db_session.flush()
+
+        streamed = list(indexer._stream_all_annotations(chunksize=chunksize))
+
+        assert sorted(a.id for a in streamed) == sorted(a.id for a in annotations)
+        assert [a.updated for a in streamed] == sorted(timestamps)
+
+    def test_stream_all_annotations_yields_nothing_without_annotations(self, indexer):
+        assert list(indexer._stream_all_annotations()) == []
+
+    def test_index_partition_indexes_annotations_in_the_partition(self,
+                                                                  db_session,
+                                                                  indexer,
+                                                                  streaming_bulk):
+        db_session.add_all([self.annotation() for _ in range(3)])
+        db_session.flush()
+        # Partitions are ranges in the database's order of ids, which isn't
+        # the order of their URL-safe string forms.
+        annotations = db_session.query(models.Annotation). \
+            order_by(models.Annotation.id).all()
+        partition = index.Partition(start=annotations[1].id, end=annotations[2].id)
+
+        indexer.index_partition(partition)
+
+        streaming_bulk.assert_called_once_with(
+            indexer.es_client.conn, GeneratorEquals([annotations[1]]),
+            chunk_size=mock.ANY, max_chunk_bytes=mock.ANY, raise_on_error=False,
+            expand_action_callback=mock.ANY)
+
+    def test_stream_partition_annotations_loads_a_page_at_a_time(self,
+                                                                db_session,
+                                                                indexer):
+        db_session.add_all([self.annotation() for _ in range(5)])
+        db_session.flush()
+        ids = [a.id for a in db_session.query(models.Annotation).
+               order_by(models.Annotation.id)]
+        partition = index.Partition(start=ids[1], end=ids[4])
+
+        with mock.patch.object(indexer, 'pages',
+                               wraps=indexer.pages) as pages:
+            streamed = list(indexer._stream_partition_annotations(partition,
+                                                                  chunksize=2))
+
+        pages.assert_called_once_with(chunksize=2, partition=partition)
+        assert sorted(a.id for a in streamed) == sorted(ids[1:4])
+
+    def test_index_partition_returns_count_and_failures(self, indexer, index,
+                                                        patch, streaming_bulk):
+        stream = patch('h.api.search.index.BatchIndexer._stream_partition_annotations')
+        stream.return_value = [mock.sentinel.ann_1,
+                               mock.sentinel.ann_2,
+                               mock.sentinel.ann_3]
+        streaming_bulk.return_value = [(True, {'index': {'_id': 'id-1'}}),
+                                       (False, {'index': {'_id': 'id-2'}}),
+                                       (False, {'index': {'_id': 'id-3'}})]
+        index.return_value = set(['id-3'])
+
+        result = indexer.index_partition(mock.sentinel.partition)
+
+        index.assert_called_once_with(indexer, set(['id-2', 'id-3']))
+        assert result == (2, set(['id-3']))
+
+    def test_index_annotations_sends_a_bulk_request_per_chunk(self,
+                                                              indexer,
+                                                              streaming_bulk):
+        indexer.chunk_size = 2
+        annotations = [mock.sentinel.ann_1,
+                       mock.sentinel.ann_2,
+                       mock.sentinel.ann_3]
+
+        indexer.index_annotations(iter(annotations))
+
+        chunks = [c[0][1] for c in streaming_bulk.call_args_list]
+        assert chunks == [annotations[:2], annotations[2:]]
+
+    def test_index_annotations_logs_throughput_per_chunk(self,
+                                                         indexer,
+                                                         log,
+                                                         streaming_bulk):
+        indexer.chunk_size = 2
+
+        indexer.index_annotations([mock.sentinel.ann_1,
+                                   mock.sentinel.ann_2,
+                                   mock.sentinel.ann_3])
+
+        assert log.info.call_count == 2
+        assert log.info.call_args_list[0][0][1] == 2
+        assert log.info.call_args_list[1][0][1] == 1
+
+    @pytest.mark.parametrize('bulk_load,chunk_size,max_chunk_bytes', [
+        (False, index.CHUNK_SIZE, index.MAX_CHUNK_BYTES),
+        (True, index.BULK_LOAD_CHUNK_SIZE, index.BULK_LOAD_MAX_CHUNK_BYTES),
+    ])
+    def test_bulk_load_uses_larger_chunks(self,
+                                          db_session,
+                                          pyramid_request,
+                                          streaming_bulk,
+                                          bulk_load,
+                                          chunk_size,
+                                          max_chunk_bytes):
+        indexer = index.BatchIndexer(db_session, mock.MagicMock(),
+                                     pyramid_request, bulk_load=bulk_load)
+
+        indexer.index_annotations([mock.sentinel.ann])
+
+        streaming_bulk.assert_called_once_with(
+            indexer.es_client.conn, [mock.sentinel.ann],
+            chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes,
+            raise_on_error=False, expand_action_callback=mock.ANY)
+
     @pytest.fixture
     def indexer(self, db_session, pyramid_request):
         return index.BatchIndexer(db_session, mock.MagicMock(), pyramid_request)
 
+    @pytest.fixture
+    def log(self, patch):
+        return patch('h.api.search.index.log')
+
     @pytest.fixture
     def index(self, patch):
         return patch('h.api.search.index.BatchIndexer.index')
@@ -378,6 +1033,10 @@ class TestBatchDeleter(object):
         return ann
 
 
+def assert_not_called(mock_):
+    assert not mock_.called
+
+
 @pytest.fixture
 def es():
     mock_es = mock.Mock(spec=client.Client('localhost', 'hypothesis'))
@@ -6,6 +6,7 @@ from hypothesis import strategies as st
 from hypothesis import given
 from webob import multidict
 
+from h.api.schemas import ValidationError
 from h.api.search import query
 
 MISSING = object()
@@ -134,6 +135,80 @@ def test_builder_with_custom_order():
     assert sort[0]["updated"]["order"] == "asc"
 
 
+def test_builder_without_cursor_does_not_sort_by_uid():
+    builder = query.Builder()
+
+    q = builder.build({})
+
+    assert len(q["sort"]) == 1
+
+
+def test_builder_with_cursor_breaks_ties_by_uid():
+    builder = query.Builder()
+
+    q = builder.build({"cursor": "", "order": "asc"})
+
+    assert q["sort"][1] == {"_uid": {"order": "asc"}}
+
+
+def test_builder_with_cursor_ignores_offset():
+    builder = query.Builder()
+
+    q = builder.build({"cursor": "", "offset": 100})
+
+    assert q["from"] == 0
+
+
+def test_builder_with_empty_cursor_does_not_filter():
+    builder = query.Builder()
+
+    q = builder.build({"cursor": ""})
+
+    assert q["query"] == {"match_all": {}}
+
+
+@pytest.mark.parametrize('cursor', ["foo", "W10=", query.encode_cursor(3)])
+def test_builder_with_invalid_cursor_raises(cursor):
+    builder = query.Builder()
+
+    with pytest.raises(ValidationError):
+        builder.build({"cursor": cursor})
+
+
+@pytest.mark.parametrize('order,op', [('desc', 'lt'), ('asc', 'gt')])
+def test_builder_with_cursor_filters_results_after_cursor(order, op):
+    builder = query.Builder()
+    cursor = query.encode_cursor([1466000000000, "annotation#abc123"])
+
+    q = builder.build({"cursor": cursor, "order": order})
+
+    assert q["query"]["filtered"]["filter"] == {"and": [{"or": [
+        {"range": {"updated": {op: 1466000000000}}},
+        {"and": [
+            {"term": {"updated": 1466000000000}},
+            {"range": {"_uid": {op: "annotation#abc123"}}},
+        ]},
+    ]}]}
+
+
+def test_builder_returns_all_fields_by_default():
+    builder = query.Builder()
+
+    q = builder.build({})
+
+    assert "_source" not in q
+
+
+@pytest.mark.parametrize('source', [False, ["id", "uri"]])
+def test_builder_with_source(source):
+    builder = query.Builder()
+    builder.source = source
+
+    q = builder.build({})
+
+    assert q["_source"] == source
+
+
 def test_builder_defaults_to_match_all():
     """If no query params are given a "match_all": {} query is returned."""
     builder = query.Builder()
@@ -363,6 +438,18 @@ def test_urifilter_queries_multiple_uris(storage, uri):
                                          "http://tigers.com"])
 
 
+def test_scopefilter_normalizes_into_terms_filter(uri):
+    uri.normalize.side_effect = lambda x: x[:-1]  # Strip the trailing slash
+    scopefilter = query.ScopeFilter(["http://giraffes.com/",
+                                     "https://elephants.com/"])
+
+    result = scopefilter({})
+
+    assert result == {"terms":
+        {"target.scope": ["http://giraffes.com", "https://elephants.com"]}
+    }
+
+
 def test_anymatcher():
     anymatcher = query.AnyMatcher()
 
@@ -91,6 +91,61 @@ class TestExpandURI(object):
         ]
 
 
+class TestExpandURIs(object):
+
+    def test_expand_uris_no_document(self, db_session):
+        actual = storage.expand_uris(db_session, ['http://example.com/'])
+        assert actual == {'http://example.com/': ['http://example.com/']}
+
+    def test_expand_uris_no_uris(self, db_session):
+        assert storage.expand_uris(db_session, []) == {}
+
+    def test_expand_uris_document_doesnt_expand_canonical_uris(self, db_session):
+        document = Document(document_uris=[
+            DocumentURI(uri='http://foo.com/', claimant='http://example.com'),
+            DocumentURI(uri='http://bar.com/', claimant='http://example.com'),
+            DocumentURI(uri='http://example.com/', type='rel-canonical',
+                        claimant='http://example.com'),
+        ])
+        db_session.add(document)
+        db_session.flush()
+
+        actual = storage.expand_uris(db_session, ['http://example.com/'])
+
+        assert actual == {'http://example.com/': ['http://example.com/']}
+
+    def test_expand_uris_document_uris(self, db_session):
+        db_session.add(Document(document_uris=[
+            DocumentURI(uri='http://foo.com/', claimant='http://bar.com'),
+            DocumentURI(uri='http://bar.com/', claimant='http://bar.com'),
+        ]))
+        db_session.add(Document(document_uris=[
+            DocumentURI(uri='http://baz.com/', claimant='http://baz.com'),
+        ]))
+        db_session.flush()
+
+        actual = storage.expand_uris(db_session, ['http://foo.com/',
+                                                  'http://baz.com/',
+                                                  'http://example.com/'])
+
+        assert sorted(actual['http://foo.com/']) == ['http://bar.com/',
+                                                     'http://foo.com/']
+        assert actual['http://baz.com/'] == ['http://baz.com/']
+        assert actual['http://example.com/'] == ['http://example.com/']
+
+    def test_expand_uris_matches_expand_uri(self, db_session):
+        db_session.add(Document(document_uris=[
+            DocumentURI(uri='http://foo.com/', claimant='http://bar.com'),
+            DocumentURI(uri='http://bar.com/', claimant='http://bar.com'),
+        ]))
+        db_session.flush()
+
+        actual = storage.expand_uris(db_session, ['http://foo.com/'])
+
+        assert actual['http://foo.com/'] == storage.expand_uri(
+            db_session, 'http://foo.com/')
+
+
 @pytest.mark.usefixtures('models',
                          'update_document_metadata')
 class TestCreateAnnotation(object):
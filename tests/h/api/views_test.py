@@ -37,6 +37,7 @@ class TestIndex(object):
 
     def test_it_returns_the_right_links(self, pyramid_config, pyramid_request):
         pyramid_config.add_route('api.search', '/dummy/search')
+        pyramid_config.add_route('api.export', '/dummy/export')
         pyramid_config.add_route('api.annotations', '/dummy/annotations')
         pyramid_config.add_route('api.annotation', '/dummy/annotations/:id')
 
@@ -58,9 +59,60 @@ class TestIndex(object):
             host + '/dummy/annotations/:id')
         assert links['search']['method'] == 'GET'
         assert links['search']['url'] == host + '/dummy/search'
+        assert links['export']['method'] == 'GET'
+        assert links['export']['url'] == host + '/dummy/export'
 
 
-@pytest.mark.usefixtures('search_lib', 'AnnotationJSONPresenter')
+@pytest.mark.usefixtures('search_lib', 'AnnotationSearchHitJSONPresenter')
+class TestExport(object):
+
+    def test_it_scans(self, pyramid_request, search_lib):
+        views.export(pyramid_request)
+
+        search_lib.scan.assert_called_once_with(pyramid_request,
+                                                pyramid_request.params)
+
+    def test_it_streams_ndjson(self, pyramid_request):
+        response = views.export(pyramid_request)
+
+        assert response.content_type == 'application/x-ndjson'
+        assert list(response.app_iter) == ['{"giraffe": 1}\n',
+                                           '{"giraffe": 2}\n']
+
+    def test_it_presents_annotations(self,
+                                     pyramid_request,
+                                     AnnotationSearchHitJSONPresenter):
+        response = views.export(pyramid_request)
+        list(response.app_iter)
+
+        assert AnnotationSearchHitJSONPresenter.call_count == 2
+
+    def test_it_reads_annotations_as_the_response_is_sent(self,
+                                                          pyramid_request,
+                                                          search_lib):
+        rows = iter([{'id': 'foo'}, {'id': 'bar'}])
+        search_lib.scan.return_value = rows
+
+        response = views.export(pyramid_request)
+        next(iter(response.app_iter))
+
+        assert list(rows) == [{'id': 'bar'}]
+
+    @pytest.fixture
+    def search_lib(self, patch):
+        search_lib = patch('h.api.views.search_lib')
+        search_lib.scan.return_value = iter([{'id': 'foo'}, {'id': 'bar'}])
+        return search_lib
+
+    @pytest.fixture
+    def AnnotationSearchHitJSONPresenter(self, patch):
+        cls = patch('h.api.views.AnnotationSearchHitJSONPresenter')
+        cls.return_value.asdict.side_effect = [{'giraffe': 1},
+                                               {'giraffe': 2}]
+        return cls
+
+
+@pytest.mark.usefixtures('search_lib', 'AnnotationSearchHitJSONPresenter')
 class TestSearch(object):
 
     def test_it_searches(self, pyramid_request, search_lib):
@@ -68,7 +120,41 @@ class TestSearch(object):
 
         search_lib.search.assert_called_once_with(pyramid_request,
                                                   pyramid_request.params,
-                                                  separate_replies=False)
+                                                  separate_replies=False,
+                                                  replies_cursor=None)
+
+    def test_it_passes_the_replies_cursor(self, pyramid_request, search_lib):
+        pyramid_request.params = {'_separate_replies': '1',
+                                  '_replies_cursor': '200'}
+
+        views.search(pyramid_request)
+
+        search_lib.search.assert_called_once_with(pyramid_request,
+                                                  {},
+                                                  separate_replies='1',
+                                                  replies_cursor='200')
+
+    def test_it_warns_about_deep_offsets(self, pyramid_request):
+        pyramid_request.params = {'offset': '1001'}
+
+        views.search(pyramid_request)
+
+        assert 'cursor' in pyramid_request.response.headers['Warning']
+
+    def test_it_does_not_warn_about_shallow_offsets(self, pyramid_request):
+        pyramid_request.params = {'offset': '1000'}
+
+        views.search(pyramid_request)
+
+        assert 'Warning' not in pyramid_request.response.headers
+
+    def test_deep_offset_warning_depth_is_configurable(self, pyramid_request):
+        pyramid_request.registry.settings['h.search.offset_warning_depth'] = 10
+        pyramid_request.params = {'offset': '20'}
+
+        views.search(pyramid_request)
+
+        assert 'Warning' in pyramid_request.response.headers
 
     def test_it_returns_search_results(self, pyramid_request, search_lib):
         search_lib.search.return_value = {'total': 0, 'rows': []}
@@ -80,10 +166,10 @@ class TestSearch(object):
     def test_it_presents_annotations(self,
                                      pyramid_request,
                                      search_lib,
-                                     AnnotationJSONPresenter):
+                                     AnnotationSearchHitJSONPresenter):
         search_lib.search.return_value = {'total': 2, 'rows': [{'foo': 'bar'},
                                                                {'baz': 'bat'}]}
-        presenter = AnnotationJSONPresenter.return_value
+        presenter = AnnotationSearchHitJSONPresenter.return_value
         presenter.asdict.return_value = {'giraffe': True}
 
         result = views.search(pyramid_request)
@@ -94,13 +180,13 @@ class TestSearch(object):
     def test_it_presents_replies(self,
                                  pyramid_request,
                                  search_lib,
-                                 AnnotationJSONPresenter):
+                                 AnnotationSearchHitJSONPresenter):
         pyramid_request.params = {'_separate_replies': '1'}
         search_lib.search.return_value = {'total': 1,
                                           'rows': [{'foo': 'bar'}],
                                           'replies': [{'baz': 'bat'},
                                                       {'baz': 'bat'}]}
-        presenter = AnnotationJSONPresenter.return_value
+        presenter = AnnotationSearchHitJSONPresenter.return_value
         presenter.asdict.return_value = {'giraffe': True}
 
         result = views.search(pyramid_request)
@@ -426,6 +512,11 @@ def AnnotationJSONPresenter(patch):
     return patch('h.api.views.AnnotationJSONPresenter')
 
 
+@pytest.fixture
+def AnnotationSearchHitJSONPresenter(patch):
+    return patch('h.api.views.AnnotationSearchHitJSONPresenter')
+
+
 @pytest.fixture
 def search_lib(patch):
     return patch('h.api.views.search_lib')
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import mock
+import pytest
+
+from h.badge import models
+from h.badge.blocklist import BlocklistCache, Matcher
+
+
+class TestMatcher(object):
+    @pytest.mark.parametrize('pattern,uri', [
+        ('http://example.com', 'http://example.com'),
+        ('%//example.com%', 'http://example.com/'),
+        ('%//example.com%', 'https://example.com/foo'),
+        ('http://example.com/_', 'http://example.com/a'),
+        ('http://example.com/50\\%', 'http://example.com/50%'),
+        ('http://example.com/a\\_b', 'http://example.com/a_b'),
+        ('http://example.com/(a)+[b]', 'http://example.com/(a)+[b]'),
+        ('%', 'http://example.com/\nfoo'),
+    ])
+    def test_matches(self, pattern, uri):
+        assert Matcher([pattern]).matches(uri)
+
+    @pytest.mark.parametrize('pattern,uri', [
+        ('http://example.com', 'http://example.com/'),
+        ('http://example.com', 'http://EXAMPLE.com'),
+        ('http://example.com', 'xhttp://example.com'),
+        ('http://example.com/_', 'http://example.com/'),
+        ('http://example.com/_', 'http://example.com/ab'),
+        ('http://example.com/50\\%', 'http://example.com/500'),
+        ('http://example.com/a\\_b', 'http://example.com/axb'),
+        ('http://example.com/a.b', 'http://example.com/axb'),
+    ])
+    def test_does_not_match(self, pattern, uri):
+        assert not Matcher([pattern]).matches(uri)
+
+    def test_matches_any_pattern(self):
+        matcher = Matcher(['http://example.com', 'http://example.org/%'])
+
+        assert matcher.matches('http://example.com')
+        assert matcher.matches('http://example.org/foo')
+        assert not matcher.matches('http://example.net')
+
+    def test_empty_matcher_matches_nothing(self):
+        assert not Matcher([]).matches('http://example.com')
+
+
+class TestBlocklistCache(object):
+    def test_is_blocked(self, cache, db_session):
+        db_session.add(models.Blocklist(uri='http://example.com'))
+        db_session.add(models.Blocklist(uri='%//example.org%'))
+        db_session.flush()
+
+        assert cache.is_blocked(db_session, 'http://example.com')
+        assert cache.is_blocked(db_session, 'https://example.org/foo')
+        assert not cache.is_blocked(db_session, 'http://example.com/foo')
+
+    def test_does_not_check_for_changes_within_interval(self,
+                                                        cache,
+                                                        clock,
+                                                        db_session):
+        cache.is_blocked(db_session, 'http://example.com')
+        db_session.add(models.Blocklist(uri='http://example.com'))
+        db_session.flush()
+        clock.return_value = 159
+
+        assert not cache.is_blocked(db_session, 'http://example.com')
+
+    def test_picks_up_additions_after_interval(self, cache, clock, db_session):
+        cache.is_blocked(db_session, 'http://example.com')
+        db_session.add(models.Blocklist(uri='http://example.com'))
+        db_session.flush()
+        clock.return_value = 160
+
+        assert cache.is_blocked(db_session, 'http://example.com')
+
+    def test_picks_up_removals_after_interval(self, cache, clock, db_session):
+        db_session.add(models.Blocklist(uri='http://example.com'))
+        db_session.flush()
+        cache.is_blocked(db_session, 'http://example.com')
+        db_session.query(models.Blocklist).delete()
+        clock.return_value = 160
+
+        assert not cache.is_blocked(db_session, 'http://example.com')
+
+    def test_picks_up_changes_immediately_after_invalidate(self,
+                                                           cache,
+                                                           db_session):
+        cache.is_blocked(db_session, 'http://example.com')
+        db_session.add(models.Blocklist(uri='http://example.com'))
+        db_session.flush()
+
+        cache.invalidate()
+
+        assert cache.is_blocked(db_session, 'http://example.com')
+
+    def test_does_not_recompile_unchanged_blocklist(self, cache, clock, db_session):
+        db_session.add(models.Blocklist(uri='http://example.com'))
+        db_session.flush()
+        cache.is_blocked(db_session, 'http://example.com')
+        clock.return_value = 160
+
+        with mock.patch('h.badge.blocklist.Matcher') as Matcher:
+            cache.is_blocked(db_session, 'http://example.com')
+
+        assert not Matcher.called
+
+    @pytest.fixture
+    def clock(self):
+        return mock.Mock(return_value=100)
+
+    @pytest.fixture
+    def cache(self, clock):
+        return BlocklistCache(interval=60, clock=clock)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import pytest
+import sqlalchemy as sa
+
+from h import db
+from h.api import uri
+from h.badge import counts
+from h.badge.models import PublicAnnotationCount
+from h.nipsa.models import NipsaUser
+from tests import factories
+
+
+@pytest.mark.usefixtures('listener')
+class TestUpdateCounts(object):
+    def test_counts_new_public_annotations(self, db_session):
+        factories.Annotation(target_uri='http://example.com', shared=True)
+        factories.Annotation(target_uri='http://example.com', shared=True)
+
+        assert count(db_session, 'http://example.com') == 2
+
+    def test_does_not_count_private_annotations(self, db_session):
+        factories.Annotation(target_uri='http://example.com', shared=False)
+
+        assert count(db_session, 'http://example.com') == 0
+
+    def test_does_not_count_annotations_in_other_groups(self, db_session):
+        factories.Annotation(target_uri='http://example.com',
+                             shared=True,
+                             groupid='abc123')
+
+        assert count(db_session, 'http://example.com') == 0
+
+    def test_uncounts_deleted_annotations(self, db_session):
+        annotation = factories.Annotation(target_uri='http://example.com',
+                                          shared=True)
+
+        db_session.delete(annotation)
+        db_session.flush()
+
+        assert count(db_session, 'http://example.com') == 0
+
+    def test_counts_annotations_when_shared(self, db_session):
+        annotation = factories.Annotation(target_uri='http://example.com',
+                                          shared=False)
+
+        annotation.shared = True
+        db_session.flush()
+
+        assert count(db_session, 'http://example.com') == 1
+
+    def test_uncounts_annotations_when_unshared(self, db_session):
+        annotation = factories.Annotation(target_uri='http://example.com',
+                                          shared=True)
+
+        annotation.shared = False
+        db_session.flush()
+
+        assert count(db_session, 'http://example.com') == 0
+
+    def test_moves_counts_with_annotations(self, db_session):
+        annotation = factories.Annotation(target_uri='http://example.com',
+                                          shared=True)
+
+        annotation.target_uri = 'http://example.org'
+        db_session.flush()
+
+        assert count(db_session, 'http://example.com') == 0
+        assert count(db_session, 'http://example.org') == 1
+
+    def test_ignores_unrelated_changes(self, db_session):
+        annotation = factories.Annotation(target_uri='http://example.com',
+                                          shared=True)
+
+        annotation.text = 'changed'
+        db_session.flush()
+
+        assert count(db_session, 'http://example.com') == 1
+
+    def test_does_not_count_annotations_by_nipsad_users(self, db_session):
+        db_session.add(NipsaUser('acct:spam@example.com'))
+        factories.Annotation(target_uri='http://example.com',
+                             shared=True,
+                             userid='acct:spam@example.com')
+        factories.Annotation(target_uri='http://example.com', shared=True)
+
+        assert count(db_session, 'http://example.com') == 1
+
+    def test_uncounts_annotations_when_their_user_is_nipsad(self, db_session):
+        factories.Annotation(target_uri='http://example.com',
+                             shared=True,
+                             userid='acct:spam@example.com')
+        factories.Annotation(target_uri='http://example.com', shared=True)
+
+        db_session.add(NipsaUser('acct:spam@example.com'))
+        db_session.flush()
+
+        assert count(db_session, 'http://example.com') == 1
+
+    def test_counts_annotations_when_their_user_is_unnipsad(self, db_session):
+        nipsa_user = NipsaUser('acct:spam@example.com')
+        db_session.add(nipsa_user)
+        factories.Annotation(target_uri='http://example.com',
+                             shared=True,
+                             userid='acct:spam@example.com')
+
+        db_session.delete(nipsa_user)
+        db_session.flush()
+
+        assert count(db_session, 'http://example.com') == 1
+
+    def test_counts_changes_made_when_a_user_is_nipsad(self, db_session):
+        factories.Annotation(target_uri='http://example.com',
+                             shared=True,
+                             userid='acct:spam@example.com')
+
+        db_session.add(NipsaUser('acct:spam@example.com'))
+        factories.Annotation(target_uri='http://example.com',
+                             shared=True,
+                             userid='acct:spam@example.com')
+
+        assert count(db_session, 'http://example.com') == 0
+
+    @pytest.fixture
+    def listener(self, request):
+        sa.event.listen(db.Session, 'after_flush', counts.update_counts)
+        request.addfinalizer(lambda: sa.event.remove(db.Session,
+                                                     'after_flush',
+                                                     counts.update_counts))
+
+
+class TestRebuild(object):
+    def test_counts_public_annotations(self, db_session):
+        factories.Annotation(target_uri='http://example.com', shared=True)
+        factories.Annotation(target_uri='http://example.com', shared=True)
+        factories.Annotation(target_uri='http://example.org', shared=True)
+        factories.Annotation(target_uri='http://example.org', shared=False)
+        factories.Annotation(target_uri='http://example.net',
+                             shared=True,
+                             groupid='abc123')
+
+        result = counts.rebuild(db_session)
+
+        assert result == 2
+        assert count(db_session, 'http://example.com') == 2
+        assert count(db_session, 'http://example.org') == 1
+        assert count(db_session, 'http://example.net') == 0
+
+    def test_does_not_count_annotations_by_nipsad_users(self, db_session):
+        db_session.add(NipsaUser('acct:spam@example.com'))
+        factories.Annotation(target_uri='http://example.com',
+                             shared=True,
+                             userid='acct:spam@example.com')
+        factories.Annotation(target_uri='http://example.com', shared=True)
+
+        counts.rebuild(db_session)
+
+        assert count(db_session, 'http://example.com') == 1
+
+    def test_replaces_existing_counts(self, db_session):
+        db_session.add(PublicAnnotationCount(
+            uri_normalized=uri.normalize('http://example.com'), total=5))
+        db_session.flush()
+
+        counts.rebuild(db_session)
+        db_session.expire_all()
+
+        assert count(db_session, 'http://example.com') == 0
+
+
+class TestIncludeme(object):
+    def test_maintains_counts_if_enabled(self, pyramid_config, request):
+        pyramid_config.registry.settings['h.badge.precomputed_counts'] = True
+        request.addfinalizer(remove_listener)
+
+        counts.includeme(pyramid_config)
+
+        assert sa.event.contains(db.Session, 'after_flush',
+                                 counts.update_counts)
+
+    def test_does_not_maintain_counts_if_disabled(self, pyramid_config):
+        counts.includeme(pyramid_config)
+
+        assert not sa.event.contains(db.Session, 'after_flush',
+                                     counts.update_counts)
+
+
+def remove_listener():
+    if sa.event.contains(db.Session, 'after_flush', counts.update_counts):
+        sa.event.remove(db.Session, 'after_flush', counts.update_counts)
+
+
+def count(session, uri_):
+    return PublicAnnotationCount.get(session, uri.normalize(uri_))
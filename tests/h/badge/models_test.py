@@ -22,3 +22,29 @@ def test_is_blocked_with_wildcards(db_session):
     assert models.Blocklist.is_blocked(db_session, "http://example.com/")
     assert models.Blocklist.is_blocked(db_session, "http://example.com/bar")
     assert models.Blocklist.is_blocked(db_session, "http://example.com/foo")
+
+
+def test_public_annotation_count_get(db_session):
+    db_session.add(models.PublicAnnotationCount(
+        uri_normalized='httpx://example.com', total=3))
+    db_session.flush()
+
+    assert models.PublicAnnotationCount.get(db_session, 'httpx://example.com') == 3
+
+
+def test_public_annotation_count_get_returns_zero_if_missing(db_session):
+    assert models.PublicAnnotationCount.get(db_session, 'httpx://example.com') == 0
+
+
+def test_public_annotation_count_get_all(db_session):
+    db_session.add(models.PublicAnnotationCount(
+        uri_normalized='httpx://example.com', total=3))
+    db_session.add(models.PublicAnnotationCount(
+        uri_normalized='httpx://example.org', total=4))
+    db_session.flush()
+
+    result = models.PublicAnnotationCount.get_all(db_session,
+                                                  ['httpx://example.com',
+                                                   'httpx://example.net'])
+
+    assert result == {'httpx://example.com': 3, 'httpx://example.net': 0}
@@ -2,17 +2,18 @@ import pytest
 import mock
 
 from pyramid import httpexceptions
+from webob.multidict import MultiDict
 
 from h.badge import views
 
 
-badge_fixtures = pytest.mark.usefixtures('models', 'search_lib')
+badge_fixtures = pytest.mark.usefixtures('blocklist', 'models', 'search_lib')
 
 
 @badge_fixtures
-def test_badge_returns_number_from_search_lib(models, search_lib):
+def test_badge_returns_number_from_search_lib(blocklist, search_lib):
     request = mock.Mock(params={'uri': 'test_uri'})
-    models.Blocklist.is_blocked.return_value = False
+    blocklist.BLOCKLIST.is_blocked.return_value = False
     search_lib.search.return_value = {'total': 29}
 
     result = views.badge(request)
@@ -23,23 +24,120 @@ def test_badge_returns_number_from_search_lib(models, search_lib):
 
 
 @badge_fixtures
-def test_badge_returns_0_if_blocked(models, search_lib):
+def test_badge_returns_0_if_blocked(blocklist, search_lib):
     request = mock.Mock(params={'uri': 'test_uri'})
-    models.Blocklist.is_blocked.return_value = True
+    blocklist.BLOCKLIST.is_blocked.return_value = True
     search_lib.search.return_value = {'total': 29}
 
     result = views.badge(request)
 
+    blocklist.BLOCKLIST.is_blocked.assert_called_once_with(request.db,
+                                                           'test_uri')
     assert not search_lib.search.called
     assert result == {'total': 0}
 
 
+@badge_fixtures
+def test_badge_returns_precomputed_count_if_enabled(blocklist,
+                                                    models,
+                                                    search_lib):
+    request = mock.Mock(params={'uri': 'http://example.com'})
+    request.registry.settings = {'h.badge.precomputed_counts': 'true'}
+    blocklist.BLOCKLIST.is_blocked.return_value = False
+    models.PublicAnnotationCount.get.return_value = 7
+
+    result = views.badge(request)
+
+    models.PublicAnnotationCount.get.assert_called_once_with(
+        request.db, 'http://example.com')
+    assert not search_lib.search.called
+    assert result == {'total': 7}
+
+
 @badge_fixtures
 def test_badge_raises_if_no_uri():
     with pytest.raises(httpexceptions.HTTPBadRequest):
         views.badge(mock.Mock(params={}))
 
 
+@badge_fixtures
+class TestBadgeBatch(object):
+    def test_returns_counts_from_search_lib(self, search_lib):
+        request = batch_request('http://example.com', 'http://example.org')
+        search_lib.count_by_uri.return_value = {'http://example.com': 3,
+                                                'http://example.org': 4}
+
+        result = views.badge_batch(request)
+
+        uris, = search_lib.count_by_uri.call_args[0][1:]
+        assert sorted(uris) == ['http://example.com', 'http://example.org']
+        assert result == {'totals': {'http://example.com': 3,
+                                     'http://example.org': 4}}
+
+    def test_returns_0_for_blocked_uris(self, blocklist, search_lib):
+        request = batch_request('http://example.com', 'http://blocked.com')
+        blocklist.BLOCKLIST.is_blocked.side_effect = (
+            lambda _, uri: uri == 'http://blocked.com')
+        search_lib.count_by_uri.return_value = {'http://example.com': 3}
+
+        result = views.badge_batch(request)
+
+        search_lib.count_by_uri.assert_called_once_with(
+            request, ['http://example.com'])
+        assert result == {'totals': {'http://example.com': 3,
+                                     'http://blocked.com': 0}}
+
+    def test_does_not_search_if_all_blocked(self, blocklist, search_lib):
+        request = batch_request('http://blocked.com')
+        blocklist.BLOCKLIST.is_blocked.return_value = True
+
+        result = views.badge_batch(request)
+
+        assert not search_lib.count_by_uri.called
+        assert result == {'totals': {'http://blocked.com': 0}}
+
+    def test_returns_precomputed_counts_if_enabled(self, models, search_lib):
+        request = batch_request('http://example.com', 'https://example.org')
+        request.registry.settings['h.badge.precomputed_counts'] = 'true'
+        models.PublicAnnotationCount.get_all.return_value = {
+            'http://example.com': 3,
+            'https://example.org': 0,
+        }
+
+        result = views.badge_batch(request)
+
+        assert not search_lib.count_by_uri.called
+        assert result == {'totals': {'http://example.com': 3,
+                                     'https://example.org': 0}}
+
+    def test_raises_if_no_uris(self):
+        with pytest.raises(httpexceptions.HTTPBadRequest):
+            views.badge_batch(batch_request())
+
+    def test_raises_if_too_many_uris(self):
+        request = batch_request('http://example.com', 'http://example.org')
+        request.registry.settings['h.badge.batch_max_uris'] = 1
+
+        with pytest.raises(httpexceptions.HTTPBadRequest):
+            views.badge_batch(request)
+
+    @pytest.fixture
+    def blocklist(self, blocklist):
+        blocklist.BLOCKLIST.is_blocked.return_value = False
+        return blocklist
+
+
+def batch_request(*uris):
+    request = mock.Mock(params=MultiDict([('uri', u) for u in uris]))
+    request.registry.settings = {}
+    return request
+
+
+@pytest.fixture
+def blocklist(patch):
+    return patch('h.badge.views.blocklist')
+
+
 @pytest.fixture
 def models(patch):
     return patch('h.badge.views.models')
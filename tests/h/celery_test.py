@@ -18,6 +18,10 @@ class TestCelery(object):
     def register_logger_signal(self, request):
         return _patch('h.celery.register_logger_signal', request)
 
+    @pytest.fixture
+    def log(self, request):
+        return _patch('h.celery.log', request)
+
     def test_bootstrap_worker_bootstraps_application(self):
         sender = mock.Mock(spec=['app'])
 
@@ -46,6 +50,39 @@ class TestCelery(object):
         register_logger_signal.assert_called_once_with(mock.sentinel.sentry,
                                                        loglevel=logging.ERROR)
 
+    def test_bootstrap_worker_lifts_prefetch_limit_for_indexer_workers(self):
+        sender = self.worker(batch=True, queues={'indexer': mock.Mock()})
+
+        celery.bootstrap_worker(sender)
+
+        assert sender.prefetch_multiplier == 0
+
+    @pytest.mark.parametrize('batch,queues,warns', [
+        (True, ['celery', 'indexer'], True),
+        (False, ['indexer'], False),
+        (False, ['celery', 'indexer'], False),
+    ])
+    def test_bootstrap_worker_keeps_prefetch_limit_for_other_workers(self,
+                                                                     batch,
+                                                                     queues,
+                                                                     warns,
+                                                                     log):
+        sender = self.worker(batch=batch,
+                             queues=dict((q, mock.Mock()) for q in queues))
+
+        celery.bootstrap_worker(sender)
+
+        assert sender.prefetch_multiplier == 1
+        assert log.warning.called == warns
+
+    def worker(self, batch, queues):
+        sender = mock.Mock(spec=['app', 'prefetch_multiplier'])
+        sender.prefetch_multiplier = 1
+        request = sender.app.webapp_bootstrap.return_value
+        request.registry.settings = {'h.indexer.batch': batch}
+        sender.app.amqp.queues.consume_from = queues
+        return sender
+
     def test_reset_feature_flags_resets_request_feature_flags(self):
         sender = mock.Mock(spec=['app'])
 
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+import mock
+import pytest
+
+from h.feeds import views
+
+
+class TestAnnotations(object):
+    def test_searches_for_annotation_ids_only(self, pyramid_request, search):
+        views._annotations(pyramid_request)
+
+        search.search.assert_called_once_with(pyramid_request,
+                                              pyramid_request.params,
+                                              source=False)
+
+    def test_fetches_annotations_from_the_database(self,
+                                                   pyramid_request,
+                                                   search,
+                                                   storage):
+        search.search.return_value = {'rows': [{'id': 'foo'}, {'id': 'bar'}]}
+
+        result = views._annotations(pyramid_request)
+
+        storage.fetch_ordered_annotations.assert_called_once_with(
+            pyramid_request.db, ['foo', 'bar'], load_documents=True)
+        assert result == storage.fetch_ordered_annotations.return_value
+
+    @pytest.fixture
+    def search(self, patch):
+        search = patch('h.feeds.views.search')
+        search.search.return_value = {'rows': []}
+        return search
+
+    @pytest.fixture
+    def storage(self, patch):
+        return patch('h.feeds.views.storage')
+
+    @pytest.fixture
+    def pyramid_request(self, pyramid_request):
+        pyramid_request.db = mock.sentinel.db
+        return pyramid_request
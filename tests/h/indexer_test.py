@@ -62,7 +62,89 @@ class TestReindex(object):
         return patch('h.indexer.reindex')
 
 
-@pytest.mark.usefixtures('add_annotation', 'delete_annotation')
+@pytest.mark.usefixtures('celery', 'sync', 'tm')
+class TestSyncAnnotation(object):
+
+    def test_it_syncs_the_last_action_for_each_annotation(self, celery, sync):
+        indexer.sync_annotation([task_request('a', 'index'),
+                                 task_request('b', 'index'),
+                                 task_request('a', 'delete'),
+                                 task_request('c', 'delete')])
+
+        sync.assert_called_once_with(celery.request.db,
+                                     celery.request.es,
+                                     celery.request,
+                                     {'a': 'delete', 'b': 'index', 'c': 'delete'})
+
+    def test_it_syncs_in_the_order_of_the_last_actions(self, sync):
+        indexer.sync_annotation([task_request('a', 'index'),
+                                 task_request('b', 'index'),
+                                 task_request('a', 'delete')])
+
+        actions = sync.call_args[0][3]
+        assert list(actions.items()) == [('b', 'index'), ('a', 'delete')]
+
+    def test_it_aborts_the_transaction(self, celery):
+        indexer.sync_annotation([task_request('a', 'index')])
+
+        celery.request.tm.abort.assert_called_once_with()
+
+    def test_it_requeues_failed_actions(self, sync, sync_annotation_apply):
+        sync.return_value = set(['b'])
+
+        indexer.sync_annotation([task_request('a', 'index'),
+                                 task_request('b', 'delete')])
+
+        sync_annotation_apply.assert_called_once_with(
+            ('b', 'delete'), {'retries': 1}, countdown=indexer.SYNC_RETRY_DELAY)
+
+    def test_it_requeues_all_actions_if_the_sync_fails(self,
+                                                       sync,
+                                                       sync_annotation_apply):
+        sync.side_effect = RuntimeError('connection refused')
+
+        indexer.sync_annotation([task_request('a', 'index'),
+                                 task_request('b', 'delete')])
+
+        assert [c[0][0] for c in sync_annotation_apply.call_args_list] == [
+            ('a', 'index'), ('b', 'delete')]
+
+    def test_it_backs_off_between_retries(self, sync, sync_annotation_apply):
+        sync.return_value = set(['a'])
+
+        indexer.sync_annotation([task_request('a', 'index', retries=2)])
+
+        sync_annotation_apply.assert_called_once_with(
+            ('a', 'index'), {'retries': 3},
+            countdown=indexer.SYNC_RETRY_DELAY * 4)
+
+    def test_it_gives_up_after_the_maximum_retries(self,
+                                                   sync,
+                                                   sync_annotation_apply):
+        sync.return_value = set(['a'])
+
+        indexer.sync_annotation([
+            task_request('a', 'index', retries=indexer.SYNC_MAX_RETRIES)])
+
+        assert not sync_annotation_apply.called
+
+    @pytest.fixture
+    def sync(self, patch):
+        sync = patch('h.indexer.sync')
+        sync.return_value = set()
+        return sync
+
+    @pytest.fixture
+    def sync_annotation_apply(self, patch):
+        return patch('h.indexer.sync_annotation.apply_async')
+
+    @pytest.fixture
+    def tm(self, pyramid_request):
+        pyramid_request.tm = mock.Mock()
+        return pyramid_request.tm
+
+
+@pytest.mark.usefixtures('add_annotation', 'delete_annotation', 'sync_annotation')
 class TestSubscribeAnnotationEvent(object):
 
     @pytest.mark.parametrize('action', ['create', 'update'])
@@ -93,6 +175,29 @@ class TestSubscribeAnnotationEvent(object):
         delete_annotation.delay.assert_called_once_with(event.annotation_id)
         assert not add_annotation.delay.called
 
+    @pytest.mark.parametrize('action,sync_action', [('create', 'index'),
+                                                    ('update', 'index'),
+                                                    ('delete', 'delete')])
+    def test_it_enqueues_sync_annotation_celery_task_when_batching(
+            self,
+            action,
+            sync_action,
+            add_annotation,
+            delete_annotation,
+            sync_annotation,
+            pyramid_request):
+        pyramid_request.registry.settings['h.indexer.batch'] = 'true'
+        event = events.AnnotationEvent(pyramid_request,
+                                       {'id': 'test_annotation_id'},
+                                       action)
+
+        indexer.subscribe_annotation_event(event)
+
+        sync_annotation.delay.assert_called_once_with(event.annotation_id,
+                                                      sync_action)
+        assert not add_annotation.delay.called
+        assert not delete_annotation.delay.called
+
     @pytest.fixture
     def add_annotation(self, patch):
         return patch('h.indexer.add_annotation')
@@ -101,6 +206,14 @@ class TestSubscribeAnnotationEvent(object):
     def delete_annotation(self, patch):
         return patch('h.indexer.delete_annotation')
 
+    @pytest.fixture
+    def sync_annotation(self, patch):
+        return patch('h.indexer.sync_annotation')
+
+
+def task_request(*args, **kwargs):
+    return mock.Mock(args=args, kwargs=kwargs)
+
 
 @pytest.fixture
 def celery(patch, pyramid_request):
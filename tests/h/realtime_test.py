@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 
 from datetime import datetime
+import socket
 
+import kombu
 import pytest
 import mock
 
@@ -97,6 +99,152 @@ class TestConsumer(object):
         return patch('h.realtime.Consumer.generate_queue_name')
 
 
+class TestRoutedConsumer(object):
+    def test_get_consumers_declares_the_uri_exchange(self,
+                                                     consumer,
+                                                     consumer_factory,
+                                                     exchange):
+        channel = mock.Mock()
+
+        consumer.get_consumers(consumer_factory, channel)
+
+        exchange.assert_called_once_with(channel)
+        exchange.return_value.declare.assert_called_once_with()
+
+    def test_get_consumers_binds_queue_to_current_routing_keys(self,
+                                                               consumer_factory,
+                                                              consumer,
+                                                              exchange,
+                                                              Queue,
+                                                              binding):
+        consumer.get_consumers(consumer_factory, mock.Mock())
+
+        Queue.assert_called_once_with(mock.ANY,
+                                      durable=False,
+                                      auto_delete=True,
+                                      bindings=[binding.return_value,
+                                                binding.return_value])
+        assert binding.call_args_list == [
+            mock.call(exchange, routing_key='annotation.a'),
+            mock.call(exchange, routing_key='annotation.b'),
+        ]
+
+    def test_get_consumers_creates_a_consumer(self, consumer, consumer_factory, Queue):
+        consumers = consumer.get_consumers(consumer_factory, mock.Mock())
+
+        consumer_factory.assert_called_once_with(queues=[Queue.return_value],
+                                                 callbacks=[consumer.handle_message])
+        assert consumers == [consumer_factory.return_value]
+
+    def test_update_bindings_binds_and_unbinds_changed_keys(self,
+                                                            consumer_factory,
+                                                           consumer,
+                                                           exchange,
+                                                           Queue,
+                                                           routing_keys):
+        consumer.get_consumers(consumer_factory, mock.Mock())
+        routing_keys.return_value = {'annotation.b', 'annotation.c'}
+
+        consumer.update_bindings()
+
+        queue = Queue.return_value
+        queue.bind_to.assert_called_once_with(exchange,
+                                              routing_key='annotation.c')
+        queue.unbind_from.assert_called_once_with(exchange,
+                                                  routing_key='annotation.a')
+
+    def test_update_bindings_does_nothing_if_keys_unchanged(self,
+                                                            consumer_factory,
+                                                           consumer,
+                                                           Queue):
+        consumer.get_consumers(consumer_factory, mock.Mock())
+
+        consumer.update_bindings()
+
+        assert not Queue.return_value.bind_to.called
+        assert not Queue.return_value.unbind_from.called
+
+    def test_update_bindings_does_nothing_before_queue_created(self,
+                                                              consumer,
+                                                              routing_keys):
+        consumer.update_bindings()
+
+        assert not routing_keys.called
+
+    def test_on_iteration_updates_bindings(self,
+                                           consumer,
+                                           consumer_factory,
+                                           Queue,
+                                           routing_keys):
+        consumer.get_consumers(consumer_factory, mock.Mock())
+        routing_keys.return_value = set()
+
+        consumer.on_iteration()
+
+        assert Queue.return_value.unbind_from.call_count == 2
+
+    def test_update_bindings_binds_on_a_real_connection(self):
+        # The in-memory transport supports only one binding per queue, and
+        # doesn't support unbinding, so this only checks that a routing key
+        # added after the queue is declared gets bound.
+        keys = set()
+        received = []
+
+        with kombu.Connection('memory://') as connection:
+            consumer = realtime.RoutedConsumer(connection,
+                                               'annotation',
+                                               received.append,
+                                               lambda: set(keys))
+
+            with consumer.Consumer() as (conn, _, _):
+                keys.add('annotation.b')
+                consumer.update_bindings()
+
+                with connection.Producer() as producer:
+                    for key in ['annotation.a', 'annotation.b']:
+                        producer.publish({'key': key},
+                                         exchange=realtime.get_uri_exchange(),
+                                         routing_key=key)
+                try:
+                    while True:
+                        conn.drain_events(timeout=0.1)
+                except socket.timeout:
+                    pass
+
+        assert received == [{'key': 'annotation.b'}]
+
+    @pytest.fixture
+    def consumer_factory(self, Queue):
+        consumer_factory = mock.Mock(spec_set=[])
+        consumer_factory.return_value.queues = [Queue.return_value]
+        return consumer_factory
+
+    @pytest.fixture
+    def consumer(self, routing_keys, exchange):
+        return realtime.RoutedConsumer(mock.sentinel.connection,
+                                       'annotation',
+                                       mock.Mock(spec_set=[]),
+                                       routing_keys)
+
+    @pytest.fixture
+    def routing_keys(self):
+        return mock.Mock(spec_set=[],
+                         return_value={'annotation.a', 'annotation.b'})
+
+    @pytest.fixture
+    def exchange(self, patch):
+        get_uri_exchange = patch('h.realtime.get_uri_exchange')
+        return get_uri_exchange.return_value
+
+    @pytest.fixture
+    def Queue(self, patch):
+        return patch('h.realtime.kombu.Queue')
+
+    @pytest.fixture
+    def binding(self, patch):
+        return patch('h.realtime.kombu.binding')
+
+
 class TestPublisher(object):
     def test_publish_annotation(self, producer_pool, pyramid_request):
         payload = {'action': 'create', 'annotation': {'id': 'foobar'}}
@@ -128,6 +276,51 @@ class TestPublisher(object):
                                                  routing_key='user',
                                                  headers=expected_headers)
 
+    def test_publish_annotation_does_not_route_by_uri_by_default(self,
+                                                                 producer_pool,
+                                                                 pyramid_request):
+        producer = producer_pool['foobar'].acquire().__enter__()
+
+        publisher = realtime.Publisher(pyramid_request)
+        publisher.publish_annotation({}, uri='http://example.com', group='foo')
+
+        assert producer.publish.call_count == 1
+
+    def test_publish_annotation_routes_by_uri_if_enabled(self,
+                                                         producer_pool,
+                                                         pyramid_request):
+        pyramid_request.registry.settings['h.realtime.uri_routing'] = 'true'
+        payload = {'action': 'create', 'annotation_id': 'foobar'}
+        producer = producer_pool['foobar'].acquire().__enter__()
+        exchange = realtime.get_uri_exchange()
+
+        publisher = realtime.Publisher(pyramid_request)
+        publisher.publish_annotation(payload,
+                                     uri='http://example.com',
+                                     group='__world__')
+
+        assert producer.publish.call_count == 2
+        producer.publish.assert_called_with(
+            payload,
+            exchange=exchange,
+            declare=[exchange],
+            routing_key=realtime.uri_routing_key('http://example.com'),
+            headers=MappingContaining('timestamp'))
+        headers = producer.publish.call_args[1]['headers']
+        assert headers['uri'] == 'http://example.com'
+        assert headers['group'] == '__world__'
+
+    def test_publish_annotation_does_not_route_without_uri(self,
+                                                           producer_pool,
+                                                           pyramid_request):
+        pyramid_request.registry.settings['h.realtime.uri_routing'] = 'true'
+        producer = producer_pool['foobar'].acquire().__enter__()
+
+        publisher = realtime.Publisher(pyramid_request)
+        publisher.publish_annotation({})
+
+        assert producer.publish.call_count == 1
+
     @pytest.fixture
     def producer_pool(self, patch):
         return patch('h.realtime.producer_pool')
@@ -153,6 +346,43 @@ class TestGetExchange(object):
         assert exchange.delivery_mode == 1
 
 
+class TestGetURIExchange(object):
+    def test_type(self):
+        exchange = realtime.get_uri_exchange()
+        assert exchange.type == 'topic'
+
+    def test_durable(self):
+        exchange = realtime.get_uri_exchange()
+        assert exchange.durable is False
+
+    def test_delivery_mode(self):
+        exchange = realtime.get_uri_exchange()
+        assert exchange.delivery_mode == 1
+
+
+class TestURIRoutingKey(object):
+    def test_is_an_annotation_routing_key(self):
+        key = realtime.uri_routing_key('http://example.com')
+        assert key.startswith('annotation.')
+        assert '.' not in key[len('annotation.'):]
+
+    def test_matches_the_any_uri_routing_key_pattern(self):
+        key = realtime.uri_routing_key('http://example.com')
+        assert key.split('.')[0] == realtime.ANY_URI_ROUTING_KEY.split('.')[0]
+
+    def test_folds_uris_like_the_streamer_filter(self):
+        assert (realtime.uri_routing_key(u'http://EXAMPLE.com/café') ==
+                realtime.uri_routing_key(u'http://example.com/CAFE'))
+
+    def test_differs_for_different_uris(self):
+        assert (realtime.uri_routing_key('http://example.com') !=
+                realtime.uri_routing_key('http://example.org'))
+
+    def test_is_short_for_long_uris(self):
+        key = realtime.uri_routing_key('http://example.com/' + 'a' * 1000)
+        assert len(key) < 255
+
+
 class TestGetConnection(object):
     def test_defaults(self, Connection):
         realtime.get_connection({})
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from h.streamer.catchup import EventLog
+
+
+class TestEventLog(object):
+    def test_append_returns_increasing_cursors(self, log):
+        first = log.append('one')
+        second = log.append('two')
+
+        assert first == log.cursor(1)
+        assert second == log.cursor(2)
+
+    def test_cursors_differ_between_logs(self):
+        assert EventLog(size=3).cursor(1) != EventLog(size=3).cursor(1)
+
+    def test_since_returns_later_events(self, log):
+        cursors = [log.append(p) for p in ['one', 'two', 'three']]
+
+        assert log.since(cursors[0]) == [(cursors[1], 'two'),
+                                         (cursors[2], 'three')]
+
+    def test_since_returns_nothing_if_up_to_date(self, log):
+        cursor = log.append('one')
+
+        assert log.since(cursor) == []
+
+    def test_since_returns_everything_from_the_start(self, log):
+        log.append('one')
+
+        assert log.since(log.cursor(0)) == [(log.cursor(1), 'one')]
+
+    def test_since_returns_events_up_to_the_buffer_size(self, log):
+        cursors = [log.append(p) for p in ['one', 'two', 'three', 'four']]
+
+        assert log.since(cursors[0]) == [(cursors[1], 'two'),
+                                         (cursors[2], 'three'),
+                                         (cursors[3], 'four')]
+
+    def test_since_returns_none_if_events_have_been_dropped(self, log):
+        cursors = [log.append(p) for p in ['one', 'two', 'three', 'four', 'five']]
+
+        assert log.since(cursors[0]) is None
+
+    def test_since_returns_none_for_another_logs_cursor(self, log):
+        log.append('one')
+
+        assert log.since(EventLog(size=3).cursor(0)) is None
+
+    def test_since_returns_none_for_future_cursor(self, log):
+        log.append('one')
+
+        assert log.since(log.cursor(2)) is None
+
+    @pytest.mark.parametrize('cursor', [None, 42, '', 'foo', 'foo:bar'])
+    def test_since_returns_none_for_invalid_cursor(self, log, cursor):
+        assert log.since(cursor) is None
+
+    def test_resize_keeps_newest_events(self, log):
+        cursors = [log.append(p) for p in ['one', 'two', 'three']]
+
+        log.resize(2)
+
+        assert log.since(cursors[0]) == [(cursors[1], 'two'),
+                                         (cursors[2], 'three')]
+        assert log.since(log.cursor(0)) is None
+
+    def test_cached_returns_cached_prepared_events(self, log):
+        cursors = [log.append(p) for p in ['one', 'two']]
+
+        log.cache(cursors[1], 'prepared two')
+
+        assert log.cached(cursors) == {cursors[1]: 'prepared two'}
+
+    def test_cache_ignores_unknown_cursors(self, log):
+        log.append('one')
+
+        log.cache(log.cursor(2), 'prepared')
+        log.cache('foo:1', 'prepared')
+
+        assert log.cached([log.cursor(2), 'foo:1']) == {}
+
+    def test_append_forgets_cached_events_which_are_dropped(self, log):
+        cursors = [log.append(p) for p in ['one', 'two', 'three']]
+        for cursor in cursors:
+            log.cache(cursor, 'prepared')
+
+        log.append('four')
+
+        assert log.cached(cursors) == {cursors[1]: 'prepared',
+                                       cursors[2]: 'prepared'}
+
+    def test_resize_forgets_cached_events_which_are_dropped(self, log):
+        cursors = [log.append(p) for p in ['one', 'two', 'three']]
+        for cursor in cursors:
+            log.cache(cursor, 'prepared')
+
+        log.resize(1)
+
+        assert log.cached(cursors) == {cursors[2]: 'prepared'}
+
+    @pytest.fixture
+    def log(self):
+        return EventLog(size=3)
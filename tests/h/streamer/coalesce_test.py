@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import gevent
+from gevent.queue import Full, Queue
+import mock
+import pytest
+
+from h.streamer.coalesce import Coalescer
+from h.streamer.messages import Message
+
+WINDOW = 0.01
+
+
+class TestCoalescer(object):
+    def test_holds_back_updates_until_the_window_closes(self, coalescer, queue):
+        coalescer.put(event('update', 'panda'))
+
+        assert queue.empty()
+        gevent.sleep(WINDOW * 2)
+        assert queued(queue) == [event('update', 'panda')]
+
+    def test_only_queues_the_latest_update(self, coalescer, queue):
+        coalescer.put(event('update', 'panda', client='one'))
+        coalescer.put(event('update', 'panda', client='two'))
+        coalescer.put(event('update', 'panda', client='three'))
+        gevent.sleep(WINDOW * 2)
+
+        assert queued(queue) == [event('update', 'panda', client='three')]
+
+    def test_updates_following_a_create_are_queued_as_a_create(self,
+                                                              coalescer,
+                                                              queue):
+        coalescer.put(event('create', 'panda', client='one'))
+        coalescer.put(event('update', 'panda', client='two'))
+        gevent.sleep(WINDOW * 2)
+
+        assert queued(queue) == [event('create', 'panda', client='two')]
+
+    def test_does_not_coalesce_different_annotations(self, coalescer, queue):
+        coalescer.put(event('update', 'panda'))
+        coalescer.put(event('update', 'giraffe'))
+        gevent.sleep(WINDOW * 2)
+
+        assert queued(queue) == [event('update', 'panda'),
+                                 event('update', 'giraffe')]
+
+    def test_window_is_not_extended_by_later_updates(self, coalescer, queue):
+        coalescer.put(event('update', 'panda', client='one'))
+        gevent.sleep(WINDOW * 0.6)
+        coalescer.put(event('update', 'panda', client='two'))
+        gevent.sleep(WINDOW * 0.6)
+
+        assert queued(queue) == [event('update', 'panda', client='two')]
+
+    def test_queues_deletes_immediately(self, coalescer, queue):
+        coalescer.put(event('delete', 'panda'))
+
+        assert queued(queue) == [event('delete', 'panda')]
+
+    def test_delete_discards_held_updates(self, coalescer, queue):
+        coalescer.put(event('update', 'panda'))
+        coalescer.put(event('delete', 'panda'))
+        gevent.sleep(WINDOW * 2)
+
+        assert queued(queue) == [event('delete', 'panda')]
+        assert coalescer.pending == {}
+
+    def test_delete_does_not_discard_updates_to_other_annotations(self,
+                                                                 coalescer,
+                                                                 queue):
+        coalescer.put(event('update', 'giraffe'))
+        coalescer.put(event('delete', 'panda'))
+        gevent.sleep(WINDOW * 2)
+
+        assert queued(queue) == [event('delete', 'panda'),
+                                 event('update', 'giraffe')]
+
+    def test_queues_other_actions_immediately(self, coalescer, queue):
+        coalescer.put(event('read', 'panda'))
+
+        assert queued(queue) == [event('read', 'panda')]
+
+    def test_put_raises_if_queue_full(self):
+        coalescer = Coalescer(Queue(maxsize=1), WINDOW)
+        coalescer.put(event('delete', 'giraffe'))
+
+        with pytest.raises(Full):
+            coalescer.put(event('delete', 'panda'), timeout=0.01)
+
+    def test_flush_gives_up_if_queue_full(self):
+        queue = mock.Mock(spec_set=['put'])
+        queue.put.side_effect = Full()
+        coalescer = Coalescer(queue, WINDOW)
+        coalescer.put(event('update', 'panda'))
+
+        coalescer.flush('panda')
+
+        assert coalescer.pending == {}
+
+    @pytest.fixture
+    def queue(self):
+        return Queue()
+
+    @pytest.fixture
+    def coalescer(self, queue):
+        return Coalescer(queue, WINDOW)
+
+
+def event(action, annotation_id, client='pigeon'):
+    return Message(topic='annotation', payload={'action': action,
+                                                'annotation_id': annotation_id,
+                                                'src_client_id': client})
+
+
+def queued(queue):
+    result = []
+    while not queue.empty():
+        result.append(queue.get())
+    return result
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from hypothesis import strategies as st
+from hypothesis import given
+
+from h.streamer import filter
+
+ANNOTATION = {
+    'id': 'abc123',
+    'uri': u'http://Example.com/Café',
+    'user': 'acct:bob@example.com',
+    'text': u'Some TEXT',
+    'tags': [u'Foo', u'bar'],
+    'created': '2016-06-01T00:00:00.000000+00:00',
+    'permissions': {'read': ['group:__world__']},
+    'target': [{'source': 'http://example.com'}],
+}
+
+
+@pytest.mark.parametrize('clause', [
+    {'field': '/uri', 'operator': 'equals', 'value': u'http://example.com/cafe'},
+    {'field': '/uri', 'operator': 'equals', 'value': 'http://example.org'},
+    {'field': '/uri', 'operator': 'equals', 'value': ['http://example.com/cafe']},
+    {'field': '/uri', 'operator': 'one_of', 'value': [u'http://EXAMPLE.com/café', 'x']},
+    {'field': '/uri', 'operator': 'one_of', 'value': ['http://example.org']},
+    {'field': '/uri', 'operator': 'one_of', 'value': 'example.com'},
+    {'field': '/uri', 'operator': 'one_of', 'value': [{'not': 'hashable'}]},
+    {'field': '/text', 'operator': 'matches', 'value': 'text'},
+    {'field': '/text', 'operator': 'matches', 'value': ['some text', 'other']},
+    {'field': '/tags', 'operator': 'matches', 'value': 'foo'},
+    {'field': '/tags', 'operator': 'one_of', 'value': ['foo', 'bar']},
+    {'field': '/tags', 'operator': 'equals', 'value': ['foo', 'bar']},
+    {'field': '/tags', 'operator': 'first_of', 'value': 'FOO'},
+    {'field': '/tags', 'operator': 'match_of', 'value': ['baz', 'bar']},
+    {'field': '/tags', 'operator': 'match_of', 'value': ['baz']},
+    {'field': '/tags', 'operator': 'lene', 'value': 2},
+    {'field': '/tags', 'operator': 'leng', 'value': 2},
+    {'field': '/tags', 'operator': 'lenge', 'value': 2},
+    {'field': '/tags', 'operator': 'lenl', 'value': 3},
+    {'field': '/tags', 'operator': 'lenle', 'value': 1},
+    {'field': '/created', 'operator': 'gt', 'value': '2016-01-01'},
+    {'field': '/created', 'operator': 'ge', 'value': '2017-01-01'},
+    {'field': '/created', 'operator': 'lt', 'value': '2017-01-01'},
+    {'field': '/created', 'operator': 'le', 'value': '2016-01-01'},
+    {'field': '/permissions/read/0', 'operator': 'equals', 'value': 'group:__world__'},
+    {'field': '/target/0/source', 'operator': 'equals', 'value': 'http://example.com'},
+    {'field': '/missing', 'operator': 'equals', 'value': 'foo'},
+    {'field': ['/missing', '/user'], 'operator': 'equals', 'value': 'acct:bob@example.com'},
+    {'field': ['/missing', '/text'], 'operator': 'equals', 'value': 'foo'},
+])
+@pytest.mark.parametrize('match_policy', ['include_any', 'include_all',
+                                          'exclude_any', 'exclude_all'])
+def test_compiled_filter_matches_like_filter_handler(clause, match_policy):
+    filter_json = {
+        'match_policy': match_policy,
+        'clauses': [clause],
+        'actions': {'create': True, 'update': True, 'delete': True},
+    }
+
+    expected = filter.FilterHandler(filter_json).match(ANNOTATION, 'create')
+
+    assert filter.CompiledFilter(filter_json).match(ANNOTATION, 'create') == expected
+
+
+@pytest.mark.parametrize('match_policy,expected', [
+    ('include_any', True),
+    ('include_all', False),
+    ('exclude_any', False),
+    ('exclude_all', True),
+])
+def test_compiled_filter_match_policies(match_policy, expected):
+    compiled = filter.CompiledFilter({
+        'match_policy': match_policy,
+        'clauses': [
+            {'field': '/user', 'operator': 'equals', 'value': 'acct:bob@example.com'},
+            {'field': '/user', 'operator': 'equals', 'value': 'acct:amy@example.com'},
+        ],
+        'actions': {},
+    })
+
+    assert compiled.match(ANNOTATION) is expected
+
+
+def test_compiled_filter_with_no_clauses_matches_everything():
+    compiled = filter.CompiledFilter({'match_policy': 'exclude_any',
+                                      'clauses': [],
+                                      'actions': {}})
+
+    assert compiled.match(ANNOTATION) is True
+
+
+@pytest.mark.parametrize('action,expected', [
+    (None, True),
+    ('past', True),
+    ('create', True),
+    ('delete', False),
+])
+def test_compiled_filter_actions(action, expected):
+    compiled = filter.CompiledFilter({'match_policy': 'include_all',
+                                      'clauses': [],
+                                      'actions': {'create': True}})
+
+    assert compiled.match(ANNOTATION, action) is expected
+
+
+def test_compiled_filter_exposes_filter_json():
+    filter_json = {'match_policy': 'include_all', 'clauses': [], 'actions': {}}
+
+    assert filter.CompiledFilter(filter_json).filter is filter_json
+
+
+def test_compiled_filter_folds_clause_values_once(patch):
+    uni_fold = patch('h.streamer.filter.uni_fold', side_effect=lambda v: v)
+    compiled = filter.CompiledFilter({
+        'match_policy': 'include_all',
+        'clauses': [{'field': '/uri', 'operator': 'one_of', 'value': ['a', 'b', 'c']}],
+        'actions': {},
+    })
+    uni_fold.reset_mock()
+
+    compiled.match({'uri': 'a'})
+    compiled.match({'uri': 'b'})
+
+    # Only the field value is folded on each evaluation
+    assert uni_fold.call_count == 2
+
+
+def test_compiled_filter_rejects_unknown_match_policy():
+    with pytest.raises(ValueError):
+        filter.CompiledFilter({'match_policy': 'include_some',
+                               'clauses': [{'field': '/uri',
+                                            'operator': 'equals',
+                                            'value': 'a'}],
+                               'actions': {}})
+
+
+values = st.one_of(st.text(max_size=3),
+                   st.integers(min_value=0, max_value=3),
+                   st.lists(st.text(max_size=3), max_size=3))
+
+
+@given(operator=st.sampled_from(['equals', 'matches', 'one_of', 'match_of', 'lt', 'ge']),
+       match_policy=st.sampled_from(['include_any', 'include_all',
+                                     'exclude_any', 'exclude_all']),
+       clause_value=values,
+       field_value=values)
+@pytest.mark.fuzz
+def test_compiled_filter_agrees_with_filter_handler(operator, match_policy,
+                                                    clause_value, field_value):
+    filter_json = {
+        'match_policy': match_policy,
+        'clauses': [{'field': '/f', 'operator': operator, 'value': clause_value}],
+        'actions': {},
+    }
+    target = {'f': field_value}
+
+    try:
+        expected = filter.FilterHandler(filter_json).match(target)
+    except TypeError:
+        with pytest.raises(TypeError):
+            filter.CompiledFilter(filter_json).match(target)
+    else:
+        assert filter.CompiledFilter(filter_json).match(target) == expected
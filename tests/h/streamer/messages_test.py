@@ -1,12 +1,18 @@
 # -*- coding: utf-8 -*-
 
+import json
+
 import mock
 import pytest
 from gevent.queue import Queue
 from pyramid.request import apply_request_extensions
 from pyramid.testing import DummyRequest
 
+from h import realtime
+from h.streamer import catchup
 from h.streamer import messages
+from h.streamer.catchup import EventLog
+from h.streamer.subscriptions import SubscriptionIndex
 
 
 class FakeSocket(object):
@@ -19,7 +25,7 @@ class FakeSocket(object):
         self.client_id = client_id
         self.terminated = False
         self.filter = mock.MagicMock()
-        self.send = mock.MagicMock()
+        self.queue_send = mock.MagicMock()
         # Each fake socket needs its own request, so can't use the
         # pyramid_request fixture.
         self.request = DummyRequest(db=mock.sentinel.db_session)
@@ -99,6 +105,24 @@ class TestProcessMessages(object):
         assert result.topic == 'foobar'
         assert result.payload == {'foo': 'bar'}
 
+    def test_uses_routed_consumer_if_routing_keys_passed(self,
+                                                        fake_consumer,
+                                                        fake_routed_consumer,
+                                                        queue):
+        routing_keys = mock.Mock()
+
+        messages.process_messages({}, 'foobar', queue, raise_error=False,
+                                  routing_keys=routing_keys)
+
+        assert not fake_consumer.called
+        fake_routed_consumer.assert_called_once_with(connection=mock.ANY,
+                                                     routing_key='foobar',
+                                                     handler=mock.ANY,
+                                                     routing_keys=routing_keys,
+                                                     sentry_client=mock.ANY,
+                                                     statsd_client=mock.ANY)
+        fake_routed_consumer.return_value.run.assert_called_once_with()
+
     @pytest.fixture
     def fake_sentry(self, patch):
         return patch('h.sentry')
@@ -111,6 +135,10 @@ class TestProcessMessages(object):
     def fake_consumer(self, patch):
         return patch('h.streamer.messages.Consumer')
 
+    @pytest.fixture
+    def fake_routed_consumer(self, patch):
+        return patch('h.streamer.messages.RoutedConsumer')
+
     @pytest.fixture
     def fake_realtime(self, patch):
         return patch('h.streamer.messages.realtime')
@@ -120,60 +148,126 @@ class TestProcessMessages(object):
         return Queue()
 
 
+@pytest.mark.usefixtures('websocket')
+class TestAnnotationRoutingKeys(object):
+    def test_returns_keys_for_subscribed_uris(self):
+        socket = FakeSocket('giraffe')
+        self.subscriptions.add(socket, {
+            'match_policy': 'include_all',
+            'clauses': [{'field': '/uri',
+                         'operator': 'one_of',
+                         'value': ['http://example.com', 'http://example.org']}],
+            'actions': {},
+        })
+
+        assert messages.annotation_routing_keys() == {
+            realtime.uri_routing_key('http://example.com'),
+            realtime.uri_routing_key('http://example.org'),
+        }
+
+    def test_returns_no_keys_if_no_sockets_subscribed(self):
+        assert messages.annotation_routing_keys() == set()
+
+    def test_returns_key_for_all_uris_if_a_filter_matches_any_uri(self):
+        socket = FakeSocket('giraffe')
+        self.subscriptions.add(socket, {'match_policy': 'include_any',
+                                        'clauses': [],
+                                        'actions': {}})
+
+        assert messages.annotation_routing_keys() == {
+            realtime.ANY_URI_ROUTING_KEY}
+
+    @pytest.fixture
+    def websocket(self, patch):
+        websocket = patch('h.streamer.websocket.WebSocket')
+        self.subscriptions = websocket.subscriptions = SubscriptionIndex()
+        return websocket
+
+
 class TestHandleMessage(object):
-    def test_calls_handler_once_per_socket_with_deserialized_message(self, websocket):
-        handler = mock.Mock(return_value=None)
+    def test_calls_handler_once_with_deserialized_message(self):
+        handler = mock.Mock(return_value=[])
         message = messages.Message(topic='foo', payload={'foo': 'bar'})
-        websocket.instances = [FakeSocket('a'), FakeSocket('b')]
 
         messages.handle_message(message, topic_handlers={'foo': handler})
 
-        print(repr(mock.call({'foo': 'bar'}, websocket.instances[0])))
-        print(repr(handler.mock_calls[0]))
-        assert handler.mock_calls == [
-            mock.call({'foo': 'bar'}, websocket.instances[0]),
-            mock.call({'foo': 'bar'}, websocket.instances[1]),
-        ]
+        handler.assert_called_once_with({'foo': 'bar'})
 
-    def test_sends_serialized_messages_down_websocket(self, websocket):
-        handler = mock.Mock(return_value={'just': 'some message'})
-        message = messages.Message(topic='foo', payload={'foo': 'bar'})
+    def test_queues_serialized_messages_on_websocket(self):
         socket = FakeSocket('a')
-        websocket.instances = [socket]
+        handler = mock.Mock(return_value=[(socket, {'just': 'some message'})])
+        message = messages.Message(topic='foo', payload={'foo': 'bar'})
 
         messages.handle_message(message, topic_handlers={'foo': handler})
 
-        socket.send.assert_called_once_with('{"just": "some message"}')
+        socket.queue_send.assert_called_once_with('{"just": "some message"}',
+                                                  key=None)
 
-    def test_does_not_send_messages_down_websocket_if_handler_response_is_none(self, websocket):
-        handler = mock.Mock(return_value=None)
+    def test_only_queues_messages_for_sockets_returned_by_handler(self):
+        socket_a = FakeSocket('a')
+        socket_b = FakeSocket('b')
+        handler = mock.Mock(return_value=[(socket_b, {'just': 'some message'})])
+        message = messages.Message(topic='foo', payload={'foo': 'bar'})
+
+        messages.handle_message(message, topic_handlers={'foo': handler})
+
+        assert socket_a.queue_send.call_count == 0
+        assert socket_b.queue_send.call_count == 1
+
+    def test_serializes_shared_replies_once(self, json):
+        sockets = [FakeSocket('a'), FakeSocket('b')]
+        reply = {'just': 'some message'}
+        handler = mock.Mock(return_value=[(s, reply) for s in sockets])
         message = messages.Message(topic='foo', payload={'foo': 'bar'})
-        socket = FakeSocket('a')
-        websocket.instances = [socket]
 
         messages.handle_message(message, topic_handlers={'foo': handler})
 
-        assert socket.send.call_count == 0
+        json.dumps.assert_called_once_with(reply)
+        for socket in sockets:
+            socket.queue_send.assert_called_once_with(json.dumps.return_value,
+                                                      key=None)
 
-    def test_does_not_send_messages_down_websocket_if_socket_terminated(self, websocket):
-        handler = mock.Mock(return_value={'just': 'some message'})
+    def test_serializes_distinct_replies_separately(self):
+        sockets = [FakeSocket('a'), FakeSocket('b')]
+        handler = mock.Mock(return_value=[(sockets[0], {'n': 1}),
+                                          (sockets[1], {'n': 2})])
         message = messages.Message(topic='foo', payload={'foo': 'bar'})
+
+        messages.handle_message(message, topic_handlers={'foo': handler})
+
+        sockets[0].queue_send.assert_called_once_with('{"n": 1}', key=None)
+        sockets[1].queue_send.assert_called_once_with('{"n": 2}', key=None)
+
+    def test_keys_annotation_notifications_by_annotation_id(self):
         socket = FakeSocket('a')
-        socket.terminated = True
-        websocket.instances = [socket]
+        reply = {'type': 'annotation-notification',
+                 'options': {'action': 'update'},
+                 'payload': [{'id': 'panda'}]}
+        handler = mock.Mock(return_value=[(socket, reply)])
+        message = messages.Message(topic='foo', payload={'foo': 'bar'})
 
         messages.handle_message(message, topic_handlers={'foo': handler})
 
-        assert socket.send.call_count == 0
+        socket.queue_send.assert_called_once_with(mock.ANY,
+                                                  key=('annotation', 'panda'))
+
+    def test_raises_for_unknown_topic(self):
+        message = messages.Message(topic='foo', payload={'foo': 'bar'})
+
+        with pytest.raises(RuntimeError):
+            messages.handle_message(message, topic_handlers={})
 
     @pytest.fixture
-    def websocket(self, patch):
-        return patch('h.streamer.websocket.WebSocket')
+    def json(self, patch):
+        return patch('h.streamer.messages.json')
 
 
-@pytest.mark.usefixtures('fetch_annotation', 'nipsa_service')
+@pytest.mark.usefixtures('events',
+                         'fetch_ordered_annotations',
+                         'nipsa_service',
+                         'websocket')
 class TestHandleAnnotationEvent(object):
-    def test_it_fetches_the_annotation(self, fetch_annotation, presenter_asdict):
+    def test_it_fetches_the_annotation(self, fetch_ordered_annotations, presenter_asdict):
         message = {
             'annotation_id': 'panda',
             'action': 'update',
@@ -182,11 +276,13 @@ class TestHandleAnnotationEvent(object):
         socket = FakeSocket('giraffe')
         presenter_asdict.return_value = self.serialized_annotation()
 
-        messages.handle_annotation_event(message, socket)
+        self.notification_for(message, socket)
 
-        fetch_annotation.assert_called_once_with(socket.request.db, 'panda')
+        fetch_ordered_annotations.assert_called_once_with(socket.request.db,
+                                                          ['panda'],
+                                                          load_documents=True)
 
-    def test_it_skips_notification_when_fetch_failed(self, fetch_annotation):
+    def test_it_skips_notification_when_fetch_failed(self, fetch_ordered_annotations):
         """
         When a create/update and a delete event happens in quick succession
         we could fail to load the annotation, even though the event action is
@@ -199,22 +295,23 @@ class TestHandleAnnotationEvent(object):
             'src_client_id': 'pigeon'
         }
         socket = FakeSocket('giraffe')
-        fetch_annotation.return_value = None
+        fetch_ordered_annotations.side_effect = None
+        fetch_ordered_annotations.return_value = []
 
-        assert messages.handle_annotation_event(message, socket) is None
+        assert self.notification_for(message, socket) is None
 
     def test_it_serializes_the_annotation(self,
-                                          fetch_annotation,
+                                          fetch_ordered_annotations,
                                           presenters):
         message = {'action': '_', 'annotation_id': '_', 'src_client_id': '_'}
         socket = FakeSocket('giraffe')
         presenters.AnnotationJSONPresenter.return_value.asdict.return_value = (
             self.serialized_annotation())
 
-        messages.handle_annotation_event(message, socket)
+        self.notification_for(message, socket)
 
         presenters.AnnotationJSONPresenter.assert_called_once_with(
-            socket.request, fetch_annotation.return_value)
+            socket.request, self.fetched['_'])
         assert presenters.AnnotationJSONPresenter.return_value.asdict.called
 
     def test_notification_format(self, presenter_asdict):
@@ -227,10 +324,11 @@ class TestHandleAnnotationEvent(object):
         socket = FakeSocket('giraffe')
         presenter_asdict.return_value = self.serialized_annotation()
 
-        assert messages.handle_annotation_event(message, socket) == {
+        assert self.notification_for(message, socket) == {
             'payload': [self.serialized_annotation()],
             'type': 'annotation-notification',
             'options': {'action': 'update'},
+            'cursor': self.events.cursor(1),
         }
 
     def test_none_for_sender_socket(self, presenter_asdict):
@@ -239,7 +337,7 @@ class TestHandleAnnotationEvent(object):
         socket = FakeSocket('pigeon')
         presenter_asdict.return_value = self.serialized_annotation()
 
-        result = messages.handle_annotation_event(message, socket)
+        result = self.notification_for(message, socket)
         assert result is None
 
     def test_none_if_no_socket_filter(self, presenter_asdict):
@@ -249,7 +347,7 @@ class TestHandleAnnotationEvent(object):
         socket.filter = None
         presenter_asdict.return_value = self.serialized_annotation()
 
-        result = messages.handle_annotation_event(message, socket)
+        result = self.notification_for(message, socket)
         assert result is None
 
     def test_none_if_action_is_read(self, presenter_asdict):
@@ -258,7 +356,7 @@ class TestHandleAnnotationEvent(object):
         socket = FakeSocket('giraffe')
         presenter_asdict.return_value = self.serialized_annotation()
 
-        result = messages.handle_annotation_event(message, socket)
+        result = self.notification_for(message, socket)
         assert result is None
 
     def test_none_if_filter_does_not_match(self, presenter_asdict):
@@ -268,7 +366,7 @@ class TestHandleAnnotationEvent(object):
         socket.filter.match.return_value = False
         presenter_asdict.return_value = self.serialized_annotation()
 
-        result = messages.handle_annotation_event(message, socket)
+        result = self.notification_for(message, socket)
         assert result is None
 
     def test_none_if_annotation_nipsad(self, nipsa_service, presenter_asdict):
@@ -278,7 +376,7 @@ class TestHandleAnnotationEvent(object):
         presenter_asdict.return_value = self.serialized_annotation()
         nipsa_service.is_flagged.return_value = True
 
-        result = messages.handle_annotation_event(message, socket)
+        result = self.notification_for(message, socket)
         assert result is None
 
     def test_sends_nipsad_annotations_to_owners(self, presenter_asdict, pyramid_config):
@@ -289,7 +387,7 @@ class TestHandleAnnotationEvent(object):
 
         presenter_asdict.return_value = self.serialized_annotation({'nipsa': True})
 
-        result = messages.handle_annotation_event(message, socket)
+        result = self.notification_for(message, socket)
         assert result is not None
 
     def test_sends_if_annotation_public(self, presenter_asdict):
@@ -306,7 +404,7 @@ class TestHandleAnnotationEvent(object):
         socket = FakeSocket('giraffe')
         presenter_asdict.return_value = self.serialized_annotation()
 
-        result = messages.handle_annotation_event(message, socket)
+        result = self.notification_for(message, socket)
         assert result is not None
 
     def test_none_if_not_in_group(self, presenter_asdict, pyramid_config):
@@ -317,7 +415,7 @@ class TestHandleAnnotationEvent(object):
         presenter_asdict.return_value = self.serialized_annotation({
             'permissions': {'read': ['group:private-group']}})
 
-        result = messages.handle_annotation_event(message, socket)
+        result = self.notification_for(message, socket)
         assert result is None
 
     def test_sends_if_in_group(self, presenter_asdict, pyramid_config):
@@ -328,14 +426,305 @@ class TestHandleAnnotationEvent(object):
         presenter_asdict.return_value = self.serialized_annotation({
             'permissions': {'read': ['group:private-group']}})
 
-        result = messages.handle_annotation_event(message, socket)
+        result = self.notification_for(message, socket)
         assert result is not None
 
+    def test_fetches_and_presents_the_annotation_once_for_all_sockets(self,
+                                                                     fetch_ordered_annotations,
+                                                                     presenters):
+        message = {'action': 'update', 'annotation_id': 'panda', 'src_client_id': '_'}
+        presenters.AnnotationJSONPresenter.return_value.asdict.return_value = (
+            self.serialized_annotation())
+        sockets = [FakeSocket('giraffe'), FakeSocket('zebra'), FakeSocket('lion')]
+
+        result = self.handle(message, *sockets)
+
+        assert [s for s, _ in result] == sockets
+        assert fetch_ordered_annotations.call_count == 1
+        assert presenters.AnnotationJSONPresenter.call_count == 1
+
+    def test_looks_up_nipsa_status_once_for_all_sockets(self,
+                                                        nipsa_service,
+                                                        presenter_asdict):
+        message = {'action': '_', 'annotation_id': '_', 'src_client_id': '_'}
+        presenter_asdict.return_value = self.serialized_annotation()
+
+        self.handle(message, FakeSocket('giraffe'), FakeSocket('zebra'))
+
+        nipsa_service.is_flagged.assert_called_once_with('fred')
+
+    def test_does_not_fetch_annotation_if_no_sockets_subscribed(self,
+                                                               fetch_ordered_annotations):
+        message = {'action': 'update', 'annotation_id': '_', 'src_client_id': '_'}
+        socket = FakeSocket('giraffe')
+        socket.filter = None
+
+        assert self.notification_for(message, socket) is None
+        assert not fetch_ordered_annotations.called
+
+    def test_only_considers_sockets_whose_subscriptions_might_match(self,
+                                                                    presenter_asdict):
+        message = {'action': 'update', 'annotation_id': '_', 'src_client_id': '_'}
+        presenter_asdict.return_value = self.serialized_annotation({
+            'uri': 'http://example.com'})
+        on_page = FakeSocket('giraffe')
+        elsewhere = FakeSocket('zebra')
+        for socket, uri in [(on_page, 'http://example.com'),
+                            (elsewhere, 'http://example.org')]:
+            self.subscriptions.add(socket, {
+                'match_policy': 'include_all',
+                'clauses': [{'field': '/uri',
+                             'operator': 'one_of',
+                             'value': [uri]}],
+                'actions': {},
+            })
+
+        result = list(messages.handle_annotation_event(message))
+
+        assert [s for s, _ in result] == [on_page]
+        assert elsewhere.filter.match.call_count == 0
+
+    def test_evaluates_shared_filters_once(self, presenter_asdict):
+        message = {'action': 'update', 'annotation_id': '_', 'src_client_id': '_'}
+        presenter_asdict.return_value = self.serialized_annotation()
+        sockets = [FakeSocket('giraffe'), FakeSocket('zebra')]
+        shared_filter = sockets[1].filter = sockets[0].filter
+
+        result = self.handle(message, *sockets)
+
+        assert [s for s, _ in result] == sockets
+        assert shared_filter.match.call_count == 1
+
+    def test_shares_one_notification_between_sockets(self, presenter_asdict):
+        message = {'action': 'update', 'annotation_id': '_', 'src_client_id': '_'}
+        presenter_asdict.return_value = self.serialized_annotation()
+
+        result = self.handle(message, FakeSocket('giraffe'), FakeSocket('zebra'))
+
+        assert result[0][1] is result[1][1]
+
+    def test_delete_notification_payload_contains_only_id(self):
+        message = {
+            'action': 'delete',
+            'annotation_id': 'panda',
+            'src_client_id': '_',
+            'annotation_dict': self.serialized_annotation(),
+        }
+
+        result = self.handle(message, FakeSocket('giraffe'))
+
+        assert result[0][1]['payload'] == [{'id': 'panda'}]
+
+    def test_fetches_all_annotations_in_a_batch_at_once(self,
+                                                        fetch_ordered_annotations,
+                                                        presenter_asdict):
+        payloads = [
+            {'action': 'create', 'annotation_id': 'panda', 'src_client_id': '_'},
+            {'action': 'update', 'annotation_id': 'giraffe', 'src_client_id': '_'},
+            {'action': 'update', 'annotation_id': 'panda', 'src_client_id': '_'},
+        ]
+        presenter_asdict.return_value = self.serialized_annotation()
+        socket = FakeSocket('zebra')
+        self.subscribe(socket)
+
+        result = list(messages.handle_annotation_events(payloads))
+
+        assert fetch_ordered_annotations.call_count == 1
+        ids = fetch_ordered_annotations.call_args[0][1]
+        assert sorted(ids) == ['giraffe', 'panda']
+        assert [r['options']['action'] for _, r in result] == ['create',
+                                                               'update',
+                                                               'update']
+
+    def test_batch_skips_events_whose_annotations_could_not_be_loaded(self,
+                                                                      fetch_ordered_annotations,
+                                                                      presenter_asdict):
+        payloads = [
+            {'action': 'create', 'annotation_id': 'panda', 'src_client_id': '_'},
+            {'action': 'update', 'annotation_id': 'giraffe', 'src_client_id': '_'},
+        ]
+        presenter_asdict.return_value = self.serialized_annotation()
+        fetch_ordered_annotations.side_effect = None
+        fetch_ordered_annotations.return_value = [mock.Mock(id='giraffe')]
+        socket = FakeSocket('zebra')
+        self.subscribe(socket)
+
+        result = list(messages.handle_annotation_events(payloads))
+
+        assert [r['options']['action'] for _, r in result] == ['update']
+
+    def test_handle_annotation_batch_queues_notifications(self, presenter_asdict):
+        batch = messages.AnnotationBatch(payloads=[
+            {'action': 'create', 'annotation_id': 'panda', 'src_client_id': '_'},
+            {'action': 'update', 'annotation_id': 'giraffe', 'src_client_id': '_'},
+        ])
+        presenter_asdict.return_value = self.serialized_annotation()
+        socket = FakeSocket('zebra')
+        self.subscribe(socket)
+
+        messages.handle_annotation_batch(batch)
+
+        assert socket.queue_send.call_count == 2
+
+    def test_logs_events_even_if_no_sockets_subscribed(self):
+        message = {'action': 'update', 'annotation_id': 'panda', 'src_client_id': '_'}
+
+        list(messages.handle_annotation_event(message))
+
+        assert self.events.since(self.events.cursor(0)) == [
+            (self.events.cursor(1), message)]
+
+    def test_does_not_log_read_events(self):
+        message = {'action': 'read', 'annotation_id': 'panda', 'src_client_id': '_'}
+
+        list(messages.handle_annotation_event(message))
+
+        assert self.events.last == 0
+
+    def test_handle_resume_sends_missed_events(self, presenter_asdict):
+        presenter_asdict.return_value = self.serialized_annotation()
+        socket = FakeSocket('giraffe')
+        self.subscribe(socket)
+        for id_ in ['panda', 'giraffe', 'zebra']:
+            self.events.append({'action': 'update',
+                                'annotation_id': id_,
+                                'src_client_id': 'pigeon'})
+
+        messages.handle_resume(socket, self.events.cursor(1))
+
+        sent = [json.loads(c[0][0]) for c in socket.queue_send.call_args_list]
+        assert [n['cursor'] for n in sent] == [self.events.cursor(2),
+                                               self.events.cursor(3)]
+        assert [n['type'] for n in sent] == ['annotation-notification'] * 2
+
+    def test_handle_resume_applies_the_socket_filter(self, presenter_asdict):
+        presenter_asdict.return_value = self.serialized_annotation()
+        socket = FakeSocket('giraffe')
+        socket.filter.match.return_value = False
+        self.events.append({'action': 'update',
+                            'annotation_id': 'panda',
+                            'src_client_id': 'pigeon'})
+
+        messages.handle_resume(socket, self.events.cursor(0))
+
+        assert not socket.queue_send.called
+
+    def test_handle_resume_skips_the_sockets_own_events(self, presenter_asdict):
+        presenter_asdict.return_value = self.serialized_annotation()
+        socket = FakeSocket('giraffe')
+        self.events.append({'action': 'update',
+                            'annotation_id': 'panda',
+                            'src_client_id': 'giraffe'})
+
+        messages.handle_resume(socket, self.events.cursor(0))
+
+        assert not socket.queue_send.called
+
+    def test_handle_resume_sends_nothing_if_up_to_date(self,
+                                                       fetch_ordered_annotations):
+        socket = FakeSocket('giraffe')
+        self.events.append({'action': 'update',
+                            'annotation_id': 'panda',
+                            'src_client_id': 'pigeon'})
+
+        messages.handle_resume(socket, self.events.cursor(1))
+
+        assert not socket.queue_send.called
+        assert not fetch_ordered_annotations.called
+
+    def test_handle_resume_requests_resync_if_cursor_unknown(self):
+        socket = FakeSocket('giraffe')
+
+        messages.handle_resume(socket, 'foo:1')
+
+        socket.queue_send.assert_called_once_with(
+            json.dumps({'type': 'resync-required'}), key=None)
+
+    def test_handle_resume_prepares_each_event_once(self,
+                                                     fetch_ordered_annotations,
+                                                     presenter_asdict):
+        presenter_asdict.return_value = self.serialized_annotation()
+        sockets = [FakeSocket('giraffe'), FakeSocket('zebra')]
+        self.events.append({'action': 'update',
+                            'annotation_id': 'panda',
+                            'src_client_id': 'pigeon'})
+
+        for socket in sockets:
+            messages.handle_resume(socket, self.events.cursor(0))
+
+        assert fetch_ordered_annotations.call_count == 1
+        assert presenter_asdict.call_count == 1
+        for socket in sockets:
+            assert socket.queue_send.call_count == 1
+
+    def test_handle_resume_reuses_events_prepared_for_live_notifications(
+            self, fetch_ordered_annotations, presenter_asdict):
+        presenter_asdict.return_value = self.serialized_annotation()
+        self.subscribe(FakeSocket('zebra'))
+        list(messages.handle_annotation_event({'action': 'update',
+                                               'annotation_id': 'panda',
+                                               'src_client_id': 'pigeon'}))
+        socket = FakeSocket('giraffe')
+
+        messages.handle_resume(socket, self.events.cursor(0))
+
+        assert fetch_ordered_annotations.call_count == 1
+        assert socket.queue_send.call_count == 1
+
+    def test_handle_resume_does_not_prepare_events_for_unsubscribed_sockets(
+            self, fetch_ordered_annotations):
+        socket = FakeSocket('giraffe')
+        socket.filter = None
+        self.events.append({'action': 'update',
+                            'annotation_id': 'panda',
+                            'src_client_id': 'pigeon'})
+
+        messages.handle_resume(socket, self.events.cursor(0))
+
+        assert not fetch_ordered_annotations.called
+        assert not socket.queue_send.called
+
+    def test_handle_resume_requests_resync_if_routing_by_uri(
+            self, fetch_ordered_annotations, pyramid_config):
+        pyramid_config.registry.settings['h.realtime.uri_routing'] = 'true'
+        socket = FakeSocket('giraffe')
+        self.events.append({'action': 'update',
+                            'annotation_id': 'panda',
+                            'src_client_id': 'pigeon'})
+
+        messages.handle_resume(socket, self.events.cursor(0))
+
+        socket.queue_send.assert_called_once_with(
+            json.dumps({'type': 'resync-required'}), key=None)
+        assert not fetch_ordered_annotations.called
+
+    def subscribe(self, socket):
+        self.subscriptions.add(socket, {'match_policy': 'include_all',
+                                        'clauses': [],
+                                        'actions': {}})
+
+    def handle(self, message, *sockets):
+        """Return (socket, notification) pairs for `message` with `sockets`."""
+        for socket in sockets:
+            if socket.filter is not None:
+                self.subscribe(socket)
+        return sorted(messages.handle_annotation_event(message),
+                      key=lambda r: sockets.index(r[0]))
+
+    def notification_for(self, message, socket):
+        """Return the notification `socket` receives for `message`, if any."""
+        result = self.handle(message, socket)
+        if not result:
+            return None
+        assert result == [(socket, result[0][1])]
+        return result[0][1]
+
     def serialized_annotation(self, data=None):
         if data is None:
             data = {}
 
         serialized = {
+            'id': 'panda',
             'user': 'fred',
             'permissions': {'read': ['group:__world__']}
         }
@@ -344,8 +733,24 @@ class TestHandleAnnotationEvent(object):
         return serialized
 
     @pytest.fixture
-    def fetch_annotation(self, patch):
-        return patch('h.streamer.messages.storage.fetch_annotation')
+    def events(self, monkeypatch):
+        self.events = EventLog(size=10)
+        monkeypatch.setattr(catchup, 'EVENTS', self.events)
+        return self.events
+
+    @pytest.fixture
+    def fetch_ordered_annotations(self, patch):
+        self.fetched = {}
+
+        def fetch(session, ids, load_documents=False):
+            for id_ in ids:
+                self.fetched.setdefault(id_, mock.Mock(id=id_))
+            return [self.fetched[id_] for id_ in ids]
+
+        fetch_ordered_annotations = patch(
+            'h.streamer.messages.storage.fetch_ordered_annotations')
+        fetch_ordered_annotations.side_effect = fetch
+        return fetch_ordered_annotations
 
     @pytest.fixture
     def presenters(self, patch):
@@ -355,6 +760,12 @@ class TestHandleAnnotationEvent(object):
     def presenter_asdict(self, patch):
         return patch('h.streamer.messages.presenters.AnnotationJSONPresenter.asdict')
 
+    @pytest.fixture
+    def websocket(self, patch):
+        websocket = patch('h.streamer.websocket.WebSocket')
+        self.subscriptions = websocket.subscriptions = SubscriptionIndex()
+        return websocket
+
     @pytest.fixture
     def nipsa_service(self, pyramid_config):
         service = mock.Mock(spec_set=['is_flagged'])
@@ -362,6 +773,7 @@ class TestHandleAnnotationEvent(object):
         pyramid_config.register_service(service, name='nipsa')
         return service
 
+@pytest.mark.usefixtures('websocket')
 class TestHandleUserEvent(object):
     def test_sends_session_change_when_joining_or_leaving_group(self, pyramid_config):
         pyramid_config.testing_securitypolicy('amy')
@@ -374,12 +786,13 @@ class TestHandleUserEvent(object):
         }
 
         sock = FakeSocket('clientid')
+        self.instances[:] = [sock]
 
-        assert messages.handle_user_event(message, sock) == {
+        assert list(messages.handle_user_event(message)) == [(sock, {
             'type': 'session-change',
             'action': 'group-join',
             'model': session_model,
-        }
+        })]
 
     def test_none_when_socket_is_not_event_users(self, pyramid_config):
         """Don't send session-change events if the event user is not the socket user."""
@@ -391,6 +804,12 @@ class TestHandleUserEvent(object):
         }
 
         sock = FakeSocket('clientid')
+        self.instances[:] = [sock]
 
-        assert messages.handle_user_event(message, sock) is None
+        assert list(messages.handle_user_event(message)) == []
 
+    @pytest.fixture
+    def websocket(self, patch):
+        websocket = patch('h.streamer.websocket.WebSocket')
+        self.instances = websocket.instances = []
+        return websocket
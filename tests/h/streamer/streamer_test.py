@@ -3,6 +3,7 @@
 import mock
 from mock import call
 import pytest
+from gevent.queue import Empty
 
 from h.streamer import messages
 from h.streamer import streamer
@@ -103,6 +104,70 @@ def test_process_work_queue_calls_close_after_rollback(session):
     ]
 
 
+def test_process_work_queue_batches_consecutive_annotation_messages(session,
+                                                                   messages_handle_annotation_batch):
+    queue = FakeQueue([
+        messages.Message(topic='annotation', payload='one'),
+        messages.Message(topic='annotation', payload='two'),
+        messages.Message(topic='user', payload='three'),
+        messages.Message(topic='annotation', payload='four'),
+    ])
+    settings = {'h.streamer.batch_size': '10'}
+
+    streamer.process_work_queue(settings, queue, session_factory=lambda: session)
+
+    messages_handle_annotation_batch.assert_called_once_with(
+        messages.AnnotationBatch(payloads=['one', 'two']))
+    assert [c[0][0].payload for c in messages.handle_message.call_args_list] == [
+        'three', 'four']
+    assert session.commit.call_count == 3
+
+
+def test_process_work_queue_does_not_batch_by_default(session,
+                                                      messages_handle_annotation_batch):
+    queue = FakeQueue([
+        messages.Message(topic='annotation', payload='one'),
+        messages.Message(topic='annotation', payload='two'),
+    ])
+
+    streamer.process_work_queue({}, queue, session_factory=lambda: session)
+
+    assert not messages_handle_annotation_batch.called
+    assert messages.handle_message.call_count == 2
+
+
+def test_process_work_queue_limits_batch_size(session,
+                                              messages_handle_annotation_batch):
+    queue = FakeQueue([
+        messages.Message(topic='annotation', payload=str(i)) for i in range(5)
+    ])
+    settings = {'h.streamer.batch_size': '2'}
+
+    streamer.process_work_queue(settings, queue, session_factory=lambda: session)
+
+    assert messages_handle_annotation_batch.call_args_list == [
+        call(messages.AnnotationBatch(payloads=['0', '1'])),
+        call(messages.AnnotationBatch(payloads=['2', '3'])),
+    ]
+    assert messages.handle_message.call_count == 1
+
+
+class FakeQueue(object):
+    """A work queue which is initially full, and never refilled."""
+
+    def __init__(self, items):
+        self.items = list(items)
+
+    def __iter__(self):
+        while self.items:
+            yield self.items.pop(0)
+
+    def get(self, timeout=None):
+        if not self.items:
+            raise Empty()
+        return self.items.pop(0)
+
+
 @pytest.fixture
 def session():
     return mock.Mock(spec_set=['close', 'commit', 'execute', 'rollback'])
@@ -115,3 +180,8 @@ def websocket_handle_message(patch):
 @pytest.fixture(autouse=True)
 def messages_handle_message(patch):
     return patch('h.streamer.messages.handle_message')
+
+
+@pytest.fixture
+def messages_handle_annotation_batch(patch):
+    return patch('h.streamer.messages.handle_annotation_batch')
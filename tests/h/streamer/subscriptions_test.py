@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+import mock
+import pytest
+
+from h.streamer.subscriptions import SubscriptionIndex
+
+
+class TestSubscriptionIndex(object):
+    def test_candidates_includes_sockets_subscribed_to_the_uri(self, index):
+        socket = mock.Mock()
+        index.add(socket, uri_filter(['http://example.com',
+                                      'http://example.com/alt']))
+
+        assert index.candidates({'uri': 'http://example.com/alt'}) == {socket}
+
+    def test_candidates_excludes_sockets_subscribed_to_other_uris(self, index):
+        socket = mock.Mock()
+        index.add(socket, uri_filter(['http://example.com']))
+
+        assert index.candidates({'uri': 'http://example.org'}) == set()
+
+    def test_candidates_folds_values_like_the_filter(self, index):
+        socket = mock.Mock()
+        index.add(socket, uri_filter([u'http://EXAMPLE.com/café']))
+
+        assert index.candidates({'uri': u'http://example.com/CAFÉ'}) == {socket}
+
+    def test_candidates_excludes_sockets_when_field_missing(self, index):
+        socket = mock.Mock()
+        index.add(socket, uri_filter(['http://example.com']))
+
+        assert index.candidates({'text': 'foo'}) == set()
+
+    def test_candidates_includes_sockets_indexed_on_list_valued_fields(self, index):
+        socket = mock.Mock()
+        index.add(socket, {'match_policy': 'include_all',
+                           'clauses': [{'field': '/tags',
+                                        'operator': 'equals',
+                                        'value': 'foo'}],
+                           'actions': {}})
+
+        assert index.candidates({'tags': ['bar']}) == {socket}
+
+    @pytest.mark.parametrize('filter_json', [
+        # No clauses: matches everything
+        {'match_policy': 'include_all', 'clauses': [], 'actions': {}},
+        # Exclusion policies can't be indexed
+        {'match_policy': 'exclude_any',
+         'clauses': [{'field': '/uri', 'operator': 'one_of', 'value': ['a']}],
+         'actions': {}},
+        # "one_of" with a single value is a substring test
+        {'match_policy': 'include_all',
+         'clauses': [{'field': '/uri', 'operator': 'one_of', 'value': 'a'}],
+         'actions': {}},
+        # Non-equality operators can't be indexed
+        {'match_policy': 'include_all',
+         'clauses': [{'field': '/text', 'operator': 'matches', 'value': 'a'}],
+         'actions': {}},
+        # Multi-field clauses can't be indexed
+        {'match_policy': 'include_all',
+         'clauses': [{'field': ['/uri', '/text'], 'operator': 'equals', 'value': 'a'}],
+         'actions': {}},
+        # "include_any" can only be indexed if all clauses can be
+        {'match_policy': 'include_any',
+         'clauses': [{'field': '/uri', 'operator': 'one_of', 'value': ['a']},
+                     {'field': '/text', 'operator': 'matches', 'value': 'b'}],
+         'actions': {}},
+    ])
+    def test_candidates_always_includes_unindexable_filters(self, index, filter_json):
+        socket = mock.Mock()
+        index.add(socket, filter_json)
+
+        assert index.candidates({'uri': 'http://example.org'}) == {socket}
+
+    def test_include_all_filters_are_indexed_on_the_uri_clause(self, index):
+        socket = mock.Mock()
+        index.add(socket, {'match_policy': 'include_all',
+                           'clauses': [{'field': '/user',
+                                        'operator': 'equals',
+                                        'value': 'acct:bob@example.com'},
+                                       {'field': '/uri',
+                                        'operator': 'one_of',
+                                        'value': ['http://example.com']}],
+                           'actions': {}})
+
+        assert index.candidates({'uri': 'http://example.org',
+                                 'user': 'acct:bob@example.com'}) == set()
+        assert index.candidates({'uri': 'http://example.com',
+                                 'user': 'acct:bob@example.com'}) == {socket}
+
+    def test_include_any_filters_are_indexed_on_every_clause(self, index):
+        socket = mock.Mock()
+        index.add(socket, {'match_policy': 'include_any',
+                           'clauses': [{'field': '/user',
+                                        'operator': 'equals',
+                                        'value': 'acct:bob@example.com'},
+                                       {'field': '/uri',
+                                        'operator': 'one_of',
+                                        'value': ['http://example.com']}],
+                           'actions': {}})
+
+        assert index.candidates({'uri': 'http://example.org',
+                                 'user': 'acct:bob@example.com'}) == {socket}
+        assert index.candidates({'uri': 'http://example.com',
+                                 'user': 'acct:amy@example.com'}) == {socket}
+        assert index.candidates({'uri': 'http://example.org',
+                                 'user': 'acct:amy@example.com'}) == set()
+
+    def test_add_replaces_previous_registration(self, index):
+        socket = mock.Mock()
+        index.add(socket, uri_filter(['http://example.com']))
+        index.add(socket, uri_filter(['http://example.org']))
+
+        assert index.candidates({'uri': 'http://example.com'}) == set()
+        assert index.candidates({'uri': 'http://example.org'}) == {socket}
+        assert len(index) == 1
+
+    def test_remove_unregisters_socket(self, index):
+        socket = mock.Mock()
+        index.add(socket, uri_filter(['http://example.com']))
+
+        index.remove(socket)
+
+        assert index.candidates({'uri': 'http://example.com'}) == set()
+        assert len(index) == 0
+
+    def test_remove_does_not_raise_for_unknown_socket(self, index):
+        index.remove(mock.Mock())
+
+    def test_iterates_over_registered_sockets(self, index):
+        sockets = [mock.Mock(), mock.Mock()]
+        for socket in sockets:
+            index.add(socket, uri_filter(['http://example.com']))
+
+        assert set(index) == set(sockets)
+
+    def test_uris_returns_the_folded_subscribed_uris(self, index):
+        sockets = [mock.Mock(), mock.Mock()]
+        index.add(sockets[0], uri_filter([u'http://Example.com/café']))
+        index.add(sockets[1], uri_filter(['http://example.org']))
+
+        assert index.uris() == {u'http://example.com/cafe',
+                                u'http://example.org'}
+
+    def test_uris_forgets_unsubscribed_uris(self, index):
+        sockets = [mock.Mock(), mock.Mock()]
+        index.add(sockets[0], uri_filter(['http://example.com']))
+        index.add(sockets[1], uri_filter(['http://example.org']))
+
+        index.remove(sockets[1])
+
+        assert index.uris() == {'http://example.com'}
+
+    def test_uris_returns_none_if_a_filter_is_not_indexed(self, index):
+        socket = mock.Mock()
+        index.add(socket, {'match_policy': 'include_any',
+                           'clauses': [],
+                           'actions': {}})
+
+        assert index.uris() is None
+
+    def test_uris_returns_none_if_a_filter_is_indexed_on_another_field(self, index):
+        sockets = [mock.Mock(), mock.Mock()]
+        index.add(sockets[0], uri_filter(['http://example.com']))
+        index.add(sockets[1], {'match_policy': 'include_all',
+                               'clauses': [{'field': '/user',
+                                            'operator': 'equals',
+                                            'value': 'acct:bob@example.com'}],
+                               'actions': {}})
+
+        assert index.uris() is None
+
+    @pytest.fixture
+    def index(self):
+        return SubscriptionIndex()
+
+
+def uri_filter(uris):
+    return {
+        'match_policy': 'include_all',
+        'clauses': [{'field': '/uri', 'operator': 'one_of', 'value': uris}],
+        'actions': {'create': True, 'update': True, 'delete': True},
+    }
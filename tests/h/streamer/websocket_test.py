@@ -3,8 +3,11 @@
 from collections import namedtuple
 import json
 
+import gevent
+from gevent import socket
 from gevent.queue import Queue
 import mock
+import pytest
 
 from h.streamer import websocket
 
@@ -72,6 +75,19 @@ def test_handle_message_sets_socket_client_id_for_client_id_messages():
     assert socket.client_id == 'abcd1234'
 
 
+@mock.patch('h.streamer.messages.handle_resume')
+def test_handle_message_resumes_for_resume_from_messages(handle_resume):
+    socket = mock.Mock()
+    message = websocket.Message(socket=socket, payload=json.dumps({
+        'messageType': 'resume_from',
+        'value': 'abcd:1234',
+    }))
+
+    websocket.handle_message(message)
+
+    handle_resume.assert_called_once_with(socket, 'abcd:1234')
+
+
 @mock.patch('h.api.storage.expand_uri')
 def test_handle_message_sets_socket_filter_for_filter_messages(expand_uri):
     expand_uri.return_value = ['http://example.com']
@@ -121,3 +137,266 @@ def test_handle_message_expands_uris_in_uri_filter(expand_uri):
     assert 'http://example.com' in uri_values
     assert 'http://example.com/alter' in uri_values
     assert 'http://example.com/print' in uri_values
+
+
+@mock.patch('h.api.storage.expand_uri')
+def test_handle_message_adds_socket_to_subscriptions_for_filter_messages(expand_uri):
+    expand_uri.return_value = ['http://example.com']
+    socket = mock.Mock()
+    socket.filter = None
+    message = websocket.Message(socket=socket, payload=json.dumps({
+        'filter': {
+            'actions': {},
+            'match_policy': 'include_all',
+            'clauses': [{
+                'field': '/uri',
+                'operator': 'one_of',
+                'value': 'http://example.com',
+            }],
+        }
+    }))
+
+    websocket.handle_message(message)
+
+    candidates = websocket.WebSocket.subscriptions.candidates(
+        {'uri': 'http://example.com'})
+    assert socket in candidates
+
+
+def test_websocket_removes_self_from_subscriptions_when_closed():
+    socket = mock.Mock()
+    client = websocket.WebSocket(socket)
+    websocket.WebSocket.subscriptions.add(client, {
+        'actions': {},
+        'match_policy': 'include_all',
+        'clauses': [],
+    })
+
+    client.closed(1000)
+
+    assert client not in set(websocket.WebSocket.subscriptions)
+
+
+@mock.patch('h.api.storage.expand_uri')
+def test_handle_message_shares_filters_between_sockets_with_identical_filters(expand_uri):
+    expand_uri.return_value = ['http://example.com', 'http://example.com/alt']
+    sockets = [mock.Mock(), mock.Mock()]
+    for socket in sockets:
+        message = websocket.Message(socket=socket, payload=json.dumps({
+            'filter': {
+                'actions': {},
+                'match_policy': 'include_all',
+                'clauses': [{
+                    'field': '/uri',
+                    'operator': 'one_of',
+                    'value': 'http://example.com',
+                }],
+            }
+        }))
+        websocket.handle_message(message)
+
+    assert sockets[0].filter is sockets[1].filter
+
+
+@mock.patch('h.api.storage.expand_uri')
+def test_handle_message_does_not_share_filters_between_sockets_with_different_filters(expand_uri):
+    expand_uri.side_effect = lambda _, uri: [uri]
+    sockets = [mock.Mock(), mock.Mock()]
+    for socket, uri in zip(sockets, ['http://example.com', 'http://example.org']):
+        message = websocket.Message(socket=socket, payload=json.dumps({
+            'filter': {
+                'actions': {},
+                'match_policy': 'include_all',
+                'clauses': [{
+                    'field': '/uri',
+                    'operator': 'one_of',
+                    'value': uri,
+                }],
+            }
+        }))
+        websocket.handle_message(message)
+
+    assert sockets[0].filter is not sockets[1].filter
+
+
+class TestQueueSend(object):
+    def test_sends_queued_messages_in_order(self, client):
+        client.queue_send('first')
+        client.queue_send('second')
+        client._writer.join()
+
+        assert client.send.mock_calls == [mock.call('first'),
+                                          mock.call('second')]
+        assert len(client.outbox) == 0
+
+    def test_does_not_send_immediately(self, client):
+        client.queue_send('first')
+
+        assert not client.send.called
+
+    def test_does_not_queue_for_terminated_sockets(self, client):
+        client.client_terminated = client.server_terminated = True
+
+        client.queue_send('first')
+
+        assert len(client.outbox) == 0
+
+    def test_drop_oldest_discards_oldest_messages_when_full(self, client):
+        client.outbox_size = 2
+
+        for data in ['first', 'second', 'third']:
+            client.queue_send(data)
+
+        assert [d for _, d in client.outbox] == ['second', 'third']
+        assert client.evicted == 1
+
+    def test_coalesce_discards_superseded_messages_when_full(self, client):
+        client.outbox_size = 2
+        client.slow_consumer_policy = 'coalesce'
+
+        client.queue_send('first', key='a')
+        client.queue_send('second', key='b')
+        client.queue_send('third', key='a')
+
+        assert [d for _, d in client.outbox] == ['second', 'third']
+        assert client.evicted == 1
+
+    def test_coalesce_falls_back_to_discarding_oldest(self, client):
+        client.outbox_size = 2
+        client.slow_consumer_policy = 'coalesce'
+
+        client.queue_send('first', key='a')
+        client.queue_send('second', key='b')
+        client.queue_send('third', key='c')
+
+        assert [d for _, d in client.outbox] == ['second', 'third']
+
+    def test_disconnect_closes_socket_when_full(self, client, gevent):
+        client.outbox_size = 2
+        client.slow_consumer_policy = 'disconnect'
+        client.slow_consumer_close_code = 4000
+
+        for data in ['first', 'second', 'third']:
+            client.queue_send(data)
+
+        assert len(client.outbox) == 0
+        assert client.evicted == 2
+        gevent.spawn.assert_any_call(client._disconnect, 4000, mock.ANY)
+
+    def test_disconnect_stops_queueing_and_counts_once(self, client, gevent):
+        websocket.WebSocket.slow_disconnects = 0
+        client.outbox_size = 1
+        client.slow_consumer_policy = 'disconnect'
+
+        for data in ['first', 'second', 'third', 'fourth']:
+            client.queue_send(data)
+
+        assert len(client.outbox) == 0
+        assert websocket.WebSocket.slow_disconnects == 1
+
+    def test_does_not_queue_after_close(self, client):
+        client.server_terminated = True
+
+        client.queue_send('first')
+
+        assert len(client.outbox) == 0
+
+    def test_disconnect_drops_a_client_which_blocks_sending(self):
+        server, peer = socket.socketpair()
+        client = websocket.WebSocket(server)
+        client.outbox_size = 1
+        client.slow_consumer_policy = 'disconnect'
+        message = 'x' * (4 * 1024 * 1024)
+
+        # The peer never reads, so the writer blocks sending the first message.
+        client.queue_send(message)
+        gevent.sleep(0.1)
+        assert client._writer is not None
+        client.queue_send(message)
+        client.queue_send(message)
+        gevent.sleep(websocket.SLOW_CONSUMER_CLOSE_TIMEOUT + 0.5)
+
+        assert client._writer is None
+        assert client.sock is None
+        assert _read_until_closed(peer, timeout=5)
+
+    def test_disconnect_sends_a_close_frame_if_not_sending(self, client):
+        client.slow_consumer_close_code = 4000
+        client.close = mock.Mock()
+        client.close_connection = mock.Mock()
+
+        client._disconnect(4000, 'Too slow')
+
+        client.close.assert_called_once_with(4000, 'Too slow')
+        client.close_connection.assert_called_once_with()
+
+    def test_counts_evictions_for_all_sockets(self, client):
+        websocket.WebSocket.evictions = 0
+        client.outbox_size = 1
+
+        for data in ['first', 'second', 'third']:
+            client.queue_send(data)
+
+        assert websocket.WebSocket.evictions == 2
+
+    def test_stops_sending_when_send_fails(self, client):
+        client.send.side_effect = RuntimeError('Cannot send')
+        client.queue_send('first')
+        client.queue_send('second')
+        client._writer.join()
+
+        assert client.send.call_count == 1
+        assert len(client.outbox) == 0
+        assert client._writer is None
+
+    @pytest.fixture
+    def client(self):
+        client = websocket.WebSocket(mock.Mock())
+        client.send = mock.Mock()
+        return client
+
+    @pytest.fixture
+    def gevent(self, patch):
+        return patch('h.streamer.websocket.gevent')
+
+
+def _read_until_closed(sock, timeout):
+    """Read from `sock` until it is closed. Return False if it isn't."""
+    with gevent.Timeout(timeout, False):
+        while sock.recv(65536):
+            pass
+        return True
+    return False
+
+
+class TestIncludeme(object):
+    def test_configures_outbox_from_settings(self, pyramid_config, restore_websocket):
+        pyramid_config.registry.settings.update({
+            'h.streamer.outbox_size': '10',
+            'h.streamer.slow_consumer_policy': 'disconnect',
+            'h.streamer.slow_consumer_close_code': '4000',
+        })
+
+        websocket.includeme(pyramid_config)
+
+        assert websocket.WebSocket.outbox_size == 10
+        assert websocket.WebSocket.slow_consumer_policy == 'disconnect'
+        assert websocket.WebSocket.slow_consumer_close_code == 4000
+
+    def test_rejects_unknown_slow_consumer_policy(self, pyramid_config, restore_websocket):
+        pyramid_config.registry.settings.update({
+            'h.streamer.slow_consumer_policy': 'ignore',
+        })
+
+        with pytest.raises(ValueError):
+            websocket.includeme(pyramid_config)
+
+    @pytest.fixture
+    def restore_websocket(self, request):
+        attrs = ['outbox_size', 'slow_consumer_policy', 'slow_consumer_close_code']
+        saved = {a: getattr(websocket.WebSocket, a) for a in attrs}
+
+        def restore():
+            for a, v in saved.items():
+                setattr(websocket.WebSocket, a, v)
+        request.addfinalizer(restore)
@@ -18,38 +18,94 @@ class FakeMailer(object):
 
 class TestPublishAnnotationEvent:
 
-    def test_it_publishes_the_realtime_event(self, event):
+    def test_it_publishes_the_realtime_event(self, event, fetch_annotation):
         event.request.headers = {'X-Client-Id': 'client_id'}
 
         subscribers.publish_annotation_event(event)
 
+        fetch_annotation.assert_called_once_with(event.request.db,
+                                                 'test_annotation_id')
         event.request.realtime.publish_annotation.assert_called_once_with({
             'action': event.action,
             'annotation_id': event.annotation_id,
-            'src_client_id': 'client_id'
+            'src_client_id': 'client_id',
+            'uri': fetch_annotation.return_value.target_uri,
         })
 
-    def test_it_adds_annotation_dict_to_realtime_event(self, event):
-        annotation_dict = mock.Mock()
-        type(event).annotation_dict = mock.PropertyMock(return_value=annotation_dict)
+    def test_it_adds_annotation_dict_to_realtime_event(self,
+                                                      event,
+                                                      fetch_annotation):
+        annotation_dict = {'uri': 'http://example.com', 'group': '__world__'}
+        event.annotation_dict = annotation_dict
         event.request.headers = {'X-Client-Id': 'client_id'}
 
         subscribers.publish_annotation_event(event)
 
+        assert not fetch_annotation.called
         event.request.realtime.publish_annotation.assert_called_once_with({
             'action': event.action,
             'annotation_id': event.annotation_id,
             'src_client_id': 'client_id',
-            'annotation_dict': annotation_dict
+            'annotation_dict': annotation_dict,
+            'uri': 'http://example.com',
         })
 
+    def test_it_publishes_a_null_uri_if_annotation_missing(
+            self, event, fetch_annotation):
+        fetch_annotation.return_value = None
+
+        subscribers.publish_annotation_event(event)
+
+        data = event.request.realtime.publish_annotation.call_args[0][0]
+        assert data['uri'] is None
+
+    def test_it_routes_by_uri_if_enabled(self, event, fetch_annotation):
+        event.request.registry.settings['h.realtime.uri_routing'] = True
+        event.request.headers = {'X-Client-Id': 'client_id'}
+        annotation = fetch_annotation.return_value
+
+        subscribers.publish_annotation_event(event)
+
+        fetch_annotation.assert_called_once_with(event.request.db,
+                                                 'test_annotation_id')
+        event.request.realtime.publish_annotation.assert_called_once_with(
+            mock.ANY, uri=annotation.target_uri, group=annotation.groupid)
+
+    def test_it_routes_deletes_by_the_annotation_dict_uri(self,
+                                                         event,
+                                                         fetch_annotation):
+        event.request.registry.settings['h.realtime.uri_routing'] = True
+        annotation_dict = {'uri': 'http://example.com', 'group': '__world__'}
+        event.annotation_dict = annotation_dict
+
+        subscribers.publish_annotation_event(event)
+
+        assert not fetch_annotation.called
+        event.request.realtime.publish_annotation.assert_called_once_with(
+            mock.ANY, uri='http://example.com', group='__world__')
+
+    def test_it_publishes_without_uri_if_annotation_missing(self,
+                                                           event,
+                                                           fetch_annotation):
+        event.request.registry.settings['h.realtime.uri_routing'] = True
+        fetch_annotation.return_value = None
+
+        subscribers.publish_annotation_event(event)
+
+        event.request.realtime.publish_annotation.assert_called_once_with(
+            mock.ANY, uri=None, group=None)
+
+    @pytest.fixture
+    def fetch_annotation(self, patch):
+        return patch('h.subscribers.storage.fetch_annotation')
+
     @pytest.fixture
     def event(self, pyramid_request):
         pyramid_request.realtime = mock.Mock()
         event = AnnotationEvent(pyramid_request,
                                 'test_annotation_id',
                                 'create')
-        type(event).annotation_dict = mock.PropertyMock(return_value=None)
+        event.annotation_dict = None
         return event
 
 